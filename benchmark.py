@@ -0,0 +1,499 @@
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import selectors
+import socket
+import time
+from typing import Callable, List, Optional, Tuple
+
+import protocol
+from lossy_proxy import LossyProxy
+from metrics import percentile
+from server import Connection, Game, Food, Server, ThreadedServer, create_game
+
+TICK_SIZES = [(10, 75), (50, 1000), (200, 5000), (500, 20000)]
+
+def make_game(players: int, food: int, engine: str = "python", seed: int = 1, regions: Optional[int] = None):
+    random.seed(seed)
+    # Grow the map with the pellet count so density matches the default 75 pellets on 1080x720
+    scale = max(1.0, (food / 75) ** 0.5)
+    game = create_game(engine, int(1080 * scale), int(720 * scale), food, regions, seed=seed)
+    for pid in range(players):
+        game.add_player(pid, f"bot{pid}")
+    game.bench_players = players
+    return game
+
+def steer(game) -> None:
+    for pid in range(game.bench_players):
+        game.set_input(pid, random.uniform(0, game.width), random.uniform(0, game.height))
+
+def legacy_check_eat(game: Game) -> None:
+    # Baseline algorithm: all player pairs, then a linear food scan with list.remove and a fresh Food
+    players_list = list(game.players.values())
+    for p1 in players_list:
+        for p2 in players_list:
+            if p1 == p2:
+                continue
+            if p1.size > p2.size:
+                dist = ((p1.x - p2.x)**2 + (p1.y - p2.y)**2)**0.5
+                if dist < p1.size:
+                    p1.size += p2.size * 0.5
+                    p1.score += int(p2.score / 2)
+                    p2.size = 20
+                    p2.score = 0
+                    p2.x = random.randint(0, game.width - p2.size)
+                    p2.y = random.randint(0, game.height - p2.size)
+        for food in game.food[:]:
+            dist = ((p1.x - food.x)**2 + (p1.y - food.y)**2)**0.5
+            if dist < (p1.size + food.size):
+                p1.size += food.size
+                p1.score += food.size
+                game.food.remove(food)
+                game.food.append(Food(game.width, game.height))
+
+def legacy_tick(game: Game, dt: float) -> None:
+    game.move_players(dt)
+    legacy_check_eat(game)
+    game.decay(dt)
+
+def time_ticks(game: Game, tick, ticks: int) -> float:
+    total = 0.0
+    for _ in range(ticks):
+        steer(game)
+        start = time.perf_counter()
+        tick(game, 1 / 60)
+        total += time.perf_counter() - start
+    return total / ticks * 1000
+
+def bench_tick(sizes: List[Tuple[int, int]], ticks: int, legacy_ticks: int, regions: Optional[int]) -> None:
+    try:
+        import numpy  # noqa: F401
+        engines = ["python", "numpy"]
+    except ImportError:
+        engines = ["python"]
+    if regions:
+        # Wall-clock time per tick, so the regions column only beats python with a free core per region
+        engines.append("regions")
+    header = f"{'players':>8} {'food':>8} {'legacy ms':>10}" + "".join(f" {engine + ' ms':>10}" for engine in engines)
+    print(header)
+    for players, food in sizes:
+        legacy_ms = time_ticks(make_game(players, food), legacy_tick, legacy_ticks)
+        row = f"{players:>8} {food:>8} {legacy_ms:>10.3f}"
+        for engine in engines:
+            engine_ms = time_ticks(make_game(players, food, engine, regions=regions), lambda g, dt: g.tick(dt), ticks)
+            row += f" {engine_ms:>10.3f}"
+        print(row)
+
+PROTOCOL_SIZES = [(5, 75), (50, 1000), (200, 5000)]
+
+def per_call_us(fn: Callable[[], object], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def bench_protocol(sizes: List[Tuple[int, int]], repeat: int) -> None:
+    print(f"{'players':>8} {'food':>8} {'format':>8} {'bytes':>9} {'encode us':>10} {'decode us':>10}")
+    for players, food in sizes:
+        game = make_game(players, food)
+        for _ in range(5):
+            steer(game)
+            game.tick(1 / 60)
+        state = game.get_state()
+
+        # Previous format: one pickled (MSG_UPDATE, state) tuple per send, no framing
+        blob = pickle.dumps((1, state))
+        encode_us = per_call_us(lambda: pickle.dumps((1, state)), repeat)
+        decode_us = per_call_us(lambda: pickle.loads(blob), repeat)
+        print(f"{players:>8} {food:>8} {'pickle':>8} {len(blob):>9} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+        data = protocol.encode_state(state)
+        decoder = protocol.FrameDecoder()
+        encode_us = per_call_us(lambda: protocol.encode_state(state), repeat)
+        decode_us = per_call_us(lambda: protocol.decode_state(decoder.feed(data)[0][1]), repeat)
+        print(f"{players:>8} {food:>8} {'binary':>8} {len(data):>9} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+    blob = pickle.dumps((1, (512.0, 384.0)))
+    data = protocol.encode_input(512.0, 384.0)
+    print(f"input message: pickle {len(blob)} bytes, binary {len(data)} bytes")
+
+DELTA_SIZES = [(10, 75), (50, 1000), (200, 5000)]
+
+def bench_delta(sizes: List[Tuple[int, int]], ticks: int, ack_lag: int) -> None:
+    # Per-client egress when every tick is sent: full keyframes vs. deltas against a snapshot
+    # acked ack_lag ticks ago (the round trip, in ticks)
+    print(f"{'players':>8} {'food':>8} {'keyframe B':>11} {'delta B':>8} {'keyframe KB/s':>14} {'delta KB/s':>11} {'ratio':>6}")
+    for players, food in sizes:
+        game = make_game(players, food)
+        history = []
+        key_bytes = delta_bytes = 0
+        for tick in range(ticks + ack_lag):
+            steer(game)
+            game.tick(1 / 60)
+            history.append(game.get_state())
+            if tick >= ack_lag:
+                key_bytes += len(protocol.encode_state(history[-1]))
+                delta_bytes += len(protocol.encode_delta(history[-1 - ack_lag], history[-1]))
+        key_avg, delta_avg = key_bytes / ticks, delta_bytes / ticks
+        print(f"{players:>8} {food:>8} {key_avg:>11.0f} {delta_avg:>8.0f} {key_avg * 60 / 1024:>14.1f} "
+              f"{delta_avg * 60 / 1024:>11.1f} {key_avg / delta_avg:>5.1f}x")
+
+FANOUT_CLIENTS = [10, 100, 300]
+
+def tuple_view(view, snapshot) -> dict:
+    # The same view with plain state tuples, as the per-client encoder consumed it
+    return {
+        'seq': view['seq'],
+        'players': {pid: snapshot['players'][pid] for pid in view['players']},
+        'food': {fid: snapshot['food'][fid] for fid in view['food']},
+        'time_left': view['time_left']
+    }
+
+def bench_fanout(counts: List[int], food: int, ticks: int, ack_lag: int) -> None:
+    # Server CPU per tick to build every client's frame: records packed once per tick and shared vs.
+    # encoding each client's view from scratch. One player per client, acks lag by ack_lag ticks.
+    print(f"{'clients':>8} {'pack ms/tick':>13} {'shared ms/tick':>15} {'per-client ms/tick':>19}")
+    for count in counts:
+        server = Server("127.0.0.1", 0)
+        server.game = make_game(count, food)
+        conns = []
+        for pid in range(count):
+            conn = Connection(None, ("bench", pid))
+            conn.pid = pid
+            conns.append(conn)
+        history = {}
+        pack = shared = separate = 0.0
+        for tick in range(ticks + ack_lag):
+            steer(server.game)
+            server.game.tick(1 / 60)
+            start = time.perf_counter()
+            server.publish_snapshot()
+            packed = time.perf_counter()
+            snapshot = server.latest_snapshot
+            views = [server.build_view(conn.pid, conn.zoom) for conn in conns]
+            tuples = [tuple_view(view, snapshot) for view in views]
+            viewed = time.perf_counter()
+            for conn, view in zip(conns, views):
+                baseline = conn.views.get(view['seq'] - ack_lag)
+                conn.views[view['seq']] = view
+                server.keyframe_parts(view) if baseline is None else server.delta_parts(baseline, view)
+            framed = time.perf_counter()
+            for conn, view in zip(conns, tuples):
+                baseline = history.get((conn.pid, view['seq'] - ack_lag))
+                history[conn.pid, view['seq']] = view
+                protocol.encode_state(view) if baseline is None else protocol.encode_delta(baseline, view)
+            encoded = time.perf_counter()
+            if tick >= ack_lag:
+                pack += packed - start
+                shared += framed - viewed
+                separate += encoded - framed
+        print(f"{count:>8} {pack / ticks * 1000:>13.2f} {shared / ticks * 1000:>15.2f} {separate / ticks * 1000:>19.2f}")
+        server.socket.close()
+
+FRONTENDS = {"selectors": Server, "threaded": ThreadedServer}
+
+def serve(frontend: str, port: int, udp: bool = False, backlog: int = socket.SOMAXCONN) -> None:
+    logging.disable(logging.CRITICAL)
+    FRONTENDS[frontend]("127.0.0.1", port, udp=udp, backlog=backlog).run()
+
+def process_cpu_seconds(pid: int) -> float:
+    # utime + stime of a process from /proc (Linux)
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+class Bot:
+    # Bare protocol client: steers in a circle around its own spot and acks whatever snapshot arrived last.
+    # With udp=True it switches input to UDP once WELCOME hands out a token.
+    def __init__(self, host: str, port: int, name: str, udp: bool = False):
+        self.sock = socket.create_connection((host, port))
+        self.sock.sendall(protocol.encode_hello(name))
+        self.decoder = protocol.FrameDecoder()
+        self.pid = None
+        self.token = 0
+        self.input_seq = 0
+        self.udp = None
+        if udp:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.connect((host, port))
+            self.udp.setblocking(False)
+        self.acked = 0
+        self.snapshots = 0
+        self.bytes_in = 0
+        # Arrival time of every snapshot newer than the last one applied
+        self.arrivals: List[float] = []
+        self.centre = (random.uniform(150, 930), random.uniform(150, 570))
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.sock.setblocking(False)
+
+    def send_input(self, now: float) -> None:
+        mx = self.centre[0] + 100 * math.cos(now + self.phase)
+        my = self.centre[1] + 100 * math.sin(now + self.phase)
+        self.input_seq += 1
+        try:
+            if self.udp is not None and self.token:
+                self.udp.send(protocol.encode_udp_input(self.token, self.input_seq, mx, my, self.acked))
+            else:
+                self.sock.send(protocol.encode_input(mx, my, self.acked, self.input_seq))
+        except OSError:
+            pass
+
+    def on_frame(self, msg_type: int, payload: bytes) -> None:
+        if msg_type == protocol.MSG_WELCOME:
+            self.pid, self.token, _ = protocol.decode_welcome(payload)
+        elif msg_type in (protocol.MSG_STATE, protocol.MSG_DELTA):
+            seq = protocol.snapshot_seq(payload)
+            if seq > self.acked:
+                self.acked = seq
+                self.snapshots += 1
+                self.arrivals.append(time.monotonic())
+
+    def on_readable(self) -> None:
+        data = self.sock.recv(65536)
+        self.bytes_in += len(data)
+        for msg_type, payload in self.decoder.feed(data):
+            self.on_frame(msg_type, payload)
+
+    def on_datagram(self) -> None:
+        try:
+            data = self.udp.recv(65536)
+        except OSError:
+            return
+        self.bytes_in += len(data)
+        self.on_frame(*protocol.decode_datagram(data))
+
+    def register(self, selector: selectors.BaseSelector) -> None:
+        selector.register(self.sock, selectors.EVENT_READ, self.on_readable)
+        if self.udp is not None:
+            selector.register(self.udp, selectors.EVENT_READ, self.on_datagram)
+
+    def close(self) -> None:
+        self.sock.close()
+        if self.udp is not None:
+            self.udp.close()
+
+def drive_bots(bots: List[Bot], duration: float, input_rate: float) -> float:
+    # Let every handshake finish, then steer all bots at input_rate for duration seconds and return the
+    # measured time; bot counters only cover the measured part
+    selector = selectors.DefaultSelector()
+    for bot in bots:
+        bot.register(selector)
+    warmup_end = time.monotonic() + 1.0
+    while time.monotonic() < warmup_end:
+        for key, _ in selector.select(0.05):
+            key.data()
+    for bot in bots:
+        bot.snapshots = 0
+        bot.arrivals = []
+    start = time.monotonic()
+    next_input = start
+    while time.monotonic() - start < duration:
+        now = time.monotonic()
+        if now >= next_input:
+            for bot in bots:
+                bot.send_input(now)
+            next_input += 1 / input_rate
+        for key, _ in selector.select(max(0.0, next_input - time.monotonic())):
+            key.data()
+    selector.close()
+    return time.monotonic() - start
+
+def run_proxy(listen_port: int, target_port: int, loss: float, delay: float, jitter: float) -> None:
+    logging.disable(logging.CRITICAL)
+    LossyProxy(listen_port, "127.0.0.1", target_port, loss=loss, delay=delay, jitter=jitter, seed=1).run()
+
+def bench_transport(losses: List[float], clients: int, duration: float, delay: float, jitter: float,
+                    input_rate: float, port: int) -> None:
+    # Gaps between consecutive new snapshots at the client behind a lossy proxy: with TCP a lost segment
+    # stalls everything behind it for a retransmission timeout, with UDP only the lost datagram is missed
+    print(f"{'loss %':>7} {'transport':>10} {'snapshots/s':>12} {'gap p50 ms':>11} {'gap p99 ms':>11} {'gap max ms':>11}")
+    for loss in losses:
+        for transport in ("tcp", "udp"):
+            server = multiprocessing.Process(target=serve, args=("selectors", port, True), daemon=True)
+            proxy = multiprocessing.Process(target=run_proxy, args=(port + 1, port, loss, delay, jitter), daemon=True)
+            server.start()
+            proxy.start()
+            time.sleep(0.5)
+            bots = [Bot("127.0.0.1", port + 1, f"bot{i}", udp=transport == "udp") for i in range(clients)]
+            elapsed = drive_bots(bots, duration, input_rate)
+            gaps = [(b - a) * 1000 for bot in bots for a, b in zip(bot.arrivals, bot.arrivals[1:])]
+            rate = sum(bot.snapshots for bot in bots) / len(bots) / elapsed
+            print(f"{loss * 100:>7.1f} {transport:>10} {rate:>12.1f} {percentile(gaps, 0.5):>11.1f} "
+                  f"{percentile(gaps, 0.99):>11.1f} {max(gaps, default=0.0):>11.1f}")
+            for bot in bots:
+                bot.close()
+            proxy.terminate()
+            server.terminate()
+            proxy.join()
+            server.join()
+            port += 2
+
+def bench_connections(counts: List[int], duration: float, input_rate: float, port: int) -> None:
+    print(f"{'frontend':>10} {'clients':>8} {'server CPU %':>13} {'snapshots/s/client':>19}")
+    for frontend in FRONTENDS:
+        for count in counts:
+            server = multiprocessing.Process(target=serve, args=(frontend, port), daemon=True)
+            server.start()
+            time.sleep(0.5)
+            bots = [Bot("127.0.0.1", port, f"bot{i}") for i in range(count)]
+            cpu_start = process_cpu_seconds(server.pid)
+            elapsed = drive_bots(bots, duration, input_rate)
+            cpu = (process_cpu_seconds(server.pid) - cpu_start) / elapsed * 100
+            rate = sum(bot.snapshots for bot in bots) / len(bots) / elapsed
+            print(f"{frontend:>10} {count:>8} {cpu:>13.1f} {rate:>19.1f}")
+            for bot in bots:
+                bot.close()
+            server.terminate()
+            server.join()
+            port += 1
+
+def burst_join(port: int, count: int, timeout: float) -> Tuple[List[float], List[float], int]:
+    # Starts count connects at once and returns, for every player that got in, seconds from the burst to its
+    # WELCOME and to its first snapshot, plus how many failed or got no snapshot within timeout. Joined
+    # players stay connected until the end, as they would in a real match.
+    selector = selectors.DefaultSelector()
+    start = time.monotonic()
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.connect_ex(("127.0.0.1", port))
+        selector.register(sock, selectors.EVENT_WRITE, protocol.FrameDecoder())
+    welcomes: List[float] = []
+    firsts: List[float] = []
+    finished: List[socket.socket] = []
+    failed = 0
+    while len(finished) < count and time.monotonic() - start < timeout:
+        for key, events in selector.select(0.1):
+            sock, decoder = key.fileobj, key.data
+            done = False
+            try:
+                if events & selectors.EVENT_WRITE:
+                    error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    sock.send(protocol.encode_hello("bot"))
+                    selector.modify(sock, selectors.EVENT_READ, decoder)
+                    continue
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError("closed by the server")
+                for msg_type, _ in decoder.feed(data):
+                    if msg_type == protocol.MSG_WELCOME:
+                        welcomes.append(time.monotonic() - start)
+                    elif msg_type in (protocol.MSG_STATE, protocol.MSG_DELTA):
+                        firsts.append(time.monotonic() - start)
+                        done = True
+                        break
+            except OSError:
+                failed += 1
+                done = True
+            if done:
+                selector.unregister(sock)
+                finished.append(sock)
+    failed += count - len(finished)
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    for sock in finished:
+        sock.close()
+    selector.close()
+    return welcomes, firsts, failed
+
+def bench_joins(counts: List[int], backlogs: List[int], timeout: float, port: int) -> None:
+    # Everyone connects at the same moment, as when a match fills up. A short listen backlog overflows
+    # and the kernel drops SYNs, which clients only retry after a second or more.
+    print(f"{'backlog':>8} {'clients':>8} {'joined':>7} {'joins/s':>8} {'welcome p50':>12} {'first p50':>10} "
+          f"{'first p99':>10} {'first max':>10}")
+    for backlog in backlogs:
+        for count in counts:
+            server = multiprocessing.Process(target=serve, args=("selectors", port, False, backlog), daemon=True)
+            server.start()
+            time.sleep(0.5)
+            welcomes, firsts, failed = burst_join(port, count, timeout)
+            rate = len(firsts) / max(firsts) if firsts else 0.0
+            print(f"{backlog:>8} {count:>8} {len(firsts):>7} {rate:>8.0f} {percentile(welcomes, 0.5) * 1000:>10.0f}ms "
+                  f"{percentile(firsts, 0.5) * 1000:>8.0f}ms {percentile(firsts, 0.99) * 1000:>8.0f}ms "
+                  f"{max(firsts, default=0.0) * 1000:>8.0f}ms" + (f"  ({failed} failed)" if failed else ""))
+            server.terminate()
+            server.join()
+            port += 1
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for pair in text.split(","):
+        players, food = pair.split("x")
+        sizes.append((int(players), int(food)))
+    return sizes
+
+def main() -> None:
+    # Servers and games built in this process would otherwise log every join and meal
+    logging.disable(logging.CRITICAL)
+    parser = argparse.ArgumentParser(description="phago.io performance benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    tick_parser = sub.add_parser("tick", help="simulation tick time vs. entity count")
+    tick_parser.add_argument("--sizes", type=parse_sizes, default=TICK_SIZES, help="e.g. 10x75,200x5000 (players x food)")
+    tick_parser.add_argument("--ticks", type=int, default=60)
+    tick_parser.add_argument("--legacy-ticks", type=int, default=5)
+    tick_parser.add_argument("--regions", type=int, help="also time the regions engine with this many processes")
+
+    protocol_parser = sub.add_parser("protocol", help="state message size and encode/decode time, pickle vs. binary")
+    protocol_parser.add_argument("--sizes", type=parse_sizes, default=PROTOCOL_SIZES, help="e.g. 5x75,200x5000 (players x food)")
+    protocol_parser.add_argument("--repeat", type=int, default=200)
+
+    delta_parser = sub.add_parser("delta", help="per-client bytes per snapshot, keyframes vs. acked deltas")
+    delta_parser.add_argument("--sizes", type=parse_sizes, default=DELTA_SIZES, help="e.g. 10x75,200x5000 (players x food)")
+    delta_parser.add_argument("--ticks", type=int, default=300)
+    delta_parser.add_argument("--ack-lag", type=int, default=6, help="ticks between a snapshot and its ack")
+
+    fanout_parser = sub.add_parser("fanout", help="per-tick CPU to frame every client's snapshot, shared records vs. per-client encoding")
+    fanout_parser.add_argument("--clients", type=lambda text: [int(n) for n in text.split(",")], default=FANOUT_CLIENTS)
+    fanout_parser.add_argument("--food", type=int, default=1000)
+    fanout_parser.add_argument("--ticks", type=int, default=60)
+    fanout_parser.add_argument("--ack-lag", type=int, default=6, help="ticks between a snapshot and its ack")
+
+    conn_parser = sub.add_parser("connections", help="server CPU and update rate vs. connection count, per front end")
+    conn_parser.add_argument("--clients", type=lambda text: [int(n) for n in text.split(",")], default=[10, 100, 300])
+    conn_parser.add_argument("--duration", type=float, default=5.0)
+    conn_parser.add_argument("--input-rate", type=float, default=30.0)
+    conn_parser.add_argument("--port", type=int, default=15500)
+
+    joins_parser = sub.add_parser("joins", help="join throughput and time to first snapshot for a burst of simultaneous connects")
+    joins_parser.add_argument("--clients", type=lambda text: [int(n) for n in text.split(",")], default=[1000])
+    joins_parser.add_argument("--backlog", type=lambda text: [int(n) for n in text.split(",")], default=[5, socket.SOMAXCONN],
+                              help="listen backlogs to compare (5 was the old server's)")
+    joins_parser.add_argument("--timeout", type=float, default=20.0, help="give up on players not in after this long")
+    joins_parser.add_argument("--port", type=int, default=15900)
+
+    transport_parser = sub.add_parser("transport", help="snapshot gaps over TCP vs. UDP behind a lossy, delayed proxy")
+    transport_parser.add_argument("--loss", type=lambda text: [float(n) / 100 for n in text.split(",")], default=[0.0, 0.02, 0.05],
+                                  help="packet loss percentages, e.g. 0,2,5")
+    transport_parser.add_argument("--clients", type=int, default=20)
+    transport_parser.add_argument("--duration", type=float, default=5.0)
+    transport_parser.add_argument("--delay", type=float, default=40.0, help="one-way delay in ms")
+    transport_parser.add_argument("--jitter", type=float, default=5.0, help="delay variation in ms (+-)")
+    transport_parser.add_argument("--input-rate", type=float, default=30.0)
+    transport_parser.add_argument("--port", type=int, default=15700)
+
+    args = parser.parse_args()
+    if args.bench == "tick":
+        bench_tick(args.sizes, args.ticks, args.legacy_ticks, args.regions)
+    elif args.bench == "protocol":
+        bench_protocol(args.sizes, args.repeat)
+    elif args.bench == "delta":
+        bench_delta(args.sizes, args.ticks, args.ack_lag)
+    elif args.bench == "fanout":
+        bench_fanout(args.clients, args.food, args.ticks, args.ack_lag)
+    elif args.bench == "connections":
+        bench_connections(args.clients, args.duration, args.input_rate, args.port)
+    elif args.bench == "joins":
+        bench_joins(args.clients, args.backlog, args.timeout, args.port)
+    elif args.bench == "transport":
+        bench_transport(args.loss, args.clients, args.duration, args.delay / 1000, args.jitter / 1000,
+                        args.input_rate, args.port)
+
+if __name__ == "__main__":
+    main()
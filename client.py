@@ -1,18 +1,33 @@
+import argparse
+import collections
+import functools
 import pygame
 import socket
-import pickle
 import time
 import logging
 import os
-from typing import Optional, Tuple
+import selectors
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import protocol
+from movement import step
+from profiler import CPROFILE_TICKS, NULL_PROFILER, Profiler
+from viewport import GAME_WIDTH, GAME_HEIGHT, ZoomTracker
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Not available on Windows; the network overlay then shows no kernel backlog
+    fcntl = None
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-pygame.init()
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 UI_WIDTH, UI_HEIGHT = 600, 400
-GAME_WIDTH, GAME_HEIGHT = 960, 720  
 MAP_WIDTH, MAP_HEIGHT = 1080, 720
 FPS = 60
 WHITE = (255, 255, 255)
@@ -22,53 +37,88 @@ BORDER_COLOR = (100, 100, 100)
 CELL_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
 FOOD_COLOR = (100, 255, 100)
 ENEMY_COLOR = (255, 0, 0)
-FONT = pygame.font.SysFont('Arial', 24, bold=True)
-FOOTER_FONT = pygame.font.SysFont('Arial', 20, bold=False)
-SMALL_FONT = pygame.font.SysFont('Arial', 20, bold=True)
-WINNER_FONT = pygame.font.SysFont('Arial', 40, bold=True)
 GRAY = (150, 150, 150)
 
+# Number of applied snapshots kept as delta baselines (counted, not a seq distance: the server sends every
+# few ticks); more than the server keeps, so an acked baseline never goes missing
+SNAPSHOT_HISTORY = 128
+# Remote blobs are drawn this far in the past, so there is almost always a newer snapshot to blend towards
+# (two snapshot intervals at the default 20 Hz send rate: one late or lost snapshot is covered)
+INTERP_DELAY = 0.1
+INTERP_BUFFER_SECONDS = 1.0
+# Share of a prediction error still shown after each frame, so corrections glide instead of snapping;
+# errors beyond SNAP_DISTANCE (respawn after being eaten) are applied at once
+CORRECTION_DECAY = 0.85
+SNAP_DISTANCE = 100
+MAX_PENDING_INPUTS = 256
+# The mouse is sampled this many times a second and sent only if it moved at least INPUT_THRESHOLD pixels;
+# an unchanged input is still resent every INPUT_REFRESH seconds, carrying the newest snapshot ack and
+# replacing a lost datagram
+INPUT_RATE = 30
+INPUT_THRESHOLD = 2.0
+INPUT_REFRESH = 0.1
+
+# Rendered text kept for reuse (player names and HUD strings); enough for every name on a crowded screen
+TEXT_CACHE_SIZE = 512
+GRID_SPACING = 20
+# The pre-rendered grid is redrawn once the camera zoom drifts this far from the zoom it was drawn at
+GRID_RESCALE = 0.01
+# Pellet sprites kept per on-screen radius; cleared when zooming has produced this many sizes
+MAX_PELLET_SPRITES = 64
+
+# The network thread wakes at least this often to notice a disconnect or a stop request
+NETWORK_POLL = 0.1
+# Weight of the newest sample in the network thread's running latency averages
+STATS_SMOOTHING = 0.1
+
 MINIMAP_WIDTH = 200
 MINIMAP_HEIGHT = 150
 MINIMAP_SCALE_X = MINIMAP_WIDTH / MAP_WIDTH
 MINIMAP_SCALE_Y = MINIMAP_HEIGHT / MAP_HEIGHT
 
-class Camera:
+@functools.lru_cache(maxsize=None)
+def local_address() -> str:
+    # This machine's LAN address for the connect screen's default. Connecting a UDP socket only picks the
+    # outgoing interface (nothing is sent), unlike a hostname lookup, which can stall on DNS.
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("10.255.255.255", 1))
+            return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+class TextCache:
+    # Rendered text surfaces keyed on font, text and colour; the least recently used are dropped first
+    def __init__(self, capacity: int = TEXT_CACHE_SIZE):
+        self.capacity = capacity
+        self.surfaces: collections.OrderedDict = collections.OrderedDict()
+
+    def render(self, font: pygame.font.Font, text: str, color: Tuple[int, int, int]) -> pygame.Surface:
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.capacity:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+class Camera(ZoomTracker):
     def __init__(self):
-        self.zoom = 2.0
-        self.target_zoom = 2.0
+        super().__init__()
         self.offset_x = 0
         self.offset_y = 0
         self.target_offset_x = 0
         self.target_offset_y = 0
-        self.base_zoom = 2.0
-        self.min_zoom = 0.5
-        self.max_zoom = 2.2
-        self.smoothing = 0.1
-        self.min_threshold = 20
-        self.max_threshold = 50
 
     def update(self, player_x: float, player_y: float, player_size: float) -> None:
         self.target_offset_x = GAME_WIDTH / 2 - player_x * self.zoom
         self.target_offset_y = GAME_HEIGHT / 2 - player_y * self.zoom
         self.offset_x += (self.target_offset_x - self.offset_x) * self.smoothing
         self.offset_y += (self.target_offset_y - self.offset_y) * self.smoothing
-
-        desired_diameter = min(GAME_WIDTH, GAME_HEIGHT) * 0.5
-        if player_size > self.max_threshold:
-            self.target_zoom = desired_diameter / (player_size * 2)
-            self.target_zoom = max(self.min_zoom, min(self.max_zoom, self.target_zoom))
-            self.min_threshold = self.max_threshold
-            self.max_threshold = player_size * 1.5
-            logger.debug(f"Zooming out: size={player_size}, zoom={self.target_zoom}, new min={self.min_threshold}, new max={self.max_threshold}")
-        elif player_size < self.min_threshold:
-            self.target_zoom = desired_diameter / (player_size * 2)
-            self.target_zoom = max(self.min_zoom, min(self.max_zoom, self.target_zoom))
-            self.max_threshold = self.min_threshold
-            self.min_threshold = player_size * 0.5
-            logger.debug(f"Zooming in: size={player_size}, zoom={self.target_zoom}, new min={self.min_threshold}, new max={self.max_threshold}")
-
-        self.zoom += (self.target_zoom - self.zoom) * self.smoothing
+        self.update_zoom(player_size)
 
     def apply(self, pos: Tuple[float, float]) -> Tuple[int, int]:
         x, y = pos
@@ -76,27 +126,177 @@ class Camera:
         screen_y = (y * self.zoom) + self.offset_y
         return int(screen_x), int(screen_y)
 
+    def view_rect(self) -> Tuple[float, float, float, float]:
+        # The world rectangle on screen: (left, top, right, bottom)
+        return (-self.offset_x / self.zoom, -self.offset_y / self.zoom,
+                (GAME_WIDTH - self.offset_x) / self.zoom, (GAME_HEIGHT - self.offset_y) / self.zoom)
+
+class SnapshotBuffer:
+    # Recent snapshots on the server's clock (seq / tick rate), sampled INTERP_DELAY behind the newest
+    def __init__(self, tick_rate: int = 60, delay: float = INTERP_DELAY):
+        self.tick_rate = tick_rate
+        self.delay = delay
+        self.snapshots: List[Tuple[float, dict]] = []
+        # Local clock minus server clock. Follows the earliest arrivals at once and late ones slowly, so
+        # network jitter does not shake the render time.
+        self.offset: Optional[float] = None
+
+    def push(self, state: dict, now: float) -> None:
+        server_time = state['seq'] / self.tick_rate
+        sample = now - server_time
+        if self.offset is None or sample < self.offset:
+            self.offset = sample
+        else:
+            self.offset += (sample - self.offset) * 0.02
+        self.snapshots.append((server_time, state))
+        while self.snapshots[0][0] < server_time - INTERP_BUFFER_SECONDS:
+            self.snapshots.pop(0)
+
+    def sample(self, now: float) -> Optional[dict]:
+        if not self.snapshots:
+            return None
+        render_time = now - self.offset - self.delay
+        older = None
+        for index, (server_time, state) in enumerate(self.snapshots):
+            if server_time > render_time:
+                if older is None:
+                    return state
+                older_time, older_state = older
+                alpha = (render_time - older_time) / (server_time - older_time)
+                return self.interpolate(older_state, state, alpha)
+            older = (server_time, state)
+        # Ran out of snapshots (late packets): hold the newest rather than guess ahead
+        return self.snapshots[-1][1]
+
+    @staticmethod
+    def interpolate(older: dict, newer: dict, alpha: float) -> dict:
+        # Blobs that exist at the render time move along the line between the two snapshots;
+        # pellets and the clock come from the older snapshot to stay consistent with them
+        players = {}
+        for pid, (x, y, size, name, score) in older['players'].items():
+            target = newer['players'].get(pid)
+            if target is not None:
+                tx, ty, tsize = target[:3]
+                x += (tx - x) * alpha
+                y += (ty - y) * alpha
+                size += (tsize - size) * alpha
+            players[pid] = (x, y, size, name, score)
+        return {
+            'seq': older['seq'],
+            'players': players,
+            'food': older['food'],
+            'time_left': older['time_left']
+        }
+
+class Predictor:
+    # Our own blob, stepped locally every frame with the server's movement rules so it answers the mouse
+    # without waiting a round trip. Each snapshot resets it to the authoritative position and replays the
+    # inputs the server had not applied yet (newer than the snapshot's input ack).
+    def __init__(self, width: int = MAP_WIDTH, height: int = MAP_HEIGHT):
+        self.width = width
+        self.height = height
+        self.record: Optional[tuple] = None
+        self.x = 0.0
+        self.y = 0.0
+        self.last_dx = 0.0
+        self.last_dy = 0.0
+        self.error_x = 0.0
+        self.error_y = 0.0
+        self.inputs: List[Tuple[int, float, float, float]] = []
+
+    def reconcile(self, state: dict, pid: int) -> None:
+        own = state['players'].get(pid)
+        if own is None:
+            return
+        shown = self.position() if self.record is not None else own[:2]
+        self.record = own
+        self.x, self.y = own[0], own[1]
+        self.inputs = [entry for entry in self.inputs if entry[0] > state['input_ack']]
+        for _, mx, my, dt in self.inputs:
+            self.step(mx, my, dt)
+        self.error_x = shown[0] - self.x
+        self.error_y = shown[1] - self.y
+        if self.error_x**2 + self.error_y**2 > SNAP_DISTANCE**2:
+            self.error_x = self.error_y = 0.0
+
+    def predict(self, seq: int, mx: float, my: float, dt: float) -> None:
+        if self.record is None:
+            return
+        self.inputs.append((seq, mx, my, dt))
+        del self.inputs[:-MAX_PENDING_INPUTS]
+        self.step(mx, my, dt)
+        self.error_x *= CORRECTION_DECAY
+        self.error_y *= CORRECTION_DECAY
+
+    def step(self, mx: float, my: float, dt: float) -> None:
+        self.x, self.y, self.last_dx, self.last_dy = step(self.x, self.y, self.record[2], mx, my, self.last_dx,
+                                                          self.last_dy, dt, self.width, self.height)
+
+    def position(self) -> Tuple[float, float]:
+        return self.x + self.error_x, self.y + self.error_y
+
+    def apply(self, state: dict, pid: int) -> dict:
+        # The render state with our blob at its predicted position (size and score as last confirmed)
+        if self.record is None:
+            return state
+        x, y = self.position()
+        players = dict(state['players'])
+        players[pid] = (x, y) + tuple(self.record[2:])
+        return dict(state, players=players)
+
 class Client:
-    def __init__(self, name: str, host: str, port: int):
+    def __init__(self, name: str, host: str, port: int, udp: bool = False, input_rate: float = INPUT_RATE,
+                 spectate: bool = False):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.name = name
+        # A spectator only watches: it sends nothing after WATCH and gets the whole map
         self.host = host
         self.port = port
         self.connected = False
         self.pid = None
+        self.spectate = spectate
+        # Optional UDP transport: set up after the TCP handshake if the server handed out a token
+        self.use_udp = udp
+        self.udp: Optional[socket.socket] = None
+        self.token = 0
+        self.input_seq = 0
+        self.input_interval = 1 / input_rate
+        self.next_input = 0.0
+        # The last input sent and when; the server steers towards it until a newer one arrives
+        self.last_input: Optional[Tuple[float, float]] = None
+        self.last_input_time = 0.0
+        self.tick_rate = 60
+        self.bytes_in = 0
+        self.decoder = protocol.FrameDecoder()
+        self.outgoing = b""
+        self.snapshots: Dict[int, dict] = {}
+        self.acked = 0
+        self.minimap: Optional[dict] = None
+        self.watched: Optional[dict] = None
 
     def connect(self) -> bool:
         try:
             self.socket.connect((self.host, self.port))
-            self.socket.send(pickle.dumps(self.name))
-            logger.info(f"Sent name: {self.name}")
+            if self.spectate:
+                self.socket.sendall(protocol.encode_watch())
+                logger.info("Joining as a spectator")
+            else:
+                self.socket.sendall(protocol.encode_hello(self.name))
+                logger.info(f"Sent name: {self.name}")
             self.socket.setblocking(True)
-            data = self.socket.recv(4096)
-            msg_type, pid = pickle.loads(data)
-            if msg_type == "PID":
-                self.pid = pid
+            msg_type, payload = protocol.recv_frames(self.socket, self.decoder)[0]
+            if msg_type == protocol.MSG_WELCOME:
+                self.pid, self.token, self.tick_rate = protocol.decode_welcome(payload)
                 logger.info(f"Received PID: {self.pid}")
             self.socket.setblocking(False)
+            if self.use_udp and not self.spectate:
+                if self.token:
+                    self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    self.udp.connect((self.host, self.port))
+                    self.udp.setblocking(False)
+                    logger.info("Sending input over UDP")
+                else:
+                    logger.warning("Server does not offer UDP, staying on TCP")
             self.connected = True
             logger.info("Connected to server")
             return True
@@ -104,81 +304,320 @@ class Client:
             logger.error(f"Connect failed: {e}")
             return False
 
+    def send_input(self, payload: Tuple[float, float], now: float) -> bool:
+        # Called every frame; sends at most once per input interval and only when the input is worth sending
+        if now < self.next_input:
+            return False
+        self.next_input = now + self.input_interval
+        last = self.last_input
+        moved = (last is None or abs(payload[0] - last[0]) >= INPUT_THRESHOLD
+                 or abs(payload[1] - last[1]) >= INPUT_THRESHOLD)
+        if not moved and now - self.last_input_time < INPUT_REFRESH:
+            return False
+        self.send(payload)
+        self.last_input = payload
+        self.last_input_time = now
+        return True
+
     def send(self, payload: Tuple[float, float]) -> None:
-        if self.connected:
+        # Every input gets a new seq: the server drops duplicate and reordered datagrams by it and echoes
+        # the newest one applied, which the predictor reconciles against
+        self.input_seq += 1
+        if self.connected and self.udp is not None:
+            try:
+                self.udp.send(protocol.encode_udp_input(self.token, self.input_seq, payload[0], payload[1], self.acked))
+            except OSError:
+                # Full buffer or a transient ICMP error: the next frame sends a newer input anyway
+                pass
+        elif self.connected:
             try:
-                self.socket.send(pickle.dumps((1, payload)))
+                # Inputs are latest-value-wins: only a partially written frame is kept, never a backlog
+                if not self.outgoing:
+                    self.outgoing = protocol.encode_input(payload[0], payload[1], self.acked, self.input_seq)
+                sent = self.socket.send(self.outgoing)
+                self.outgoing = self.outgoing[sent:]
+            except BlockingIOError:
+                pass
             except:
                 self.connected = False
                 logger.debug("Send failed, disconnected")
 
     def receive(self) -> Optional[dict]:
-        if self.connected:
+        # Drain everything the socket has buffered and decode only the newest complete state.
+        # Every delta is relative to a snapshot we acked, so older frames in the batch can be skipped.
+        latest = None
+        while self.connected:
             try:
-                data = self.socket.recv(4096)
-                if data:
-                    return pickle.loads(data)[1]
+                data = self.socket.recv(65536)
+                if not data:
+                    self.connected = False
+                    logger.debug("Server closed the connection")
+                    break
+                self.bytes_in += len(data)
+                for msg_type, payload in self.decoder.feed(data):
+                    latest = self.collect(msg_type, payload, latest)
             except BlockingIOError:
-                return None
+                break
             except:
                 self.connected = False
                 logger.debug("Receive failed, disconnected")
-        return None
+        while self.connected and self.udp is not None:
+            try:
+                data = self.udp.recv(65536)
+                self.bytes_in += len(data)
+                latest = self.collect(*protocol.decode_datagram(data), latest)
+            except BlockingIOError:
+                break
+            except (OSError, protocol.ProtocolError) as e:
+                # A lost or mangled datagram is simply skipped; a later snapshot supersedes it
+                logger.debug(f"Datagram dropped: {e}")
+        if self.spectate:
+            state, self.watched = self.watched, None
+            return state
+        if latest is None:
+            return None
+        return self.apply(*latest)
+
+    def collect(self, msg_type: int, payload: bytes, latest: Optional[tuple]) -> Optional[tuple]:
+        # Keep the highest-seq snapshot seen; datagrams can arrive out of order or interleaved with TCP
+        if msg_type in (protocol.MSG_STATE, protocol.MSG_DELTA) and self.spectate:
+            # A spectator's deltas each build on the frame before, so every one is applied in order
+            self.watched = self.apply(msg_type, payload) or self.watched
+        elif msg_type in (protocol.MSG_STATE, protocol.MSG_DELTA):
+            if latest is None or protocol.snapshot_seq(payload) > protocol.snapshot_seq(latest[1]):
+                return msg_type, payload
+        elif msg_type == protocol.MSG_MINIMAP:
+            self.minimap = protocol.decode_minimap(payload)
+        return latest
+
+    def apply(self, msg_type: int, payload: bytes) -> Optional[dict]:
+        if msg_type == protocol.MSG_STATE:
+            state = protocol.decode_state(payload)
+        else:
+            baseline = self.snapshots.get(protocol.delta_baseline(payload))
+            if baseline is None:
+                # Keep acking the old snapshot; the server falls back to a keyframe once it expires
+                logger.debug("Delta baseline missing, waiting for keyframe")
+                return None
+            state = protocol.apply_delta(baseline, payload)
+        seq = state['seq']
+        if seq <= self.acked:
+            return None
+        self.snapshots[seq] = state
+        # Only newer seqs are applied, so the oldest snapshot is always first
+        while len(self.snapshots) > SNAPSHOT_HISTORY:
+            del self.snapshots[next(iter(self.snapshots))]
+        self.acked = seq
+        return state
+
+def pending_bytes(sock: socket.socket) -> int:
+    # Bytes the kernel has received for this socket that nobody has read yet
+    if fcntl is None:
+        return 0
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.FIONREAD, b'\0\0\0\0'))[0]
+    except OSError:
+        return 0
+
+class NetworkWorker(threading.Thread):
+    # Drains the client's sockets on its own thread so a slow frame never leaves snapshots queued in the
+    # kernel, and decodes them off the render thread. Only the newest applied state is handed over: the
+    # single-slot deque replaces an unrendered state atomically, so neither side takes a lock.
+    def __init__(self, client: Client, profiler=NULL_PROFILER):
+        super().__init__(daemon=True, name="network")
+        self.client = client
+        self.profiler = profiler
+        self.slot: collections.deque = collections.deque(maxlen=1)
+        self.running = True
+        self.stats = {'received': 0, 'superseded': 0, 'interval_ms': 0.0, 'handoff_ms': 0.0, 'backlog': 0}
+        self.last_arrival: Optional[float] = None
+
+    def run(self) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(self.client.socket, selectors.EVENT_READ)
+        if self.client.udp is not None:
+            selector.register(self.client.udp, selectors.EVENT_READ)
+        try:
+            while self.running and self.client.connected:
+                if not selector.select(NETWORK_POLL):
+                    continue
+                start = self.profiler.begin()
+                state = self.client.receive()
+                self.profiler.end("receive", start)
+                stats = self.stats
+                stats['backlog'] = pending_bytes(self.client.socket) + len(self.client.decoder.buffer)
+                if state is None:
+                    continue
+                now = time.monotonic()
+                if self.slot:
+                    stats['superseded'] += 1
+                self.slot.append((state, now))
+                stats['received'] += 1
+                if self.last_arrival is not None:
+                    interval = (now - self.last_arrival) * 1000
+                    stats['interval_ms'] += (interval - stats['interval_ms']) * STATS_SMOOTHING
+                self.last_arrival = now
+        finally:
+            selector.close()
+
+    def take(self) -> Optional[Tuple[dict, float]]:
+        # Newest state not yet rendered and when it arrived, or None if nothing new came in
+        try:
+            state, arrived = self.slot.popleft()
+        except IndexError:
+            return None
+        handoff = (time.monotonic() - arrived) * 1000
+        self.stats['handoff_ms'] += (handoff - self.stats['handoff_ms']) * STATS_SMOOTHING
+        return state, arrived
+
+    def stop(self) -> None:
+        self.running = False
+        self.join(timeout=NETWORK_POLL * 2)
 
 class GameView:
     def __init__(self):
+        # pygame is only initialised here, so Client can be imported and driven headless (loadtest.py)
+        pygame.init()
+        self.font = pygame.font.SysFont('Arial', 24, bold=True)
+        self.footer_font = pygame.font.SysFont('Arial', 20, bold=False)
+        self.small_font = pygame.font.SysFont('Arial', 20, bold=True)
+        self.winner_font = pygame.font.SysFont('Arial', 40, bold=True)
         self.screen = pygame.display.set_mode((UI_WIDTH, UI_HEIGHT))
         pygame.display.set_caption("phago.io")
         self.clock = pygame.time.Clock()
         self.camera = Camera()
         self.minimap_surface = pygame.Surface((MINIMAP_WIDTH, MINIMAP_HEIGHT))
+        # The minimap summary the surface was drawn from; it is redrawn only when a new one arrives
+        self.minimap_source: Optional[dict] = None
+        self.pellet_sprites: Dict[int, pygame.Surface] = {}
+        # F3 overlay: frame time, how many entities were drawn vs. culled and the network thread's stats
+        self.debug = False
+        # --profile: per-phase frame timings (profiler.py)
+        self.profiler = NULL_PROFILER
+        self.stats = {'players': 0, 'players_culled': 0, 'food': 0, 'food_culled': 0, 'frame_ms': 0.0}
+        self.network: Optional[NetworkWorker] = None
         self.start_time = None
-        self.watermark = SMALL_FONT.render("phago.io - 23PT01 - 23PT14", True, (0, 0, 0))
+        self.watermark = self.small_font.render("phago.io - 23PT01 - 23PT14", True, (0, 0, 0))
         self.watermark.set_alpha(50)
+        self.text = TextCache()
+        self.grid_layer: Optional[pygame.Surface] = None
+        self.grid_zoom = 0.0
 
     def resize_for_game(self):
         self.screen = pygame.display.set_mode((GAME_WIDTH, GAME_HEIGHT))
 
-    def draw_grid(self) -> None:
-        for x in range(0, MAP_WIDTH, 20):
-            start_pos = self.camera.apply((x, 0))
-            end_pos = self.camera.apply((x, MAP_HEIGHT))
-            pygame.draw.line(self.screen, GRID_COLOR, start_pos, end_pos)
-        for y in range(0, MAP_HEIGHT, 20):
-            start_pos = self.camera.apply((0, y))
-            end_pos = self.camera.apply((MAP_WIDTH, y))
-            pygame.draw.line(self.screen, GRID_COLOR, start_pos, end_pos)
-
-    def draw_map_border(self) -> None:
+    def render_grid(self, zoom: float) -> None:
+        # A screen-sized grid plus one spacing of slack, drawn once per zoom level; each frame blits it at
+        # the camera's offset within one spacing
+        spacing = GRID_SPACING * zoom
+        layer_w = int(GAME_WIDTH + 2 * spacing) + 1
+        layer_h = int(GAME_HEIGHT + 2 * spacing) + 1
+        self.grid_layer = pygame.Surface((layer_w, layer_h))
+        self.grid_layer.fill(WHITE)
+        for i in range(int(layer_w / spacing) + 1):
+            x = round(i * spacing)
+            pygame.draw.line(self.grid_layer, GRID_COLOR, (x, 0), (x, layer_h))
+        for i in range(int(layer_h / spacing) + 1):
+            y = round(i * spacing)
+            pygame.draw.line(self.grid_layer, GRID_COLOR, (0, y), (layer_w, y))
+        self.grid_zoom = zoom
+
+    def draw_grid(self, width: int, height: int) -> None:
+        zoom = self.camera.zoom
+        if self.grid_layer is None or abs(zoom - self.grid_zoom) > self.grid_zoom * GRID_RESCALE:
+            self.render_grid(zoom)
+        spacing = GRID_SPACING * self.grid_zoom
+        # Only inside the map: clip to its rectangle on screen
+        left, top = self.camera.apply((0, 0))
+        right, bottom = self.camera.apply((width, height))
+        self.screen.set_clip(pygame.Rect(left, top, right - left, bottom - top))
+        self.screen.blit(self.grid_layer, (self.camera.offset_x % spacing - spacing,
+                                           self.camera.offset_y % spacing - spacing))
+        self.screen.set_clip(None)
+
+    def draw_map_border(self, width: int, height: int) -> None:
         top_left = self.camera.apply((0, 0))
-        top_right = self.camera.apply((MAP_WIDTH, 0))
-        bottom_left = self.camera.apply((0, MAP_HEIGHT))
-        bottom_right = self.camera.apply((MAP_WIDTH, MAP_HEIGHT))
+        top_right = self.camera.apply((width, 0))
+        bottom_left = self.camera.apply((0, height))
+        bottom_right = self.camera.apply((width, height))
         pygame.draw.line(self.screen, BORDER_COLOR, top_left, top_right, 5)
         pygame.draw.line(self.screen, BORDER_COLOR, top_left, bottom_left, 5)
         pygame.draw.line(self.screen, BORDER_COLOR, bottom_left, bottom_right, 5)
         pygame.draw.line(self.screen, BORDER_COLOR, top_right, bottom_right, 5)
 
-    def draw_minimap(self, state: dict, my_pid: int) -> None:
+    def draw_minimap(self, state: dict, my_pid: int, minimap: Optional[dict]) -> None:
+        # The server only sends nearby entities, so the minimap draws its coarse whole-map summary:
+        # pellet density per cell and the leading players, plus our own blob from the live state.
+        # The summary comes a couple of times a second and is drawn to minimap_surface only then;
+        # each frame just blits it and adds our own dot.
+        scale_x, scale_y = MINIMAP_SCALE_X, MINIMAP_SCALE_Y
+        if minimap:
+            scale_x = MINIMAP_WIDTH / minimap['width']
+            scale_y = MINIMAP_HEIGHT / minimap['height']
+        if minimap is not self.minimap_source or minimap is None:
+            self.render_minimap(my_pid, minimap, scale_x, scale_y)
+        origin = (10, GAME_HEIGHT - MINIMAP_HEIGHT - 10)
+        self.screen.blit(self.minimap_surface, origin)
+        if my_pid in state['players']:
+            px, py = state['players'][my_pid][:2]
+            pygame.draw.circle(self.screen, CELL_COLORS[my_pid % len(CELL_COLORS)],
+                               (origin[0] + px * scale_x, origin[1] + py * scale_y), 2)
+
+    def render_minimap(self, my_pid: int, minimap: Optional[dict], scale_x: float, scale_y: float) -> None:
+        self.minimap_source = minimap
         self.minimap_surface.fill(BLACK)
-        for fx, fy, _ in state['food']:
-            minimap_x = fx * MINIMAP_SCALE_X
-            minimap_y = fy * MINIMAP_SCALE_Y
-            pygame.draw.circle(self.minimap_surface, FOOD_COLOR, (minimap_x, minimap_y), 1)
-        for pid, (px, py, _, _, _) in state['players'].items():
-            minimap_x = px * MINIMAP_SCALE_X
-            minimap_y = py * MINIMAP_SCALE_Y
-            if pid == my_pid:
-                color = CELL_COLORS[pid % len(CELL_COLORS)]
-            else:
-                color = ENEMY_COLOR
-            pygame.draw.circle(self.minimap_surface, color, (minimap_x, minimap_y), 2)
+        if minimap:
+            cols, rows = minimap['cols'], minimap['rows']
+            cell_w, cell_h = MINIMAP_WIDTH / cols, MINIMAP_HEIGHT / rows
+            peak = max(minimap['density']) or 1
+            for index, count in enumerate(minimap['density']):
+                if count:
+                    shade = 0.25 + 0.75 * count / peak
+                    color = tuple(int(c * shade) for c in FOOD_COLOR)
+                    rect = ((index % cols) * cell_w, (index // cols) * cell_h, cell_w + 1, cell_h + 1)
+                    pygame.draw.rect(self.minimap_surface, color, rect)
+            for pid, (px, py, _, _, _) in minimap['players'].items():
+                if pid != my_pid:
+                    pygame.draw.circle(self.minimap_surface, ENEMY_COLOR, (px * scale_x, py * scale_y), 2)
         pygame.draw.rect(self.minimap_surface, WHITE, (0, 0, MINIMAP_WIDTH, MINIMAP_HEIGHT), 2)
-        self.screen.blit(self.minimap_surface, (10, GAME_HEIGHT - MINIMAP_HEIGHT - 10))
+
+    def pellet_sprite(self, radius: int) -> pygame.Surface:
+        sprite = self.pellet_sprites.get(radius)
+        if sprite is None:
+            if len(self.pellet_sprites) >= MAX_PELLET_SPRITES:
+                self.pellet_sprites.clear()
+            sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            pygame.draw.circle(sprite, FOOD_COLOR, (radius, radius), radius)
+            self.pellet_sprites[radius] = sprite
+        return sprite
+
+    def draw_debug(self) -> None:
+        stats = self.stats
+        lines = [f"FPS {self.clock.get_fps():.0f}  frame {stats['frame_ms']:.1f} ms",
+                 f"players {stats['players']} drawn, {stats['players_culled']} culled",
+                 f"pellets {stats['food']} drawn, {stats['food_culled']} culled"]
+        if self.network is not None:
+            net = self.network.stats
+            lines.append(f"snapshots {net['received']} in, {net['superseded']} superseded, every {net['interval_ms']:.0f} ms")
+            lines.append(f"handoff {net['handoff_ms']:.1f} ms  backlog {net['backlog']} B")
+        for i, line in enumerate(lines):
+            # Changes every frame, so rendered directly rather than churning the text cache
+            text = self.small_font.render(line, True, BLACK)
+            self.screen.blit(text, (GAME_WIDTH - text.get_width() - 10, 45 + i * 22))
+
+    def leader(self, state: dict) -> Optional[int]:
+        players = state['players']
+        return max(players, key=lambda pid: players[pid][4], default=None)
+
+    def standings(self, state: dict, minimap: Optional[dict]) -> list:
+        # Global leaders from the minimap summary, refreshed with the live records of visible players
+        players = dict(minimap['players']) if minimap else {}
+        players.update(state['players'])
+        return sorted(players.items(), key=lambda x: x[1][4], reverse=True)
 
     def draw_menu(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
         self.screen.fill(BLACK)
-        default_ip = socket.gethostbyname(socket.gethostname())
+        default_ip = local_address()
         default_port = "1401"
         username = ""
         ip = default_ip
@@ -215,74 +654,106 @@ class GameView:
                             port += event.unicode
 
             self.screen.fill(BLACK)
-            branding = FONT.render("phago.io", True, WHITE)
+            branding = self.text.render(self.font, "phago.io", WHITE)
             self.screen.blit(branding, (UI_WIDTH//2 - branding.get_width()//2, 30))
-            ip_label = FONT.render("Enter IP:", True, WHITE)
+            ip_label = self.text.render(self.font, "Enter IP:", WHITE)
             self.screen.blit(ip_label, (UI_WIDTH//2 - ip_label.get_width()//2, 80))
-            ip_text = FONT.render(ip, True, WHITE if active_field == "ip" else GRAY)
+            ip_text = self.text.render(self.font, ip, WHITE if active_field == "ip" else GRAY)
             self.screen.blit(ip_text, (UI_WIDTH//2 - ip_text.get_width()//2, 110))
-            port_label = FONT.render("Enter Port:", True, WHITE)
+            port_label = self.text.render(self.font, "Enter Port:", WHITE)
             self.screen.blit(port_label, (UI_WIDTH//2 - port_label.get_width()//2, 150))
-            port_text = FONT.render(port, True, WHITE if active_field == "port" else GRAY)
+            port_text = self.text.render(self.font, port, WHITE if active_field == "port" else GRAY)
             self.screen.blit(port_text, (UI_WIDTH//2 - port_text.get_width()//2, 180))
-            username_label = FONT.render("Enter Username:", True, WHITE)
+            username_label = self.text.render(self.font, "Enter Username:", WHITE)
             self.screen.blit(username_label, (UI_WIDTH//2 - username_label.get_width()//2, 220))
-            username_text = FONT.render(username, True, WHITE if active_field == "username" else GRAY)
+            username_text = self.text.render(self.font, username, WHITE if active_field == "username" else GRAY)
             self.screen.blit(username_text, (UI_WIDTH//2 - username_text.get_width()//2, 250))
-            credit1 = FOOTER_FONT.render("23XT46 - Computer Networks Lab", True, GRAY)
+            credit1 = self.text.render(self.footer_font, "23XT46 - Computer Networks Lab", GRAY)
             self.screen.blit(credit1, (UI_WIDTH//2 - credit1.get_width()//2, UI_HEIGHT - 100))
-            credit2 = FOOTER_FONT.render("23PT01 - Aakash Velusamy", True, GRAY)
+            credit2 = self.text.render(self.footer_font, "23PT01 - Aakash Velusamy", GRAY)
             self.screen.blit(credit2, (UI_WIDTH//2 - credit2.get_width()//2, UI_HEIGHT - 70))
-            credit3 = FOOTER_FONT.render("23PT14 - Kabilan S", True, GRAY)
+            credit3 = self.text.render(self.footer_font, "23PT14 - Kabilan S", GRAY)
             self.screen.blit(credit3, (UI_WIDTH//2 - credit3.get_width()//2, UI_HEIGHT - 40))
             pygame.display.flip()
             self.clock.tick(30)
 
-    def draw_game(self, state: dict, my_pid: int) -> None:
+    def draw_game(self, state: dict, my_pid: int, minimap: Optional[dict] = None) -> None:
+        frame_start = time.perf_counter()
         self.screen.fill(WHITE)
-        if my_pid in state['players']:
-            px, py, psize, _, _ = state['players'][my_pid]
-            self.camera.update(px, py, psize)
-        else:
+        # Spectators have no blob of their own and follow the leader
+        followed = my_pid if my_pid in state['players'] else self.leader(state)
+        if followed is None:
             return
-        self.draw_grid()
-        self.draw_map_border()
-        for fx, fy, fsize in state['food']:
-            pos = self.camera.apply((fx, fy))
-            pygame.draw.circle(self.screen, FOOD_COLOR, pos, fsize * self.camera.zoom)
+        px, py, psize, _, _ = state['players'][followed]
+        self.camera.update(px, py, psize)
+        # The map size comes with the minimap; servers can run maps larger than the default
+        width, height = (minimap['width'], minimap['height']) if minimap else (MAP_WIDTH, MAP_HEIGHT)
+        self.draw_grid(width, height)
+        self.draw_map_border(width, height)
+        # Cull everything whose circle misses the screen, then draw pellets as one batch of sprite blits
+        left, top, right, bottom = self.camera.view_rect()
+        zoom = self.camera.zoom
+        offset_x, offset_y = self.camera.offset_x, self.camera.offset_y
+        pellets = []
+        for fx, fy, fsize in state['food'].values():
+            if left - fsize <= fx <= right + fsize and top - fsize <= fy <= bottom + fsize:
+                radius = max(1, round(fsize * zoom))
+                pellets.append((self.pellet_sprite(radius),
+                                (int(fx * zoom + offset_x) - radius, int(fy * zoom + offset_y) - radius)))
+        self.screen.blits(pellets, False)
+        drawn = 0
         for pid, (px, py, psize, pname, pscore) in state['players'].items():
+            if px + psize < left or px - psize > right or py + psize < top or py - psize > bottom:
+                continue
+            drawn += 1
             color = CELL_COLORS[pid % len(CELL_COLORS)]
             pos = self.camera.apply((px, py))
-            pygame.draw.circle(self.screen, color, pos, psize * self.camera.zoom)
-            pygame.draw.circle(self.screen, BLACK, pos, psize * self.camera.zoom, 2)
-            text = FONT.render(pname, True, WHITE)
+            pygame.draw.circle(self.screen, color, pos, psize * zoom)
+            pygame.draw.circle(self.screen, BLACK, pos, psize * zoom, 2)
+            text = self.text.render(self.font, pname, WHITE)
             text_pos = (pos[0] - text.get_width()/2, pos[1] - text.get_height()/2)
             self.screen.blit(text, text_pos)
-        self.draw_minimap(state, my_pid)
+        self.stats.update(players=drawn, players_culled=len(state['players']) - drawn, food=len(pellets),
+                          food_culled=len(state['food']) - len(pellets))
+        profiler = self.profiler
+        start = profiler.begin()
+        self.draw_minimap(state, my_pid, minimap)
+        profiler.end("draw_minimap", start)
 
         # Timer at the center (top)
-        timer = FONT.render(f"Time: {state['time_left']//60:02d}:{state['time_left']%60:02d}", True, BLACK)
+        # HUD strings go through the text cache, so they are only rendered again when their values change
+        timer = self.text.render(self.font, f"Time: {state['time_left']//60:02d}:{state['time_left']%60:02d}", BLACK)
         timer_x = GAME_WIDTH // 2 - timer.get_width() // 2
         self.screen.blit(timer, (timer_x, 10))
 
         # Score at the top right
-        my_score = FONT.render(f"Score: {state['players'][my_pid][4]}", True, BLACK)
+        if followed == my_pid:
+            my_score = self.text.render(self.font, f"Score: {state['players'][my_pid][4]}", BLACK)
+        else:
+            my_score = self.text.render(self.font, f"Watching: {state['players'][followed][3]}", BLACK)
         score_x = GAME_WIDTH - my_score.get_width() - 10
         self.screen.blit(my_score, (score_x, 10))
 
         # Leaderboard at the top left
-        sorted_scores = sorted(state['players'].items(), key=lambda x: x[1][4], reverse=True)
+        sorted_scores = self.standings(state, minimap)
         for i, (pid, (_, _, _, name, score)) in enumerate(sorted_scores[:5]):
-            score_text = FONT.render(f"{name}: {int(score)}", True, BLACK)
+            score_text = self.text.render(self.font, f"{name}: {int(score)}", BLACK)
             self.screen.blit(score_text, (10, 10 + i * 25))
 
         # Draw watermark at bottom right
         self.screen.blit(self.watermark, (GAME_WIDTH - self.watermark.get_width() - 10, GAME_HEIGHT - self.watermark.get_height() - 10))
+        if self.debug:
+            self.draw_debug()
+        self.stats['frame_ms'] = (time.perf_counter() - frame_start) * 1000
+        start = profiler.begin()
         pygame.display.flip()
+        profiler.end("flip", start)
+        start = profiler.begin()
         self.clock.tick(FPS)
+        profiler.end("frame_wait", start)
 
-    def display_winner(self, state: dict) -> None:
-        sorted_players = sorted(state['players'].items(), key=lambda x: x[1][4], reverse=True)
+    def display_winner(self, state: dict, minimap: Optional[dict] = None) -> None:
+        sorted_players = self.standings(state, minimap)
         if sorted_players:
             winner_pid, (_, _, _, winner_name, winner_score) = sorted_players[0]
             winner_text = f"Winner: {winner_name} with {int(winner_score)} points!"
@@ -290,13 +761,27 @@ class GameView:
             winner_text = "No players in the game!"
         
         self.screen.fill(BLACK)
-        winner_surface = WINNER_FONT.render(winner_text, True, WHITE)
+        winner_surface = self.winner_font.render(winner_text, True, WHITE)
         self.screen.blit(winner_surface, (GAME_WIDTH//2 - winner_surface.get_width()//2, GAME_HEIGHT//2 - winner_surface.get_height()//2))
         pygame.display.flip()
         pygame.time.wait(3000)
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="phago.io client")
+    parser.add_argument("--udp", action="store_true", help="send input and receive state over UDP (server needs --udp)")
+    parser.add_argument("--input-rate", type=float, default=INPUT_RATE, help="mouse samples per second sent to the server")
+    parser.add_argument("--spectate", action="store_true", help="watch the match (from a server or relay.py) without playing")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="time frame phases, written on exit as a Chrome trace (.json) or folded stacks")
+    parser.add_argument("--cprofile-frames", type=int, default=CPROFILE_TICKS,
+                        help="frames a cProfile run covers once started with F4 (needs --profile)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     view = GameView()
+    profiler = Profiler(cprofile_ticks=args.cprofile_frames) if args.profile else NULL_PROFILER
+    view.profiler = profiler
     username, ip, port = view.draw_menu()
     if not username or not ip or not port:
         pygame.quit()
@@ -307,7 +792,7 @@ def main():
         logger.error("Invalid port number")
         pygame.quit()
         return
-    client = Client(username, ip, port_num)
+    client = Client(username, ip, port_num, udp=args.udp, input_rate=args.input_rate, spectate=args.spectate)
     if not client.connect():
         logger.error("Connection failed, exiting")
         pygame.quit()
@@ -315,29 +800,68 @@ def main():
 
     view.resize_for_game()
     view.start_time = time.time()
+    snapshots = SnapshotBuffer(client.tick_rate)
+    predictor = Predictor()
+    # Receiving and decoding run on the network thread; this loop only sends input and draws
+    network = NetworkWorker(client, profiler)
+    network.start()
+    view.network = network
 
     running = True
     game_ended = False
+    last_frame = time.monotonic()
     while running:
+        start = profiler.begin()
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                view.debug = not view.debug
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4 and profiler.enabled:
+                profiler.request_cprofile()
             elif event.type == pygame.WINDOWMOVED:
                 pygame.event.clear()
                 continue
 
-        mx, my = pygame.mouse.get_pos()
-        client.send((mx, my))
-        state = client.receive()
-        if state:
-            view.draw_game(state, client.pid)
+        profiler.end("events", start)
+        start = profiler.begin()
+        now = time.monotonic()
+        dt = min(now - last_frame, 0.25)
+        last_frame = now
+        if not client.spectate:
+            mx, my = pygame.mouse.get_pos()
+            client.send_input((mx, my), now)
+        received = network.take()
+        if received:
+            state, arrived = received
+            # Timed by arrival on the network thread, not by when this frame got around to it
+            snapshots.push(state, arrived)
+            if client.minimap:
+                predictor.width, predictor.height = client.minimap['width'], client.minimap['height']
+            predictor.reconcile(state, client.pid)
+        # Predict with the input the server has, not the live mouse, so replays match its simulation
+        if client.last_input is not None:
+            predictor.predict(client.input_seq, *client.last_input, dt)
+        # Draw every frame: remote blobs interpolated in the past, our own blob predicted
+        render = snapshots.sample(now)
+        profiler.end("update", start)
+        if render:
+            start = profiler.begin()
+            view.draw_game(predictor.apply(render, client.pid), client.pid, client.minimap)
+            profiler.end("draw", start)
+            latest = snapshots.snapshots[-1][1]
             elapsed = time.time() - view.start_time
-            if state['time_left'] <= 0 and not game_ended and elapsed > 5:
-                view.display_winner(state)
+            if latest['time_left'] <= 0 and not game_ended and elapsed > 5:
+                view.display_winner(latest, client.minimap)
                 game_ended = True
                 pygame.time.wait(1000)
                 running = False
-        time.sleep(0.001)
+        else:
+            time.sleep(0.001)
+        profiler.tick()
+    network.stop()
+    if args.profile:
+        profiler.dump(args.profile)
     pygame.quit()
 
 if __name__ == "__main__":
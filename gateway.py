@@ -0,0 +1,232 @@
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from server import (DEFAULT_PORT, ENGINES, FOOD_COUNT, HEIGHT, INPUT_LIMIT, MAX_CLIENT_BUDGET, MAX_TICK_DT,
+                    METRICS_HOST, SEND_RATE, TICK_RATE, WIDTH, Server, create_game, parse_size)
+from shm_ring import InputTable, SnapshotRing, world_size
+
+logger = logging.getLogger(__name__)
+
+# One arena whose networking is spread over several processes. The main process only simulates: each tick
+# it applies the joins, leaves and inputs it finds in the shared input table and writes the world to the
+# shared snapshot ring (shm_ring.py). Gateway processes all accept from one listening socket and do
+# everything per client (framing, views, deltas, byte budgets, sends) from the ring's snapshots, so the
+# work that grows with the number of clients runs on as many cores as there are gateways.
+# Pids are dealt out as gateway index + k * gateways, so gateways never need to agree on one.
+GATEWAY_CAPACITY = 256
+RING_POLL = 0.001
+LIVENESS_INTERVAL = 1.0
+
+class RingGame:
+    # What a gateway's Server sees as its game: snapshots come from the ring, and joins, leaves and inputs go
+    # to this gateway's rows of the input table. Only the event loop writes rows, so nothing here locks.
+    def __init__(self, ring: SnapshotRing, inputs: InputTable, rows: range, width: int, height: int):
+        self.ring = ring
+        self.inputs = inputs
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()
+        self.free: List[int] = list(reversed(rows))
+        self.rows: Dict[int, int] = {}
+        # Every write replaces the whole row, so each input carries the name given at join again
+        self.names: Dict[int, str] = {}
+        self.state: Optional[Dict] = None
+
+    def add_player(self, pid: int, name: str) -> None:
+        row = self.free.pop()
+        self.rows[pid] = row
+        self.names[pid] = name
+        self.inputs.write(row, pid, name=name)
+
+    def remove_player(self, pid: int) -> None:
+        row = self.rows.pop(pid, None)
+        self.names.pop(pid, None)
+        if row is not None:
+            self.inputs.write(row, None)
+            self.free.append(row)
+
+    def set_input(self, pid: int, mx: float, my: float, seq: int = 0) -> None:
+        row = self.rows.get(pid)
+        if row is not None:
+            self.inputs.write(row, pid, seq, mx, my, self.names[pid])
+
+    def poll(self) -> bool:
+        state = self.ring.read()
+        if state is None:
+            return False
+        self.state = state
+        return True
+
+    def get_state(self) -> Dict:
+        return self.state
+
+class Gateway(Server):
+    # A Server without a simulation: its "tick" is a new world appearing in the ring
+    def __init__(self, index: int, gateways: int, listener: socket.socket, ring_name: str, inputs_name: str,
+                 tick_rate: int, send_rate: int, metrics_port: Optional[int], map_size: Tuple[int, int],
+                 input_limit: float, client_budget: int):
+        rows = range(index * GATEWAY_CAPACITY, (index + 1) * GATEWAY_CAPACITY)
+        game = RingGame(SnapshotRing.attach(ring_name), InputTable.attach(inputs_name), rows, *map_size)
+        # A full gateway turns players away like a full server, one input row per player
+        super().__init__("", None, tick_rate=tick_rate, send_rate=send_rate, metrics_port=metrics_port,
+                         map_size=map_size, input_limit=input_limit, client_budget=client_budget, game=game,
+                         max_players=GATEWAY_CAPACITY)
+        self.index = index
+        self.socket = listener
+        self.pid_counter = itertools.count(index, gateways)
+
+    def simulation_loop(self) -> None:
+        while True:
+            start = time.monotonic()
+            if not self.game.poll():
+                time.sleep(RING_POLL)
+                continue
+            self.publish_snapshot()
+            publish_time = time.monotonic() - start
+            self.tick_times.append(publish_time)
+            self.tick_seconds.observe(publish_time)
+            self.wake()
+
+def run_gateway(index: int, gateways: int, listener: socket.socket, ring_name: str, inputs_name: str,
+                tick_rate: int, send_rate: int, metrics_port: Optional[int], map_size: Tuple[int, int],
+                input_limit: float, client_budget: int) -> None:
+    gateway = Gateway(index, gateways, listener, ring_name, inputs_name, tick_rate, send_rate, metrics_port,
+                      map_size, input_limit, client_budget)
+    logger.info(f"Gateway {index} ready (pid {os.getpid()})")
+    try:
+        gateway.run()
+    except KeyboardInterrupt:
+        pass
+
+class Simulation:
+    def __init__(self, host: str, port: int, gateways: int, tick_rate: int = TICK_RATE, engine: str = "python",
+                 send_rate: int = SEND_RATE, metrics_port: Optional[int] = None,
+                 map_size: Tuple[int, int] = (WIDTH, HEIGHT), regions: Optional[int] = None,
+                 input_limit: float = INPUT_LIMIT, seed: Optional[int] = None,
+                 client_budget: int = MAX_CLIENT_BUDGET):
+        width, height = map_size
+        food_count = round(FOOD_COUNT * width * height / (WIDTH * HEIGHT))
+        self.game = create_game(engine, width, height, food_count, regions, seed=seed)
+        self.tick_rate = tick_rate
+        # Room for every row's player and twice the pellets, so a slot never overflows
+        self.ring = SnapshotRing.create(world_size(gateways * GATEWAY_CAPACITY, 2 * food_count))
+        self.inputs = InputTable.create(gateways * GATEWAY_CAPACITY)
+        self.players: Dict[int, int] = {}
+        self.metrics = metrics.Registry()
+        self.tick_seconds = self.metrics.histogram("phago_tick_seconds",
+                                                   "Simulation tick plus ring write time")
+        self.metrics.gauge("phago_players", "Players in the game", lambda: len(self.players))
+        if metrics_port is not None:
+            metrics.serve(self.metrics, METRICS_HOST, metrics_port)
+            logger.info(f"Simulation metrics on http://{METRICS_HOST}:{metrics_port}/metrics")
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(socket.SOMAXCONN)
+        # Like lobby.py's arenas, gateways start from a fresh interpreter (forkserver) and get the listening
+        # socket passed in; every gateway accepts from it, whichever wakes first takes the connection
+        context = multiprocessing.get_context("forkserver")
+        self.gateways: List[multiprocessing.Process] = []
+        for index in range(gateways):
+            gateway_metrics = metrics_port + 1 + index if metrics_port is not None else None
+            process = context.Process(target=run_gateway, daemon=True,
+                                      args=(index, gateways, listener, self.ring.name, self.inputs.name, tick_rate,
+                                            send_rate, gateway_metrics, map_size, input_limit, client_budget))
+            process.start()
+            self.gateways.append(process)
+        listener.close()
+        self.dead: List[int] = []
+        logger.info(f"Arena on {host}:{port} with {gateways} gateway processes")
+
+    def apply_inputs(self) -> None:
+        game = self.game
+        for row, pid, seq, mx, my, name in self.inputs.changed():
+            current = self.players.get(row)
+            if current != pid:
+                if current is not None:
+                    game.remove_player(current)
+                    del self.players[row]
+                if pid is not None:
+                    game.add_player(pid, name)
+                    self.players[row] = pid
+            if pid is not None and seq:
+                game.set_input(pid, mx, my, seq)
+
+    def check_gateways(self) -> None:
+        for index, process in enumerate(self.gateways):
+            if index not in self.dead and not process.is_alive():
+                # Its clients are disconnected with it; take their blobs out of the game
+                logger.error(f"Gateway {index} exited with code {process.exitcode}")
+                self.inputs.clear(range(index * GATEWAY_CAPACITY, (index + 1) * GATEWAY_CAPACITY))
+                self.dead.append(index)
+
+    def run(self) -> None:
+        interval = 1.0 / self.tick_rate
+        last_tick = time.monotonic()
+        next_tick = last_tick + interval
+        next_check = last_tick + LIVENESS_INTERVAL
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            self.apply_inputs()
+            self.game.tick(min(now - last_tick, MAX_TICK_DT))
+            self.ring.write(self.game.get_state())
+            self.tick_seconds.observe(time.monotonic() - now)
+            last_tick = now
+            next_tick += interval
+            if next_tick < now:
+                next_tick = now + interval
+            if now >= next_check:
+                self.check_gateways()
+                next_check = now + LIVENESS_INTERVAL
+
+    def close(self) -> None:
+        for process in self.gateways:
+            process.terminate()
+        for process in self.gateways:
+            process.join(timeout=1)
+        self.ring.close()
+        self.inputs.close()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="phago.io arena with its networking spread over gateway processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--gateways", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help=f"network processes, {GATEWAY_CAPACITY} players each (default: one per spare CPU)")
+    parser.add_argument("--engine", choices=ENGINES, default="python")
+    parser.add_argument("--map-size", type=parse_size, default=(WIDTH, HEIGHT), metavar="WxH")
+    parser.add_argument("--regions", type=int, help="region processes for --engine regions")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    parser.add_argument("--send-rate", type=int, default=SEND_RATE)
+    parser.add_argument("--input-limit", type=float, default=INPUT_LIMIT)
+    parser.add_argument("--client-budget", type=int, default=MAX_CLIENT_BUDGET)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--metrics-port", type=int, help="simulation metrics on this port, gateway N on port + 1 + N")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    simulation = Simulation(args.host, args.port, args.gateways, args.tick_rate, args.engine, args.send_rate,
+                            args.metrics_port, args.map_size, args.regions, args.input_limit, args.seed,
+                            args.client_budget)
+    # The shared memory outlives the process unless close() runs, so a plain kill stops as cleanly as Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        simulation.run()
+    except KeyboardInterrupt:
+        logger.info("Arena stopped")
+    finally:
+        simulation.close()
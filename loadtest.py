@@ -0,0 +1,241 @@
+import argparse
+import collections
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import selectors
+import threading
+import time
+from typing import Deque, Dict, List, Tuple
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from benchmark import process_cpu_seconds
+from client import Client
+from metrics import percentile
+from server import Server, WIDTH, HEIGHT
+
+# Latency samples kept per player and reported per worker process, enough for stable p99s
+MAX_LATENCY_SAMPLES = 50000
+PATTERNS = ("wander", "circle", "still")
+
+def raise_fd_limit() -> None:
+    # Thousands of sockets per process need more than the usual soft limit of 1024 descriptors
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class Script:
+    # Deterministic mouse movement for one simulated player, seeded per client so runs are reproducible
+    def __init__(self, pattern: str, seed: int):
+        self.pattern = pattern
+        self.random = random.Random(seed)
+        self.centre = (self.random.uniform(100, WIDTH - 100), self.random.uniform(100, HEIGHT - 100))
+        self.phase = self.random.uniform(0, 2 * math.pi)
+        self.target = self.centre
+        self.next_turn = 0.0
+
+    def mouse(self, now: float) -> Tuple[float, float]:
+        if self.pattern == "circle":
+            return (self.centre[0] + 100 * math.cos(now + self.phase),
+                    self.centre[1] + 100 * math.sin(now + self.phase))
+        if self.pattern == "wander" and now >= self.next_turn:
+            # A new random waypoint every 1-3 s
+            self.target = (self.random.uniform(0, WIDTH), self.random.uniform(0, HEIGHT))
+            self.next_turn = now + self.random.uniform(1.0, 3.0)
+        return self.target
+
+class SimulatedPlayer:
+    # A real Client steered by a Script. Input-to-state latency is the time from sending an input to the
+    # first snapshot whose input ack covers it.
+    def __init__(self, index: int, host: str, port: int, udp: bool, pattern: str):
+        self.client = Client(f"bot{index}", host, port, udp=udp)
+        self.script = Script(pattern, index)
+        # (input seq, send time) of every input no snapshot has acked yet, oldest first
+        self.sent: Deque[Tuple[int, float]] = collections.deque()
+        self.snapshots = 0
+        self.latencies: List[float] = []
+
+    def send_input(self, now: float) -> None:
+        self.client.send(self.script.mouse(now))
+        self.sent.append((self.client.input_seq, now))
+
+    def receive(self) -> None:
+        state = self.client.receive()
+        if state is None:
+            return
+        arrived = time.monotonic()
+        self.snapshots += 1
+        acked = None
+        while self.sent and self.sent[0][0] <= state['input_ack']:
+            acked = self.sent.popleft()
+        if acked is not None and len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(arrived - acked[1])
+
+    def reset(self) -> None:
+        self.snapshots = 0
+        self.latencies = []
+
+def run_server(port: int, engine: str, udp: bool, send_rate: int, control) -> None:
+    # Server process: serves on a thread and answers "reset" / "stats" requests over the control pipe
+    logging.disable(logging.CRITICAL)
+    raise_fd_limit()
+    server = Server("127.0.0.1", port, engine=engine, udp=udp, send_rate=send_rate)
+    threading.Thread(target=server.run, daemon=True).start()
+    while True:
+        command = control.recv()
+        if command == "reset":
+            server.tick_times.clear()
+        elif command == "stats":
+            control.send(list(server.tick_times))
+            return
+
+def run_clients(host: str, port: int, first: int, count: int, duration: float, input_rate: float, udp: bool,
+                pattern: str, barrier, results) -> None:
+    # Worker process: drives `count` real Client connections from one selectors loop
+    logging.disable(logging.CRITICAL)
+    raise_fd_limit()
+    players = []
+    for index in range(first, first + count):
+        player = SimulatedPlayer(index, host, port, udp, pattern)
+        if player.client.connect():
+            players.append(player)
+    clients = [player.client for player in players]
+    selector = selectors.DefaultSelector()
+    for player in players:
+        selector.register(player.client.socket, selectors.EVENT_READ, player)
+        if player.client.udp is not None:
+            selector.register(player.client.udp, selectors.EVENT_READ, player)
+
+    def drive(until: float) -> None:
+        next_input = time.monotonic()
+        while time.monotonic() < until:
+            now = time.monotonic()
+            if now >= next_input:
+                for player in players:
+                    player.send_input(now)
+                next_input += 1 / input_rate
+            for key, _ in selector.select(max(0.0, min(next_input, until) - time.monotonic())):
+                key.data.receive()
+
+    # Warm up until every worker is connected and receiving, then measure together
+    drive(time.monotonic() + 1.0)
+    barrier.wait()
+    for player in players:
+        player.reset()
+    bytes_start = sum(client.bytes_in for client in clients)
+    start = time.monotonic()
+    drive(start + duration)
+    elapsed = time.monotonic() - start
+    per_player = MAX_LATENCY_SAMPLES // max(len(players), 1)
+    results.put({
+        'clients': len(clients),
+        'connected': sum(client.connected for client in clients),
+        'snapshots': sum(player.snapshots for player in players),
+        'bytes': sum(client.bytes_in for client in clients) - bytes_start,
+        'latencies': [t for player in players for t in player.latencies[:per_player]],
+        'elapsed': elapsed
+    })
+    barrier.wait()
+    for client in clients:
+        client.socket.close()
+
+def run_load(count: int, args: argparse.Namespace, port: int) -> Dict:
+    processes = max(1, min(args.processes, count))
+    control = None
+    server = None
+    if args.connect is None:
+        control, child = multiprocessing.Pipe()
+        server = multiprocessing.Process(target=run_server, args=(port, args.engine, args.udp, args.send_rate, child),
+                                         daemon=True)
+        server.start()
+        host = "127.0.0.1"
+        time.sleep(0.5)
+    else:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+
+    barrier = multiprocessing.Barrier(processes + 1)
+    results = multiprocessing.Queue()
+    workers = []
+    for worker in range(processes):
+        first = count * worker // processes
+        size = count * (worker + 1) // processes - first
+        process = multiprocessing.Process(target=run_clients, daemon=True,
+                                          args=(host, port, first, size, args.duration, args.input_rate,
+                                                args.udp, args.pattern, barrier, results))
+        process.start()
+        workers.append(process)
+
+    barrier.wait()
+    if control is not None:
+        control.send("reset")
+    cpu_start = process_cpu_seconds(server.pid) if server is not None else None
+    start = time.monotonic()
+    reports = [results.get() for _ in workers]
+    elapsed = time.monotonic() - start
+    cpu = (process_cpu_seconds(server.pid) - cpu_start) / elapsed * 100 if server is not None else None
+    tick_times = []
+    if control is not None:
+        control.send("stats")
+        tick_times = [t * 1000 for t in control.recv()]
+    barrier.wait()
+    for process in workers:
+        process.join()
+    if server is not None:
+        server.join(timeout=1)
+        server.terminate()
+
+    clients = sum(report['clients'] for report in reports)
+    latencies = [t * 1000 for report in reports for t in report['latencies']]
+    seconds = max(report['elapsed'] for report in reports)
+    return {
+        'clients': clients,
+        'connected': sum(report['connected'] for report in reports),
+        'tick_times': tick_times,
+        'latencies': latencies,
+        'snapshot_rate': sum(report['snapshots'] for report in reports) / max(clients, 1) / seconds,
+        'kbps': sum(report['bytes'] for report in reports) / max(clients, 1) / seconds / 1024,
+        'cpu': cpu
+    }
+
+def format_ms(values: List[float], fraction: float) -> str:
+    return f"{percentile(values, fraction):.2f}" if values else "n/a"
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Headless phago.io load test: many scripted clients against one server")
+    parser.add_argument("--clients", type=lambda text: [int(n) for n in text.split(",")], default=[100, 300, 1000],
+                        help="simulated clients per run, e.g. 100,500,1000")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per run")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="client worker processes (the server gets its own)")
+    parser.add_argument("--input-rate", type=float, default=30.0, help="inputs per second per client")
+    parser.add_argument("--pattern", choices=PATTERNS, default="wander", help="scripted mouse movement")
+    parser.add_argument("--udp", action="store_true", help="clients use the UDP transport")
+    parser.add_argument("--engine", choices=("python", "numpy"), default="python")
+    parser.add_argument("--send-rate", type=int, default=20, help="server snapshots per second per client")
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="load an already running server instead of starting one (no tick times or CPU)")
+    parser.add_argument("--port", type=int, default=15900, help="first port for the servers this tool starts")
+    return parser.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    raise_fd_limit()
+    print(f"{'clients':>8} {'tick p50':>9} {'tick p99':>9} {'tick max':>9} {'lat p50':>8} {'lat p99':>8} "
+          f"{'snap/s':>7} {'KB/s/cl':>8} {'srv CPU%':>9}")
+    for index, count in enumerate(args.clients):
+        result = run_load(count, args, args.port + index)
+        ticks, latencies = result['tick_times'], result['latencies']
+        cpu = f"{result['cpu']:.1f}" if result['cpu'] is not None else "n/a"
+        tick_max = f"{max(ticks):.2f}" if ticks else "n/a"
+        print(f"{result['connected']:>8} {format_ms(ticks, 0.5):>9} {format_ms(ticks, 0.99):>9} {tick_max:>9} "
+              f"{format_ms(latencies, 0.5):>8} {format_ms(latencies, 0.99):>8} {result['snapshot_rate']:>7.1f} "
+              f"{result['kbps']:>8.2f} {cpu:>9}")
+    print("tick and latency columns in ms; latency is input sent to first snapshot reflecting it")
+
+if __name__ == "__main__":
+    main()
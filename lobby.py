@@ -0,0 +1,327 @@
+import argparse
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import selectors
+import socket
+import struct
+import time
+from typing import Deque, Dict, Optional, Sequence, Tuple
+
+import protocol
+from server import BUFFER_SIZE, DEFAULT_PORT, SEND_RATE, TICK_RATE, Connection, Server
+
+logger = logging.getLogger(__name__)
+
+# Players per arena and how long a finished match stays up so clients can show the winner before the
+# arena's worker exits and the lobby starts a fresh one in its slot
+ARENA_CAPACITY = 50
+MATCH_GRACE = 5.0
+# Lobby <-> arena messages over a SOCK_SEQPACKET pair, one record each: kind and two fields
+#   HANDOFF (ticket, token) + client socket fd    lobby -> arena
+#   DATAGRAM (IPv4 address, port) + the datagram  lobby -> arena
+#   LEFT (ticket, 0)                              arena -> lobby
+#   CLOSED (0, 0): match over, send nobody else   arena -> lobby
+#   BOUNCE (ticket, token) + fd: arrived too late arena -> lobby
+CONTROL = struct.Struct('!BII')
+HANDOFF, DATAGRAM, LEFT, CLOSED, BOUNCE = range(1, 6)
+
+def pack_addr(addr: Tuple[str, int]) -> Tuple[int, int]:
+    return struct.unpack('!I', socket.inet_aton(addr[0]))[0], addr[1]
+
+def unpack_addr(ip: int, port: int) -> Tuple[str, int]:
+    return socket.inet_ntoa(struct.pack('!I', ip)), port
+
+class Arena(Server):
+    # One match in a worker process: a Server without a listening socket, fed client sockets by the lobby.
+    # State datagrams go out through the lobby's UDP socket (passed to the worker), so clients see them come from
+    # the public port; inbound datagrams are read by the lobby and forwarded by token.
+    def __init__(self, slot: int, control: socket.socket, udp_socket: Optional[socket.socket], tick_rate: int,
+                 engine: str, send_rate: int, metrics_port: Optional[int]):
+        super().__init__("", None, tick_rate=tick_rate, engine=engine, send_rate=send_rate,
+                         metrics_port=metrics_port)
+        self.slot = slot
+        self.control = control
+        self.control.setblocking(False)
+        self.udp_socket = udp_socket
+        self.tickets: Dict[Connection, int] = {}
+        self.ended_at: Optional[float] = None
+        self.closed = False
+
+    def register_sources(self) -> None:
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, self.on_wake)
+        self.selector.register(self.control, selectors.EVENT_READ, self.on_control)
+
+    def notify(self, kind: int, a: int = 0, b: int = 0, fds: Sequence[int] = ()) -> None:
+        # Control records are tiny and the lobby drains them promptly, so a blocking send is fine
+        self.control.setblocking(True)
+        socket.send_fds(self.control, [CONTROL.pack(kind, a, b)], list(fds))
+        self.control.setblocking(False)
+
+    def on_control(self) -> None:
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.control, BUFFER_SIZE, 1)
+            except BlockingIOError:
+                return
+            if not data:
+                # The lobby is gone; nobody can join or leave any more
+                logger.info(f"Arena {self.slot}: lobby closed, stopping")
+                self.running = False
+                return
+            kind, a, b = CONTROL.unpack_from(data)
+            if kind == DATAGRAM:
+                self.handle_datagram(data[CONTROL.size:], unpack_addr(a, b))
+            elif kind == HANDOFF:
+                self.on_handoff(a, b, fds[0])
+
+    def on_handoff(self, ticket: int, token: int, fd: int) -> None:
+        if self.closed:
+            # Crossed our CLOSED notice on the way here; hand it back to be placed in another arena
+            self.notify(BOUNCE, ticket, token, [fd])
+            os.close(fd)
+            return
+        sock = socket.socket(fileno=fd)
+        try:
+            addr = sock.getpeername()
+        except OSError:
+            sock.close()
+            self.notify(LEFT, ticket)
+            return
+        conn = self.adopt(sock, addr)
+        # The lobby hands out tokens (unique across arenas); admit() sends it in WELCOME
+        conn.token = token
+        self.tickets[conn] = ticket
+        logger.info(f"Arena {self.slot}: player from {addr} joined")
+
+    def drop(self, conn: Connection) -> None:
+        super().drop(conn)
+        ticket = self.tickets.pop(conn, None)
+        if ticket is not None:
+            self.notify(LEFT, ticket)
+
+    def publish_snapshot(self) -> None:
+        super().publish_snapshot()
+        if self.ended_at is None and self.game.start_time is not None and self.latest_snapshot['time_left'] <= 0:
+            self.ended_at = time.monotonic()
+
+    def broadcast(self) -> None:
+        super().broadcast()
+        if self.ended_at is None:
+            return
+        if not self.closed:
+            self.closed = True
+            self.notify(CLOSED)
+            logger.info(f"Arena {self.slot}: match over")
+        if time.monotonic() - self.ended_at >= MATCH_GRACE:
+            for conn in list(self.tickets):
+                self.drop(conn)
+            self.running = False
+
+def run_arena(slot: int, control: socket.socket, udp_socket: Optional[socket.socket], tick_rate: int, engine: str,
+              send_rate: int, metrics_port: Optional[int]) -> None:
+    arena = Arena(slot, control, udp_socket, tick_rate, engine, send_rate, metrics_port)
+    arena.run()
+
+class Slot:
+    # The lobby's view of one arena worker
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.control: Optional[socket.socket] = None
+        self.players = 0
+        self.open = False
+
+class Lobby:
+    # Front door: accepts every connection, places it in the fullest arena that still has room (so
+    # matches fill up rather than spreading a few players over every arena) and passes the socket to that
+    # arena's process. Each arena simulates on its own core; the lobby only routes.
+    def __init__(self, host: str, port: int, arenas: int, capacity: int = ARENA_CAPACITY, tick_rate: int = TICK_RATE,
+                 engine: str = "python", udp: bool = False, send_rate: int = SEND_RATE,
+                 metrics_port: Optional[int] = None):
+        self.capacity = capacity
+        self.tick_rate = tick_rate
+        self.engine = engine
+        self.send_rate = send_rate
+        self.metrics_port = metrics_port
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.setblocking(False)
+        self.udp_socket: Optional[socket.socket] = None
+        if udp:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(self.socket.getsockname())
+            self.udp_socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        if self.udp_socket is not None:
+            self.selector.register(self.udp_socket, selectors.EVENT_READ, None)
+        # Arena workers start from a fresh interpreter (forkserver) so they never inherit the sockets of
+        # clients waiting in the lobby, which would keep those connections open after their arena drops them
+        self.context = multiprocessing.get_context("forkserver")
+        self.slots = [Slot(index) for index in range(arenas)]
+        # Connections waiting for room: (socket, ticket, token)
+        self.waiting: Deque[Tuple[socket.socket, int, int]] = collections.deque()
+        self.tickets = itertools.count(1)
+        # UDP token -> (arena slot, ticket), and ticket -> token to clean it up when the player leaves
+        self.routes: Dict[int, Tuple[Slot, int]] = {}
+        self.ticket_tokens: Dict[int, int] = {}
+        logger.info(f"Lobby on {host}:{port} with {arenas} arenas of {capacity} players")
+
+    def start_arena(self, slot: Slot) -> None:
+        lobby_end, arena_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        metrics_port = self.metrics_port + slot.index if self.metrics_port is not None else None
+        slot.process = self.context.Process(target=run_arena, daemon=True,
+                                               args=(slot.index, arena_end, self.udp_socket, self.tick_rate,
+                                                     self.engine, self.send_rate, metrics_port))
+        slot.process.start()
+        arena_end.close()
+        lobby_end.setblocking(False)
+        slot.control = lobby_end
+        slot.players = 0
+        slot.open = True
+        self.selector.register(lobby_end, selectors.EVENT_READ, slot)
+        logger.info(f"Arena {slot.index} started (pid {slot.process.pid})")
+
+    def recycle(self, slot: Slot) -> None:
+        # The worker exits once its match is over (or if it crashed); start a fresh one in its place
+        self.selector.unregister(slot.control)
+        slot.control.close()
+        slot.process.join(timeout=1)
+        for token, (route_slot, ticket) in list(self.routes.items()):
+            if route_slot is slot:
+                del self.routes[token]
+                self.ticket_tokens.pop(ticket, None)
+        self.start_arena(slot)
+
+    def place(self) -> None:
+        while self.waiting:
+            open_slots = [slot for slot in self.slots if slot.open and slot.players < self.capacity]
+            if not open_slots:
+                return
+            slot = max(open_slots, key=lambda slot: slot.players)
+            sock, ticket, token = self.waiting.popleft()
+            try:
+                # Blocking, so a control buffer full of forwarded datagrams delays the handoff instead of failing it
+                slot.control.setblocking(True)
+                socket.send_fds(slot.control, [CONTROL.pack(HANDOFF, ticket, token)], [sock.fileno()])
+            except OSError as e:
+                logger.error(f"Handoff to arena {slot.index} failed: {e}")
+                sock.close()
+                continue
+            finally:
+                slot.control.setblocking(False)
+            # The arena holds its own copy of the descriptor now
+            sock.close()
+            slot.players += 1
+            if token:
+                self.routes[token] = (slot, ticket)
+                self.ticket_tokens[ticket] = token
+
+    def new_token(self) -> int:
+        if self.udp_socket is None:
+            return 0
+        token = 0
+        while not token or token in self.routes:
+            token = random.getrandbits(32)
+        return token
+
+    def accept_ready(self) -> None:
+        while True:
+            try:
+                sock, addr = self.socket.accept()
+            except BlockingIOError:
+                break
+            logger.info(f"New connection from {addr}")
+            self.waiting.append((sock, next(self.tickets), self.new_token()))
+        self.place()
+        if self.waiting:
+            logger.info(f"All arenas full, {len(self.waiting)} players waiting")
+
+    def on_control(self, slot: Slot) -> None:
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(slot.control, CONTROL.size, 1)
+            except BlockingIOError:
+                break
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                logger.info(f"Arena {slot.index} exited")
+                self.recycle(slot)
+                break
+            kind, ticket, token = CONTROL.unpack(data)
+            if kind == LEFT:
+                slot.players -= 1
+                self.routes.pop(self.ticket_tokens.pop(ticket, 0), None)
+            elif kind == CLOSED:
+                slot.open = False
+            elif kind == BOUNCE:
+                slot.players -= 1
+                self.routes.pop(token, None)
+                self.ticket_tokens.pop(ticket, None)
+                self.waiting.appendleft((socket.socket(fileno=fds[0]), ticket, token))
+        self.place()
+
+    def on_datagram(self) -> None:
+        while True:
+            try:
+                data, addr = self.udp_socket.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue
+            # Route by the token at the front of the input; the arena validates the rest
+            try:
+                msg_type, payload = protocol.decode_datagram(data)
+                token = protocol.decode_udp_input(payload)[0] if msg_type == protocol.MSG_UDP_INPUT else 0
+            except (protocol.ProtocolError, struct.error):
+                continue
+            route = self.routes.get(token)
+            if route is None:
+                continue
+            try:
+                route[0].control.send(CONTROL.pack(DATAGRAM, *pack_addr(addr)) + data)
+            except (BlockingIOError, OSError):
+                # Arena busy or restarting: inputs are latest-value-wins, drop this one
+                pass
+
+    def run(self) -> None:
+        for slot in self.slots:
+            self.start_arena(slot)
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.socket:
+                    self.accept_ready()
+                elif key.fileobj is self.udp_socket:
+                    self.on_datagram()
+                else:
+                    self.on_control(key.data)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="phago.io lobby: many arenas, one worker process each")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--arenas", type=int, default=os.cpu_count() or 1, help="arena worker processes")
+    parser.add_argument("--capacity", type=int, default=ARENA_CAPACITY, help="players per arena")
+    # Each arena is already its own process, so the multi-process regions engine is not offered here
+    parser.add_argument("--engine", choices=("python", "numpy"), default="python")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    parser.add_argument("--send-rate", type=int, default=SEND_RATE)
+    parser.add_argument("--udp", action="store_true", help="also accept input and send state over UDP")
+    parser.add_argument("--metrics-port", type=int, help="arena N serves metrics on this port + N")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    lobby = Lobby(args.host, args.port, args.arenas, args.capacity, args.tick_rate, args.engine, args.udp,
+                  args.send_rate, args.metrics_port)
+    try:
+        lobby.run()
+    except KeyboardInterrupt:
+        logger.info("Lobby stopped")
@@ -0,0 +1,198 @@
+import argparse
+import heapq
+import itertools
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 65536
+
+class LossyProxy:
+    # Local stand-in for a bad network between client and server, forwarding both TCP and UDP on one port.
+    # Every packet is delayed by delay +- jitter. A lost datagram is dropped; a "lost" TCP chunk is held
+    # back for a retransmission timeout, and since the stream is ordered every later chunk waits behind it
+    # (head-of-line blocking), which is what a real segment loss does to a TCP connection.
+    def __init__(self, listen_port: int, target_host: str, target_port: int, loss: float = 0.0,
+                 delay: float = 0.0, jitter: float = 0.0, rto: float = 0.2, seed: Optional[int] = None):
+        self.target = (target_host, target_port)
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.rto = rto
+        self.random = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", listen_port))
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.setblocking(False)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", listen_port))
+        self.udp.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, ("accept", None))
+        self.selector.register(self.udp, selectors.EVENT_READ, ("client_udp", None))
+        # TCP peer socket -> the socket its data is forwarded to, and the time the last scheduled chunk
+        # of that direction is delivered (chunks never overtake each other)
+        self.peers: Dict[socket.socket, socket.socket] = {}
+        self.stream_due: Dict[socket.socket, float] = {}
+        # Client UDP address -> our upstream UDP socket for it, so the server sees one address per client
+        self.upstreams: Dict[Tuple[str, int], socket.socket] = {}
+        self.queue: List[Tuple[float, int, object, bytes, Optional[Tuple[str, int]]]] = []
+        self.counter = itertools.count()
+        self.forwarded = 0
+        self.dropped = 0
+
+    def latency(self) -> float:
+        return max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+
+    def lost(self) -> bool:
+        return self.random.random() < self.loss
+
+    def schedule(self, due: float, sock, data: bytes, addr: Optional[Tuple[str, int]] = None) -> None:
+        heapq.heappush(self.queue, (due, next(self.counter), sock, data, addr))
+
+    def accept(self) -> None:
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            upstream = socket.create_connection(self.target)
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setblocking(False)
+                self.selector.register(sock, selectors.EVENT_READ, ("stream", None))
+            self.peers[client] = upstream
+            self.peers[upstream] = client
+
+    def close_stream(self, sock: socket.socket) -> None:
+        for end in (sock, self.peers.pop(sock, None)):
+            if end is None:
+                continue
+            self.peers.pop(end, None)
+            self.stream_due.pop(end, None)
+            try:
+                self.selector.unregister(end)
+            except (KeyError, ValueError):
+                pass
+            end.close()
+
+    def on_stream(self, sock: socket.socket) -> None:
+        try:
+            data = sock.recv(BUFFER_SIZE)
+        except OSError:
+            data = b""
+        if not data:
+            self.close_stream(sock)
+            return
+        now = time.monotonic()
+        due = now + self.latency()
+        if self.lost():
+            due += self.rto
+            self.dropped += 1
+        due = max(due, self.stream_due.get(sock, now))
+        self.stream_due[sock] = due
+        self.schedule(due, self.peers[sock], data)
+
+    def on_client_datagram(self) -> None:
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue
+            upstream = self.upstreams.get(addr)
+            if upstream is None:
+                upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                upstream.connect(self.target)
+                upstream.setblocking(False)
+                self.selector.register(upstream, selectors.EVENT_READ, ("server_udp", addr))
+                self.upstreams[addr] = upstream
+            self.forward_datagram(upstream, data, None)
+
+    def on_server_datagram(self, upstream: socket.socket, client_addr: Tuple[str, int]) -> None:
+        while True:
+            try:
+                data = upstream.recv(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue
+            self.forward_datagram(self.udp, data, client_addr)
+
+    def forward_datagram(self, sock: socket.socket, data: bytes, addr: Optional[Tuple[str, int]]) -> None:
+        if self.lost():
+            self.dropped += 1
+            return
+        # Independent delays, so jitter larger than the packet spacing reorders datagrams
+        self.schedule(time.monotonic() + self.latency(), sock, data, addr)
+
+    def deliver_due(self) -> None:
+        now = time.monotonic()
+        while self.queue and self.queue[0][0] <= now:
+            _, _, sock, data, addr = heapq.heappop(self.queue)
+            try:
+                if sock.type == socket.SOCK_DGRAM:
+                    if addr is None:
+                        sock.send(data)
+                    else:
+                        sock.sendto(data, addr)
+                elif sock in self.peers:
+                    # Test traffic is small; block briefly rather than keep a second queue per stream
+                    sock.setblocking(True)
+                    sock.sendall(data)
+                    sock.setblocking(False)
+                self.forwarded += 1
+            except OSError as e:
+                logger.debug(f"Forwarding failed: {e}")
+
+    def run(self) -> None:
+        logger.info(f"Proxying {self.listener.getsockname()[1]} -> {self.target[0]}:{self.target[1]} "
+                    f"(loss {self.loss:.0%}, delay {self.delay * 1000:.0f} ms +- {self.jitter * 1000:.0f} ms)")
+        while True:
+            timeout = max(0.0, self.queue[0][0] - time.monotonic()) if self.queue else None
+            for key, _ in self.selector.select(timeout):
+                kind, addr = key.data
+                if kind == "accept":
+                    self.accept()
+                elif kind == "stream":
+                    if key.fileobj in self.peers:
+                        self.on_stream(key.fileobj)
+                elif kind == "client_udp":
+                    self.on_client_datagram()
+                else:
+                    self.on_server_datagram(key.fileobj, addr)
+            self.deliver_due()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Forward TCP and UDP to a phago.io server with packet loss and latency")
+    parser.add_argument("--listen-port", type=int, default=1402, help="port clients connect to")
+    parser.add_argument("--target", default="127.0.0.1:1401", help="server host:port")
+    parser.add_argument("--loss", type=float, default=0.02, help="packet loss probability (0-1)")
+    parser.add_argument("--delay", type=float, default=40.0, help="one-way delay in ms")
+    parser.add_argument("--jitter", type=float, default=10.0, help="delay variation in ms (+-)")
+    parser.add_argument("--rto", type=float, default=200.0, help="TCP retransmission stall per lost chunk in ms")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    host, port = args.target.rsplit(":", 1)
+    proxy = LossyProxy(args.listen_port, host, int(port), loss=args.loss, delay=args.delay / 1000,
+                       jitter=args.jitter / 1000, rto=args.rto / 1000)
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        logger.info(f"Forwarded {proxy.forwarded} packets, dropped or stalled {proxy.dropped}")
@@ -0,0 +1,155 @@
+import bisect
+import http.server
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# In-process server metrics, served as Prometheus-style text over HTTP. Recording is a few attribute
+# updates with no locking: metrics are written from the simulation thread and the event loop, and a
+# rare lost increment under the GIL is an acceptable price for keeping them off the hot paths' critical
+# sections. Scrapes read whatever values are current.
+SECONDS_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+BYTES_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    # Nearest-rank percentile of raw samples, for the offline tools' reports (benchmark, loadtest, replay)
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+class Gauge:
+    # Either set directly or computed by `read` when scraped, so values that are cheap to derive from
+    # existing state (connected players, queued bytes) cost nothing between scrapes
+    def __init__(self, name: str, help_text: str, read: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> List[str]:
+        value = self.read() if self.read is not None else self.value
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    # Fixed buckets; counts are kept per bucket and made cumulative only when rendered
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {total}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total + self.counts[-1]}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, read: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help_text, read))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = SECONDS_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class TimedLock:
+    # Drop-in for threading.Lock that records how long acquirers waited and, given a `hold` histogram,
+    # how long each held it. An uncontended acquire takes the non-blocking fast path and is counted as a
+    # zero wait without reading the clock.
+    def __init__(self, wait: Histogram, lock: Optional[threading.Lock] = None, hold: Optional[Histogram] = None):
+        self.lock = lock if lock is not None else threading.Lock()
+        self.wait = wait
+        self.hold = hold
+        # Only the holder writes this, so it needs no protection of its own
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.lock.acquire(False):
+            self.wait.observe(0.0)
+        elif not blocking:
+            return False
+        else:
+            start = time.perf_counter()
+            if not self.lock.acquire(True, timeout):
+                return False
+            self.wait.observe(time.perf_counter() - start)
+        if self.hold is not None:
+            self.acquired_at = time.perf_counter()
+        return True
+
+    def release(self) -> None:
+        if self.hold is not None:
+            self.hold.observe(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+def serve(registry: Registry, host: str, port: int) -> Tuple[http.server.ThreadingHTTPServer, threading.Thread]:
+    # Plain-text endpoint on its own daemon thread; any GET path returns the current metrics
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, thread
@@ -0,0 +1,40 @@
+from typing import Tuple
+
+# Blob movement rules, shared by the server simulation (Player.move and the NumPy engine) and the
+# client's local prediction of its own blob, so both step a blob identically
+SENSITIVITY = 1.5
+BORDER_MARGIN = 50
+BORDER_BOOST = 1.5
+
+def speed_of(size: float, sensitivity: float = SENSITIVITY) -> float:
+    return (1000 / size) * 1.1 * sensitivity
+
+def step(x: float, y: float, size: float, mx: float, my: float, last_dx: float, last_dy: float, dt: float,
+         width: int, height: int, sensitivity: float = SENSITIVITY) -> Tuple[float, float, float, float]:
+    # One movement step towards the target (mx, my); returns the new position and heading.
+    # With no offset to the target the blob keeps drifting along its last heading.
+    dx = mx - x
+    dy = my - y
+    dist = (dx**2 + dy**2)**0.5
+    speed = speed_of(size, sensitivity)
+
+    speed_boost = 1.0
+    if x < BORDER_MARGIN or x > width - BORDER_MARGIN:
+        speed_boost = BORDER_BOOST
+    if y < BORDER_MARGIN or y > height - BORDER_MARGIN:
+        speed_boost = max(speed_boost, BORDER_BOOST)
+
+    speed *= speed_boost
+
+    if dist > 0:
+        last_dx = dx / dist
+        last_dy = dy / dist
+        x += last_dx * speed * dt
+        y += last_dy * speed * dt
+    elif last_dx != 0 or last_dy != 0:
+        x += last_dx * speed * dt
+        y += last_dy * speed * dt
+
+    x = max(size * 0.5, min(width - size * 0.5, x))
+    y = max(size * 0.5, min(height - size * 0.5, y))
+    return x, y, last_dx, last_dy
@@ -0,0 +1,273 @@
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from movement import BORDER_BOOST, BORDER_MARGIN, speed_of
+from profiler import NULL_PROFILER
+from server import GAME_DURATION, FOOD_COUNT, FOOD_SIZE, GRID_CELL_SIZE
+
+logger = logging.getLogger(__name__)
+
+START_SIZE = 20
+DECAY_FACTOR = 0.98
+
+def candidate_pairs(qx: np.ndarray, qy: np.ndarray, radius: np.ndarray, tx: np.ndarray, ty: np.ndarray,
+                    width: int, height: int, cell_size: float = GRID_CELL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    # Vectorized uniform-grid broad phase: (query, target) index pairs whose cells overlap each query's
+    # radius. Targets are bucketed by sorting on their cell key, then every covered cell of every query is
+    # turned into a [start, end) range of that sorted order and the ranges are expanded in one pass.
+    cols = int(width // cell_size) + 1
+    rows = int(height // cell_size) + 1
+    t_key = (tx // cell_size).astype(np.int64) * rows + (ty // cell_size).astype(np.int64)
+    t_order = np.argsort(t_key, kind='stable')
+    t_sorted = t_key[t_order]
+
+    cx0 = np.clip((qx - radius) // cell_size, 0, cols - 1).astype(np.int64)
+    cx1 = np.clip((qx + radius) // cell_size, 0, cols - 1).astype(np.int64)
+    cy0 = np.clip((qy - radius) // cell_size, 0, rows - 1).astype(np.int64)
+    cy1 = np.clip((qy + radius) // cell_size, 0, rows - 1).astype(np.int64)
+    span_y = cy1 - cy0 + 1
+    cells_per_query = (cx1 - cx0 + 1) * span_y
+    cell_query = np.repeat(np.arange(len(qx)), cells_per_query)
+    local = np.arange(len(cell_query)) - np.repeat(np.cumsum(cells_per_query) - cells_per_query, cells_per_query)
+    keys = (cx0[cell_query] + local // span_y[cell_query]) * rows + cy0[cell_query] + local % span_y[cell_query]
+
+    starts = np.searchsorted(t_sorted, keys, side='left')
+    counts = np.searchsorted(t_sorted, keys, side='right') - starts
+    pair_query = np.repeat(cell_query, counts)
+    offsets = np.arange(len(pair_query)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_target = t_order[np.repeat(starts, counts) + offsets]
+    return pair_query, pair_target
+
+class NumpyGame:
+    # Struct-of-arrays version of Game: one slot per player in contiguous arrays, same rules and interface.
+    # Eat candidates are found against the sizes and positions at the start of the pass, so growth from an
+    # earlier eat in the same tick only widens a blob's reach from the next tick on.
+    def __init__(self, width: int, height: int, food_count: int = FOOD_COUNT, capacity: int = 64,
+                 seed: Optional[int] = None, clock: Callable[[], float] = time.time):
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock
+        self.recorder = None
+        self.profiler = NULL_PROFILER
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.decay_elapsed = 0.0
+        self.pending_inputs: Dict[int, Tuple[float, float, int]] = {}
+        self.input_lock = threading.Lock()
+
+        self.slots: Dict[int, int] = {}
+        self.names: Dict[int, str] = {}
+        self.free_slots: List[int] = []
+        self.order = np.empty(0, dtype=np.int64)
+        self._allocate(capacity)
+
+        self.food_x = self.rng.integers(0, width - 10, size=food_count, endpoint=True)
+        self.food_y = self.rng.integers(0, height - 10, size=food_count, endpoint=True)
+        self.food_size = np.full(food_count, FOOD_SIZE, dtype=np.int64)
+        self.food_id = np.arange(food_count, dtype=np.int64)
+        self.next_food_id = food_count
+        self.seq = 0
+
+    def _allocate(self, capacity: int) -> None:
+        old = getattr(self, 'pid', None)
+        used = 0 if old is None else len(old)
+        arrays = {
+            'pid': np.int64, 'x': np.float64, 'y': np.float64, 'size': np.float64, 'score': np.int64,
+            'last_dx': np.float64, 'last_dy': np.float64, 'target_x': np.float64, 'target_y': np.float64,
+            'has_target': np.bool_, 'input_seq': np.int64,
+        }
+        for attr, dtype in arrays.items():
+            grown = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                grown[:used] = getattr(self, attr)
+            setattr(self, attr, grown)
+        self.free_slots.extend(range(capacity - 1, used - 1, -1))
+
+    def _rebuild_order(self) -> None:
+        # Active slots in join (pid) order, matching dict iteration order in Game
+        self.order = np.array([self.slots[pid] for pid in sorted(self.slots)], dtype=np.int64)
+
+    @property
+    def player_count(self) -> int:
+        return len(self.slots)
+
+    def add_player(self, pid: int, name: str) -> None:
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.join(pid, name)
+            if not self.slots:
+                self.start_time = self.clock()
+                logger.info("First player joined, starting game timer")
+            if not self.free_slots:
+                self._allocate(len(self.pid) * 2)
+            slot = self.free_slots.pop()
+            self.slots[pid] = slot
+            self.names[pid] = name
+            self.pid[slot] = pid
+            self.x[slot] = self.rng.integers(0, self.width, endpoint=True)
+            self.y[slot] = self.rng.integers(0, self.height, endpoint=True)
+            self.size[slot] = START_SIZE
+            self.score[slot] = 0
+            self.last_dx[slot] = 0
+            self.last_dy[slot] = 0
+            self.has_target[slot] = False
+            self.input_seq[slot] = 0
+            self._rebuild_order()
+            logger.info(f"Added player {pid}: {name}")
+
+    def remove_player(self, pid: int) -> None:
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.leave(pid)
+            with self.input_lock:
+                self.pending_inputs.pop(pid, None)
+            slot = self.slots.pop(pid, None)
+            if slot is not None:
+                del self.names[pid]
+                self.has_target[slot] = False
+                self.free_slots.append(slot)
+                self._rebuild_order()
+                logger.info(f"Removed player {pid}")
+
+    def set_input(self, pid: int, mx: float, my: float, seq: int = 0) -> None:
+        with self.input_lock:
+            self.pending_inputs[pid] = (mx, my, seq)
+
+    def tick(self, dt: float) -> None:
+        with self.lock:
+            self.seq += 1
+            profiler = self.profiler
+            start = profiler.begin()
+            self.move_players(dt)
+            profiler.end("move_players", start)
+            start = profiler.begin()
+            self.check_eat()
+            profiler.end("check_eat", start)
+            start = profiler.begin()
+            self.decay(dt)
+            profiler.end("decay", start)
+
+    def move_players(self, dt: float) -> None:
+        with self.input_lock:
+            inputs, self.pending_inputs = self.pending_inputs, {}
+        if self.recorder is not None:
+            self.recorder.tick(dt, inputs)
+        for pid, (mx, my, seq) in inputs.items():
+            slot = self.slots.get(pid)
+            if slot is not None:
+                self.target_x[slot] = mx
+                self.target_y[slot] = my
+                self.has_target[slot] = True
+                self.input_seq[slot] = seq
+
+        idx = self.order[self.has_target[self.order]]
+        if not len(idx):
+            return
+        x, y, size = self.x[idx], self.y[idx], self.size[idx]
+        dx = self.target_x[idx] - x
+        dy = self.target_y[idx] - y
+        dist = np.hypot(dx, dy)
+        speed = speed_of(size)
+        near_border = ((x < BORDER_MARGIN) | (x > self.width - BORDER_MARGIN)
+                       | (y < BORDER_MARGIN) | (y > self.height - BORDER_MARGIN))
+        speed *= np.where(near_border, BORDER_BOOST, 1.0)
+
+        # With no offset to the target keep drifting along the last direction (zero if never moved)
+        moving = dist > 0
+        safe_dist = np.where(moving, dist, 1.0)
+        dir_x = np.where(moving, dx / safe_dist, self.last_dx[idx])
+        dir_y = np.where(moving, dy / safe_dist, self.last_dy[idx])
+        self.last_dx[idx] = dir_x
+        self.last_dy[idx] = dir_y
+
+        half = size * 0.5
+        self.x[idx] = np.clip(x + dir_x * speed * dt, half, self.width - half)
+        self.y[idx] = np.clip(y + dir_y * speed * dt, half, self.height - half)
+
+    def check_eat(self) -> None:
+        idx = self.order
+        if not len(idx):
+            return
+        self._eat_players(idx)
+        self._eat_food(idx)
+
+    def _eat_players(self, idx: np.ndarray) -> None:
+        x, y, size = self.x[idx], self.y[idx], self.size[idx]
+        qi, ti = candidate_pairs(x, y, size, x, y, self.width, self.height)
+        hit = (size[qi] > size[ti]) & ((x[qi] - x[ti])**2 + (y[qi] - y[ti])**2 < size[qi]**2)
+        if not hit.any():
+            return
+        # Blob-on-blob eats are rare; resolve them sequentially in pid order so chains match Game
+        qi, ti = qi[hit], ti[hit]
+        order = np.lexsort((ti, qi))
+        for i, j in zip(qi[order].tolist(), ti[order].tolist()):
+            a, b = idx[i], idx[j]
+            if self.size[a] <= self.size[b]:
+                continue
+            if (self.x[a] - self.x[b])**2 + (self.y[a] - self.y[b])**2 >= self.size[a]**2:
+                continue
+            logger.info(f"Player {self.pid[a]} (size {self.size[a]}) ate {self.pid[b]} (size {self.size[b]})")
+            self.size[a] += self.size[b] * 0.5
+            self.score[a] += int(self.score[b] / 2)
+            self.size[b] = START_SIZE
+            self.score[b] = 0
+            self.x[b] = self.rng.integers(0, self.width - START_SIZE, endpoint=True)
+            self.y[b] = self.rng.integers(0, self.height - START_SIZE, endpoint=True)
+
+    def _eat_food(self, idx: np.ndarray) -> None:
+        x, y, size = self.x[idx], self.y[idx], self.size[idx]
+        qi, fi = candidate_pairs(x, y, size + FOOD_SIZE, self.food_x, self.food_y, self.width, self.height)
+        reach = size[qi] + self.food_size[fi]
+        hit = (x[qi] - self.food_x[fi])**2 + (y[qi] - self.food_y[fi])**2 < reach**2
+        if not hit.any():
+            return
+        # A pellet goes to the first player (in pid order) that touches it
+        qi, fi = qi[hit], fi[hit]
+        order = np.lexsort((qi, fi))
+        qi, fi = qi[order], fi[order]
+        first = np.ones(len(fi), dtype=np.bool_)
+        first[1:] = fi[1:] != fi[:-1]
+        eater, eaten = qi[first], fi[first]
+
+        gained = np.bincount(eater, weights=self.food_size[eaten], minlength=len(idx)).astype(np.int64)
+        self.size[idx] += gained
+        self.score[idx] += gained
+        self.food_x[eaten] = self.rng.integers(0, self.width - 10, size=len(eaten), endpoint=True)
+        self.food_y[eaten] = self.rng.integers(0, self.height - 10, size=len(eaten), endpoint=True)
+        self.food_id[eaten] = np.arange(self.next_food_id, self.next_food_id + len(eaten))
+        self.next_food_id += len(eaten)
+
+    def decay(self, dt: float) -> None:
+        self.decay_elapsed += dt
+        if self.decay_elapsed >= 1.0:
+            idx = self.order
+            grown = idx[self.size[idx] > START_SIZE]
+            self.size[grown] *= DECAY_FACTOR
+            self.decay_elapsed -= 1.0
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            if self.start_time is None:
+                elapsed = GAME_DURATION
+            else:
+                elapsed = int(GAME_DURATION - (self.clock() - self.start_time))
+            idx = self.order
+            pids = self.pid[idx].tolist()
+            players = zip(pids, self.x[idx].tolist(), self.y[idx].tolist(), self.size[idx].tolist(),
+                          self.score[idx].tolist())
+            food = zip(self.food_x.tolist(), self.food_y.tolist(), self.food_size.tolist())
+            state = {
+                'seq': self.seq,
+                'players': {pid: (x, y, size, self.names[pid], score) for pid, x, y, size, score in players},
+                'food': dict(zip(self.food_id.tolist(), food)),
+                'time_left': elapsed if elapsed > 0 else 0,
+                'input_acks': dict(zip(pids, self.input_seq[idx].tolist()))
+            }
+            if self.recorder is not None:
+                self.recorder.checkpoint(state)
+            return state
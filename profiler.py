@@ -0,0 +1,148 @@
+import array
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Opt-in per-phase timings for the server loop and the client frame. Code brackets a phase with
+#   start = profiler.begin() ... profiler.end("check_eat", start)
+# and an enabled Profiler stores (phase, start, end, thread) in preallocated arrays used as a ring, so
+# recording allocates nothing and only the newest PROFILE_CAPACITY phases are kept. Disabled, everything
+# holds NULL_PROFILER, whose calls do nothing. Like metrics.py, the ring is written without a lock: two
+# threads ending a phase at the same instant can overwrite one slot, which a profile can live with.
+# dump() writes Chrome trace events (.json, for chrome://tracing or Perfetto) or folded stacks (any other
+# name, for flamegraph.pl or speedscope), nesting phases by time within each thread.
+# A cProfile window covers the next N ticks of the thread that calls tick(), then writes a .prof file.
+PROFILE_CAPACITY = 1 << 16
+CPROFILE_TICKS = 300
+
+class NullProfiler:
+    enabled = False
+
+    def begin(self) -> int:
+        return 0
+
+    def end(self, phase: str, start: int) -> None:
+        pass
+
+    def tick(self) -> None:
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, capacity: int = PROFILE_CAPACITY, cprofile_ticks: int = CPROFILE_TICKS):
+        self.capacity = capacity
+        self.phases = array.array('H', bytes(2 * capacity))
+        self.starts = array.array('q', bytes(8 * capacity))
+        self.ends = array.array('q', bytes(8 * capacity))
+        self.threads = array.array('Q', bytes(8 * capacity))
+        self.next = 0
+        self.recorded = 0
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.thread_names: Dict[int, str] = {}
+        self.origin = time.perf_counter_ns()
+        self.begin = time.perf_counter_ns
+        self.cprofile_ticks = cprofile_ticks
+        self.cprofile_requested = False
+        self.cprofile: Optional[cProfile.Profile] = None
+        self.cprofile_left = 0
+
+    def end(self, phase: str, start: int) -> None:
+        now = time.perf_counter_ns()
+        phase_id = self.ids.get(phase)
+        if phase_id is None:
+            phase_id = self.ids[phase] = len(self.names)
+            self.names.append(phase)
+        thread = threading.get_ident()
+        if thread not in self.thread_names:
+            self.thread_names[thread] = threading.current_thread().name
+        i = self.next
+        self.next = i + 1 if i + 1 < self.capacity else 0
+        self.phases[i] = phase_id
+        self.starts[i] = start
+        self.ends[i] = now
+        self.threads[i] = thread
+        self.recorded += 1
+
+    def request_cprofile(self) -> None:
+        # Safe from a signal handler or another thread: the window opens at the next tick()
+        self.cprofile_requested = True
+
+    def tick(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile_left -= 1
+            if self.cprofile_left <= 0:
+                self.cprofile.disable()
+                path = f"cprofile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+                self.cprofile.dump_stats(path)
+                self.cprofile = None
+                logger.info(f"cProfile of {self.cprofile_ticks} ticks written to {path} (python -m pstats {path})")
+        elif self.cprofile_requested:
+            self.cprofile_requested = False
+            self.cprofile_left = self.cprofile_ticks
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            logger.info(f"cProfile running for {self.cprofile_ticks} ticks")
+
+    def spans(self) -> List[Tuple[int, int, int, int]]:
+        # Recorded phases, oldest first: (thread, start ns, end ns, phase id)
+        count = min(self.recorded, self.capacity)
+        first = self.next - count if self.recorded <= self.capacity else self.next
+        order = [(first + k) % self.capacity for k in range(count)]
+        return [(self.threads[i], self.starts[i], self.ends[i], self.phases[i]) for i in order]
+
+    def chrome_trace(self) -> Dict:
+        pid = os.getpid()
+        events = [{'name': self.names[phase], 'ph': 'X', 'pid': pid, 'tid': thread,
+                   'ts': (start - self.origin) / 1000, 'dur': (end - start) / 1000}
+                  for thread, start, end, phase in self.spans()]
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': name}}
+                      for thread, name in self.thread_names.items())
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def folded(self) -> Dict[str, int]:
+        # Self time in microseconds per stack "thread;outer;inner". A phase that starts inside another
+        # one on the same thread is nested under it (phases end in order, children before parents).
+        totals: Dict[str, int] = {}
+        by_thread: Dict[int, List[Tuple[int, int, int]]] = {}
+        for thread, start, end, phase in self.spans():
+            by_thread.setdefault(thread, []).append((start, -end, phase))
+        for thread, spans in by_thread.items():
+            spans.sort()
+            root = self.thread_names.get(thread, str(thread))
+            stack: List[List] = []   # [end, path, time in children, duration]
+            for start, negative_end, phase in spans:
+                end = -negative_end
+                while stack and stack[-1][0] <= start:
+                    self.close_span(stack, totals)
+                parent = stack[-1][1] if stack else root
+                stack.append([end, f"{parent};{self.names[phase]}", 0, end - start])
+            while stack:
+                self.close_span(stack, totals)
+        return totals
+
+    @staticmethod
+    def close_span(stack: List[List], totals: Dict[str, int]) -> None:
+        _, path, children, duration = stack.pop()
+        totals[path] = totals.get(path, 0) + max(0, duration - children) // 1000
+        if stack:
+            stack[-1][2] += duration
+
+    def dump(self, path: str) -> None:
+        if path.endswith(".json"):
+            with open(path, 'w') as f:
+                json.dump(self.chrome_trace(), f)
+        else:
+            with open(path, 'w') as f:
+                for stack, micros in sorted(self.folded().items()):
+                    f.write(f"{stack} {micros}\n")
+        logger.info(f"Profile of {min(self.recorded, self.capacity)} phases written to {path}")
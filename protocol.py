@@ -0,0 +1,347 @@
+import functools
+import itertools
+import socket
+import struct
+from typing import Dict, List, Tuple
+
+# Wire format shared by server.py and client.py. Every message is one frame:
+#   HEADER (payload length, message type) followed by a fixed-layout struct payload.
+# The client states its PROTOCOL_VERSION in HELLO and the server refuses mismatched clients.
+# State is sent either as a full keyframe (STATE) or as a DELTA against a snapshot the client acked
+# in its INPUT messages; every entity carries a stable id (pid for players, fid for pellets).
+# With the optional UDP transport the TCP connection still carries the handshake: WELCOME hands out a
+# token, the client then sends sequenced UDP_INPUT datagrams carrying it, and from the first valid one
+# the server sends every frame that fits a datagram over UDP as one datagram holding one frame.
+# Inputs carry a seq and snapshots echo the newest input seq applied to the player (input ack), which the
+# client uses to reconcile its locally predicted blob.
+# A spectator opens with WATCH instead of HELLO: it gets WELCOME with SPECTATOR_PID, then the whole world as
+# a keyframe followed by deltas, each against the frame before it (TCP delivers every one), and sends nothing.
+PROTOCOL_VERSION = 4
+HEADER = struct.Struct('!IB')
+MAX_FRAME_SIZE = 1 << 22
+# Larger frames are sent over TCP, so datagrams never need IP fragmentation on an Ethernet path
+MAX_DATAGRAM_SIZE = 1400
+NAME_BYTES = 16
+
+MSG_HELLO = 1
+MSG_WELCOME = 2
+MSG_INPUT = 3
+MSG_STATE = 4
+MSG_DELTA = 5
+MSG_MINIMAP = 6
+MSG_UDP_INPUT = 7
+MSG_WATCH = 8
+SPECTATOR_PID = 0xFFFFFFFF
+
+HELLO = struct.Struct(f'!H{NAME_BYTES}s')        # version, name
+WATCH = struct.Struct('!H')                      # version
+WELCOME = struct.Struct('!HIIH')                 # version, pid, UDP token (0 = server has no UDP), tick rate
+INPUT = struct.Struct('!ffII')                   # mx, my, last applied snapshot seq (0 = none), input seq
+UDP_INPUT = struct.Struct('!IIffI')              # token, input seq, mx, my, last applied snapshot seq
+STATE_HEADER = struct.Struct('!IIHII')           # seq, input ack, time_left, player count, food count
+DELTA_HEADER = struct.Struct('!IIIHHHHII')       # seq, baseline seq, input ack, time_left, joined, updated,
+                                                 # left, food spawned, food eaten
+PLAYER = struct.Struct(f'!IfffI{NAME_BYTES}s')   # pid, x, y, size, score, name
+PLAYER_UPDATE = struct.Struct('!IfffI')          # pid, x, y, size, score
+MINIMAP_HEADER = struct.Struct('!HHHHB')         # map width, map height, density cols, rows, player count
+FOOD_FORMAT = 'IHHB'                             # fid, x, y, size (pellets sit on integer coordinates)
+FOOD = struct.Struct('!' + FOOD_FORMAT)
+
+class ProtocolError(Exception):
+    pass
+
+def checked(decode):
+    # Decoders report a payload too short for its structs as ProtocolError, like every other bad message
+    @functools.wraps(decode)
+    def wrapper(*args):
+        try:
+            return decode(*args)
+        except struct.error as e:
+            raise ProtocolError(f"Malformed payload for {decode.__name__}: {e}") from None
+    return wrapper
+
+def expect_size(payload: bytes, size: int, kind: str) -> None:
+    if len(payload) != size:
+        raise ProtocolError(f"{kind} payload of {len(payload)} bytes, its counts need {size}")
+
+def frame(msg_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(len(payload), msg_type) + payload
+
+@functools.lru_cache(maxsize=1024)
+def food_block(count: int) -> struct.Struct:
+    # One precompiled struct for a whole run of pellets is much faster than packing them one by one
+    return struct.Struct('!' + FOOD_FORMAT * count)
+
+@functools.lru_cache(maxsize=4096)
+def encode_name(name: str) -> bytes:
+    # Truncate on a character boundary so the fixed-size field always holds valid UTF-8
+    data = name.encode('utf-8')[:NAME_BYTES]
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+def decode_name(data: bytes) -> str:
+    return data.rstrip(b'\0').decode('utf-8', 'ignore')
+
+def encode_hello(name: str) -> bytes:
+    return frame(MSG_HELLO, HELLO.pack(PROTOCOL_VERSION, encode_name(name)))
+
+@checked
+def decode_hello(payload: bytes) -> str:
+    version, name = HELLO.unpack(payload)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, server speaks {PROTOCOL_VERSION}")
+    return decode_name(name)
+
+def encode_watch() -> bytes:
+    return frame(MSG_WATCH, WATCH.pack(PROTOCOL_VERSION))
+
+@checked
+def decode_watch(payload: bytes) -> None:
+    version, = WATCH.unpack(payload)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, server speaks {PROTOCOL_VERSION}")
+
+def encode_welcome(pid: int, token: int = 0, tick_rate: int = 60) -> bytes:
+    return frame(MSG_WELCOME, WELCOME.pack(PROTOCOL_VERSION, pid, token, tick_rate))
+
+@checked
+def decode_welcome(payload: bytes) -> Tuple[int, int, int]:
+    version, pid, token, tick_rate = WELCOME.unpack(payload)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, client speaks {PROTOCOL_VERSION}")
+    return pid, token, tick_rate
+
+def encode_input(mx: float, my: float, ack: int = 0, seq: int = 0) -> bytes:
+    return frame(MSG_INPUT, INPUT.pack(mx, my, ack, seq))
+
+@checked
+def decode_input(payload: bytes) -> Tuple[float, float, int, int]:
+    return INPUT.unpack(payload)
+
+def encode_udp_input(token: int, seq: int, mx: float, my: float, ack: int = 0) -> bytes:
+    return frame(MSG_UDP_INPUT, UDP_INPUT.pack(token, seq, mx, my, ack))
+
+@checked
+def decode_udp_input(payload: bytes) -> Tuple[int, int, float, float, int]:
+    return UDP_INPUT.unpack(payload)
+
+def decode_datagram(data: bytes) -> Tuple[int, bytes]:
+    # A datagram holds exactly one frame
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Datagram of {len(data)} bytes is shorter than a frame header")
+    length, msg_type = HEADER.unpack_from(data, 0)
+    if length != len(data) - HEADER.size:
+        raise ProtocolError(f"Datagram holds {len(data) - HEADER.size} payload bytes, header says {length}")
+    return msg_type, memoryview(data)[HEADER.size:]
+
+def snapshot_seq(payload: bytes) -> int:
+    # STATE and DELTA payloads both start with the snapshot seq
+    return int.from_bytes(payload[:4], 'big')
+
+def encode_state(state: Dict) -> bytes:
+    players = state['players']
+    food = state['food']
+    size = STATE_HEADER.size + len(players) * PLAYER.size + len(food) * FOOD.size
+    buf = bytearray(HEADER.size + size)
+    HEADER.pack_into(buf, 0, size, MSG_STATE)
+    offset = HEADER.size
+    STATE_HEADER.pack_into(buf, offset, state['seq'], state.get('input_ack', 0), state['time_left'], len(players),
+                           len(food))
+    offset += STATE_HEADER.size
+    for pid, (x, y, psize, name, score) in players.items():
+        PLAYER.pack_into(buf, offset, pid, x, y, psize, int(score), encode_name(name))
+        offset += PLAYER.size
+    if food:
+        food_block(len(food)).pack_into(buf, offset, *flatten_food(food.items()))
+    return bytes(buf)
+
+@checked
+def decode_state(payload: bytes) -> Dict:
+    seq, input_ack, time_left, player_count, food_count = STATE_HEADER.unpack_from(payload, 0)
+    expect_size(payload, STATE_HEADER.size + player_count * PLAYER.size + food_count * FOOD.size, "STATE")
+    offset = STATE_HEADER.size
+    end = offset + player_count * PLAYER.size
+    players = {}
+    for pid, x, y, size, score, name in PLAYER.iter_unpack(payload[offset:end]):
+        players[pid] = (x, y, size, decode_name(name), score)
+    return {
+        'seq': seq,
+        'players': players,
+        'food': unflatten_food(food_block(food_count).unpack_from(payload, end)),
+        'time_left': time_left,
+        'input_ack': input_ack
+    }
+
+def encode_player_record(pid: int, record: Tuple) -> bytes:
+    x, y, size, name, score = record
+    return PLAYER.pack(pid, x, y, size, int(score), encode_name(name))
+
+def encode_player_update(pid: int, record: Tuple) -> bytes:
+    x, y, size, _, score = record
+    return PLAYER_UPDATE.pack(pid, x, y, size, int(score))
+
+def encode_food_record(fid: int, record: Tuple) -> bytes:
+    return FOOD.pack(fid, *record)
+
+# The *_parts builders assemble a frame from records packed once per tick by the server and shared by
+# every client; they return the frame as a list of buffers for socket.sendmsg instead of one copy
+
+def state_parts(seq: int, input_ack: int, time_left: int, players: List[bytes], food: List[bytes]) -> List[bytes]:
+    size = STATE_HEADER.size + len(players) * PLAYER.size + len(food) * FOOD.size
+    head = HEADER.pack(size, MSG_STATE) + STATE_HEADER.pack(seq, input_ack, time_left, len(players), len(food))
+    return [head, *players, *food]
+
+def delta_parts(seq: int, baseline_seq: int, input_ack: int, time_left: int, joined: List[bytes],
+                updated: List[bytes], left: List[int], spawned: List[bytes], eaten: List[int]) -> List[bytes]:
+    size = (DELTA_HEADER.size + len(joined) * PLAYER.size + len(updated) * PLAYER_UPDATE.size
+            + len(left) * 4 + len(spawned) * FOOD.size + len(eaten) * 4)
+    head = HEADER.pack(size, MSG_DELTA) + DELTA_HEADER.pack(seq, baseline_seq, input_ack, time_left, len(joined),
+                                                            len(updated), len(left), len(spawned), len(eaten))
+    return [head, *joined, *updated, struct.pack(f'!{len(left)}I', *left), *spawned,
+            struct.pack(f'!{len(eaten)}I', *eaten)]
+
+def flatten_food(items) -> itertools.chain:
+    return itertools.chain.from_iterable((fid, x, y, size) for fid, (x, y, size) in items)
+
+def unflatten_food(values: Tuple) -> Dict[int, Tuple[int, int, int]]:
+    it = iter(values)
+    return {fid: (x, y, size) for fid, x, y, size in zip(it, it, it, it)}
+
+def encode_delta(baseline: Dict, state: Dict) -> bytes:
+    players = state['players']
+    base_players = baseline['players']
+    joined = []
+    updated = []
+    for pid, record in players.items():
+        old = base_players.get(pid)
+        if old is None:
+            joined.append((pid, record))
+        elif old != record:
+            updated.append((pid, record))
+    left = [pid for pid in base_players if pid not in players]
+    food = state['food']
+    base_food = baseline['food']
+    spawned = [(fid, f) for fid, f in food.items() if fid not in base_food]
+    eaten = [fid for fid in base_food if fid not in food]
+
+    size = (DELTA_HEADER.size + len(joined) * PLAYER.size + len(updated) * PLAYER_UPDATE.size
+            + len(left) * 4 + len(spawned) * FOOD.size + len(eaten) * 4)
+    buf = bytearray(HEADER.size + size)
+    HEADER.pack_into(buf, 0, size, MSG_DELTA)
+    offset = HEADER.size
+    DELTA_HEADER.pack_into(buf, offset, state['seq'], baseline['seq'], state.get('input_ack', 0), state['time_left'],
+                           len(joined), len(updated), len(left), len(spawned), len(eaten))
+    offset += DELTA_HEADER.size
+    for pid, (x, y, psize, name, score) in joined:
+        PLAYER.pack_into(buf, offset, pid, x, y, psize, int(score), encode_name(name))
+        offset += PLAYER.size
+    for pid, (x, y, psize, _, score) in updated:
+        PLAYER_UPDATE.pack_into(buf, offset, pid, x, y, psize, int(score))
+        offset += PLAYER_UPDATE.size
+    struct.pack_into(f'!{len(left)}I', buf, offset, *left)
+    offset += len(left) * 4
+    if spawned:
+        food_block(len(spawned)).pack_into(buf, offset, *flatten_food(spawned))
+        offset += len(spawned) * FOOD.size
+    struct.pack_into(f'!{len(eaten)}I', buf, offset, *eaten)
+    return bytes(buf)
+
+def encode_minimap(width: int, height: int, cols: int, rows: int, density: bytes, players) -> bytes:
+    # Coarse whole-map summary: per-cell pellet counts (capped at 255) plus the leading players
+    size = MINIMAP_HEADER.size + cols * rows + len(players) * PLAYER.size
+    buf = bytearray(HEADER.size + size)
+    HEADER.pack_into(buf, 0, size, MSG_MINIMAP)
+    offset = HEADER.size
+    MINIMAP_HEADER.pack_into(buf, offset, width, height, cols, rows, len(players))
+    offset += MINIMAP_HEADER.size
+    buf[offset:offset + cols * rows] = density
+    offset += cols * rows
+    for pid, (x, y, psize, name, score) in players:
+        PLAYER.pack_into(buf, offset, pid, x, y, psize, int(score), encode_name(name))
+        offset += PLAYER.size
+    return bytes(buf)
+
+@checked
+def decode_minimap(payload: bytes) -> Dict:
+    width, height, cols, rows, player_count = MINIMAP_HEADER.unpack_from(payload, 0)
+    expect_size(payload, MINIMAP_HEADER.size + cols * rows + player_count * PLAYER.size, "MINIMAP")
+    offset = MINIMAP_HEADER.size
+    density = bytes(payload[offset:offset + cols * rows])
+    offset += cols * rows
+    players = {}
+    for pid, x, y, size, score, name in PLAYER.iter_unpack(payload[offset:offset + player_count * PLAYER.size]):
+        players[pid] = (x, y, size, decode_name(name), score)
+    return {
+        'width': width,
+        'height': height,
+        'cols': cols,
+        'rows': rows,
+        'density': density,
+        'players': players
+    }
+
+@checked
+def delta_baseline(payload: bytes) -> int:
+    return DELTA_HEADER.unpack_from(payload, 0)[1]
+
+@checked
+def apply_delta(baseline: Dict, payload: bytes) -> Dict:
+    seq, _, input_ack, time_left, joined, updated, left, spawned, eaten = DELTA_HEADER.unpack_from(payload, 0)
+    expect_size(payload, DELTA_HEADER.size + joined * PLAYER.size + updated * PLAYER_UPDATE.size + left * 4
+                + spawned * FOOD.size + eaten * 4, "DELTA")
+    players = dict(baseline['players'])
+    offset = DELTA_HEADER.size
+    end = offset + joined * PLAYER.size
+    for pid, x, y, size, score, name in PLAYER.iter_unpack(payload[offset:end]):
+        players[pid] = (x, y, size, decode_name(name), score)
+    offset, end = end, end + updated * PLAYER_UPDATE.size
+    for pid, x, y, size, score in PLAYER_UPDATE.iter_unpack(payload[offset:end]):
+        players[pid] = (x, y, size, players[pid][3], score)
+    for pid in struct.unpack_from(f'!{left}I', payload, end):
+        players.pop(pid, None)
+    offset = end + left * 4
+    food = dict(baseline['food'])
+    food.update(unflatten_food(food_block(spawned).unpack_from(payload, offset)))
+    offset += spawned * FOOD.size
+    for fid in struct.unpack_from(f'!{eaten}I', payload, offset):
+        food.pop(fid, None)
+    return {
+        'seq': seq,
+        'players': players,
+        'food': food,
+        'time_left': time_left,
+        'input_ack': input_ack
+    }
+
+class FrameDecoder:
+    # Reassembles frames from a byte stream; tolerates partial frames and several frames per read
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        self.buffer += data
+        frames = []
+        offset = 0
+        buffered = len(self.buffer)
+        while buffered - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            end = offset + HEADER.size + length
+            if end > buffered:
+                break
+            frames.append((msg_type, self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+def recv_frames(sock: socket.socket, decoder: FrameDecoder, bufsize: int = 65536) -> List[Tuple[int, bytes]]:
+    # Blocking read until at least one complete frame is available (used for the handshake)
+    while True:
+        data = sock.recv(bufsize)
+        if not data:
+            raise ConnectionError("Connection closed during handshake")
+        frames = decoder.feed(data)
+        if frames:
+            return frames
@@ -0,0 +1,348 @@
+import logging
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from profiler import NULL_PROFILER
+from server import FOOD_COUNT, FOOD_SIZE, GAME_DURATION, Food, Player, SpatialGrid
+
+logger = logging.getLogger(__name__)
+
+# Large maps split into vertical strips, each simulated by its own worker process (engine "regions").
+# Every tick the coordinator sends each region its inputs, arriving players and ghosts, and each region
+# moves the players it owns and settles every eat whose victim (a blob or a pellet) it owns:
+# - Ghosts are read-only copies of blobs owned by a neighbour that reach into the strip, so a blob
+#   straddling a border can eat on both sides. The victim's owner decides each eat, so nothing is eaten
+#   twice; growth earned from another region's victims is credited to the eater's owner next tick.
+# - A blob that moves (or respawns) out of its strip is handed off whole to the strip it is now in.
+# Ghosts come from the previous tick's positions, so border eats see neighbours one tick late.
+GHOST_MARGIN = 20
+NEW_PLAYER_SIZE = 20
+
+# A player as it travels between processes on handoff:
+# (pid, name, x, y, size, score, last_dx, last_dy, target, input_seq)
+PlayerState = Tuple
+
+def player_state(p: Player) -> PlayerState:
+    return p.pid, p.name, p.x, p.y, p.size, p.score, p.last_dx, p.last_dy, p.target, p.input_seq
+
+def region_of(x: float, width: int, count: int) -> int:
+    return min(max(int(x * count / width), 0), count - 1)
+
+class Region:
+    # One strip [x0, x1) of the world: owns the blobs and pellets whose centre lies in it
+    def __init__(self, index: int, count: int, width: int, height: int, food_count: int, seed: Optional[int] = None):
+        self.index = index
+        # Each region draws from its own stream, so a seeded match replays the same in every region
+        self.random = random.Random(None if seed is None else f"{seed}:{index}")
+        self.count = count
+        self.width = width
+        self.height = height
+        self.x0 = width * index / count
+        self.x1 = width * (index + 1) / count
+        self.players: Dict[int, Player] = {}
+        self.player_grid = SpatialGrid()
+        # Pellet ids are index, index + count, ... so every region allocates from its own space
+        self.next_food_id = index
+        share = food_count * (index + 1) // count - food_count * index // count
+        self.food: List[Food] = []
+        self.food_grid = SpatialGrid()
+        for slot in range(share):
+            food = Food(width, height, self.new_food_id(), self.random)
+            self.place(food)
+            self.food.append(food)
+            self.food_grid.insert(slot, food.x, food.y)
+        self.decay_elapsed = 0.0
+
+    def new_food_id(self) -> int:
+        fid = self.next_food_id
+        self.next_food_id += self.count
+        return fid
+
+    def place(self, food: Food) -> None:
+        # Respawn inside this strip, keeping the usual 10 unit gap from the far edges
+        lo = math.ceil(self.x0)
+        hi = max(lo, min(math.ceil(self.x1) - 1, self.width - 10))
+        food.x = self.random.randint(lo, hi)
+        food.y = self.random.randint(0, self.height - 10)
+
+    def food_records(self) -> Dict[int, Tuple[int, int, int]]:
+        return {f.fid: (f.x, f.y, f.size) for f in self.food}
+
+    def step(self, message: Tuple) -> Tuple:
+        dt, arrivals, removals, credits, inputs, ghosts = message
+        # Arrivals before removals: a player leaving the game while handed over is removed on arrival
+        for pid, name, x, y, size, score, last_dx, last_dy, target, input_seq in arrivals:
+            p = Player(pid, name, x, y)
+            p.size, p.score, p.last_dx, p.last_dy, p.target, p.input_seq = size, score, last_dx, last_dy, target, input_seq
+            self.players[pid] = p
+            self.player_grid.insert(pid, x, y)
+        for pid in removals:
+            if self.players.pop(pid, None) is not None:
+                self.player_grid.remove(pid)
+        for pid, size, score in credits:
+            p = self.players.get(pid)
+            if p is not None:
+                p.size += size
+                p.score += score
+        for pid, mx, my, seq in inputs:
+            p = self.players.get(pid)
+            if p is not None:
+                p.target = (mx, my)
+                p.input_seq = seq
+        for p in self.players.values():
+            if p.target is not None:
+                p.move(p.target[0], p.target[1], dt, self.width, self.height)
+                self.player_grid.move(p.pid, p.x, p.y)
+
+        eaten_food, spawned_food = [], {}
+        credits_out = self.check_eat([Player(pid, "", x, y) for pid, x, y, _ in ghosts], ghosts,
+                                     eaten_food, spawned_food)
+        self.decay(dt)
+
+        departures = []
+        players = []
+        for p in list(self.players.values()):
+            if region_of(p.x, self.width, self.count) != self.index:
+                departures.append(player_state(p))
+                del self.players[p.pid]
+                self.player_grid.remove(p.pid)
+            else:
+                players.append((p.pid, p.x, p.y, p.size, p.score, p.input_seq))
+        return players, departures, credits_out, eaten_food, [(fid, *record) for fid, record in spawned_food.items()]
+
+    def check_eat(self, ghost_players: List[Player], ghosts: List[Tuple], eaten_food: List[int],
+                  spawned_food: Dict[int, Tuple]) -> List[Tuple[int, float, int]]:
+        # Same rules as Game.check_eat, with owned blobs and ghosts as eaters and only owned blobs and
+        # pellets as victims. Ghost growth is tallied here and returned as credits for its owner.
+        for ghost, (_, _, _, size) in zip(ghost_players, ghosts):
+            ghost.size = size
+        credits: Dict[int, List] = {}
+        for p1 in list(self.players.values()) + ghost_players:
+            owned = p1.pid in self.players
+            for pid in self.player_grid.query_reach(p1, 0):
+                p2 = self.players[pid]
+                if p1.pid == p2.pid:
+                    continue
+                if p1.size > p2.size:
+                    dist = ((p1.x - p2.x)**2 + (p1.y - p2.y)**2)**0.5
+                    if dist < p1.size:
+                        logger.info(f"Player {p1.pid} (size {p1.size}) ate {p2.pid} (size {p2.size})")
+                        gain = (p2.size * 0.5, int(p2.score / 2))
+                        p1.size += gain[0]
+                        p1.score += gain[1]
+                        if not owned:
+                            credit = credits.setdefault(p1.pid, [0.0, 0])
+                            credit[0] += gain[0]
+                            credit[1] += gain[1]
+                        p2.size = NEW_PLAYER_SIZE
+                        p2.score = 0
+                        p2.x = self.random.randint(0, self.width - p2.size)
+                        p2.y = self.random.randint(0, self.height - p2.size)
+                        self.player_grid.move(p2.pid, p2.x, p2.y)
+
+            for index in self.food_grid.query_reach(p1, FOOD_SIZE):
+                food = self.food[index]
+                dist = ((p1.x - food.x)**2 + (p1.y - food.y)**2)**0.5
+                if dist < (p1.size + food.size):
+                    p1.size += food.size
+                    p1.score += food.size
+                    if not owned:
+                        credit = credits.setdefault(p1.pid, [0.0, 0])
+                        credit[0] += food.size
+                        credit[1] += food.size
+                    # A pellet respawned and eaten again within the tick never reaches the coordinator
+                    if spawned_food.pop(food.fid, None) is None:
+                        eaten_food.append(food.fid)
+                    self.place(food)
+                    food.fid = self.new_food_id()
+                    spawned_food[food.fid] = (food.x, food.y, food.size)
+                    self.food_grid.move(index, food.x, food.y)
+        return [(pid, size, score) for pid, (size, score) in credits.items()]
+
+    def decay(self, dt: float) -> None:
+        self.decay_elapsed += dt
+        if self.decay_elapsed >= 1.0:
+            for p in self.players.values():
+                if p.size > NEW_PLAYER_SIZE:
+                    p.size *= 0.98
+            self.decay_elapsed -= 1.0
+
+def run_region(conn, index: int, count: int, width: int, height: int, food_count: int,
+               seed: Optional[int] = None) -> None:
+    region = Region(index, count, width, height, food_count, seed)
+    conn.send(region.food_records())
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        conn.send(region.step(message))
+
+class RegionGame:
+    # Coordinator with the same interface as Game: queues joins, leaves and inputs for the owning region,
+    # runs one tick on every region in parallel and merges their results into one world state
+    def __init__(self, width: int, height: int, food_count: int = FOOD_COUNT, regions: Optional[int] = None,
+                 seed: Optional[int] = None, clock: Callable[[], float] = time.time):
+        self.width = width
+        self.height = height
+        self.count = max(1, regions or os.cpu_count() or 1)
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.recorder = None
+        self.profiler = NULL_PROFILER
+        self.lock = threading.Lock()
+        self.input_lock = threading.Lock()
+        self.start_time = None
+        self.seq = 0
+        self.names: Dict[int, str] = {}
+        self.owner: Dict[int, int] = {}
+        # Merged world, replaced (not mutated) every tick so a published snapshot never changes under a reader
+        self.players: Dict[int, Tuple] = {}
+        self.input_acks: Dict[int, int] = {}
+        self.food: Dict[int, Tuple[int, int, int]] = {}
+        self.pending_inputs: Dict[int, Tuple[float, float, int]] = {}
+        # What each region gets with its next tick
+        self.arrivals: List[List[PlayerState]] = [[] for _ in range(self.count)]
+        self.removals: List[List[int]] = [[] for _ in range(self.count)]
+        self.credits: List[List[Tuple]] = [[] for _ in range(self.count)]
+        self.ghosts: List[List[Tuple]] = [[] for _ in range(self.count)]
+        context = multiprocessing.get_context("forkserver")
+        self.pipes = []
+        self.workers = []
+        for index in range(self.count):
+            parent, child = context.Pipe()
+            worker = context.Process(target=run_region, daemon=True,
+                                     args=(child, index, self.count, width, height, food_count, seed))
+            worker.start()
+            child.close()
+            self.pipes.append(parent)
+            self.workers.append(worker)
+        for pipe in self.pipes:
+            self.food.update(pipe.recv())
+        logger.info(f"World {width}x{height} split into {self.count} regions")
+
+    def add_player(self, pid: int, name: str) -> None:
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.join(pid, name)
+            if not self.names:
+                self.start_time = self.clock()
+                logger.info("First player joined, starting game timer")
+            x, y = self.random.randint(0, self.width), self.random.randint(0, self.height)
+            region = region_of(x, self.width, self.count)
+            self.names[pid] = name
+            self.owner[pid] = region
+            self.arrivals[region].append((pid, name, x, y, NEW_PLAYER_SIZE, 0, 0, 0, None, 0))
+            self.players = {**self.players, pid: (x, y, NEW_PLAYER_SIZE, name, 0)}
+            logger.info(f"Added player {pid}: {name} in region {region}")
+
+    def remove_player(self, pid: int) -> None:
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.leave(pid)
+            with self.input_lock:
+                self.pending_inputs.pop(pid, None)
+            if pid in self.names:
+                del self.names[pid]
+                self.removals[self.owner.pop(pid)].append(pid)
+                self.players = {other: record for other, record in self.players.items() if other != pid}
+                logger.info(f"Removed player {pid}")
+
+    def set_input(self, pid: int, mx: float, my: float, seq: int = 0) -> None:
+        with self.input_lock:
+            self.pending_inputs[pid] = (mx, my, seq)
+
+    def tick(self, dt: float) -> None:
+        with self.lock:
+            self.seq += 1
+            with self.input_lock:
+                inputs, self.pending_inputs = self.pending_inputs, {}
+            if self.recorder is not None:
+                self.recorder.tick(dt, inputs)
+            region_inputs = [[] for _ in range(self.count)]
+            for pid, (mx, my, seq) in inputs.items():
+                region = self.owner.get(pid)
+                if region is not None:
+                    region_inputs[region].append((pid, mx, my, seq))
+            # Every region works on its tick at the same time; results are collected afterwards
+            profiler = self.profiler
+            start = profiler.begin()
+            for index, pipe in enumerate(self.pipes):
+                pipe.send((dt, self.arrivals[index], self.removals[index], self.credits[index], region_inputs[index],
+                           self.ghosts[index]))
+            self.arrivals = [[] for _ in range(self.count)]
+            self.removals = [[] for _ in range(self.count)]
+            credits = []
+            players = {}
+            input_acks = {}
+            names = self.names
+            for pipe in self.pipes:
+                owned, departures, region_credits, eaten_food, spawned_food = pipe.recv()
+                for pid, x, y, size, score, input_seq in owned:
+                    players[pid] = (x, y, size, names[pid], int(score))
+                    input_acks[pid] = input_seq
+                for state in departures:
+                    pid, _, x, y, size, score, _, _, _, input_seq = state
+                    region = region_of(x, self.width, self.count)
+                    self.owner[pid] = region
+                    self.arrivals[region].append(state)
+                    players[pid] = (x, y, size, names[pid], int(score))
+                    input_acks[pid] = input_seq
+                credits.extend(region_credits)
+                for fid in eaten_food:
+                    del self.food[fid]
+                for fid, x, y, size in spawned_food:
+                    self.food[fid] = (x, y, size)
+            self.credits = [[] for _ in range(self.count)]
+            for credit in credits:
+                region = self.owner.get(credit[0])
+                if region is not None:
+                    self.credits[region].append(credit)
+            profiler.end("regions", start)
+            start = profiler.begin()
+            self.ghosts = self.find_ghosts(players)
+            profiler.end("ghosts", start)
+            self.players = players
+            self.input_acks = input_acks
+
+    def find_ghosts(self, players: Dict[int, Tuple]) -> List[List[Tuple]]:
+        # Copy each blob into every other strip its reach (radius plus a pellet, with some slack for
+        # next tick's movement) overlaps
+        ghosts = [[] for _ in range(self.count)]
+        strip = self.width / self.count
+        last_region = self.count - 1
+        owners = self.owner
+        for pid, (x, y, size, _, _) in players.items():
+            reach = size + FOOD_SIZE + GHOST_MARGIN
+            owner = owners[pid]
+            # Most blobs are well inside their own strip
+            if owner * strip <= x - reach and x + reach < (owner + 1) * strip:
+                continue
+            first = max(int((x - reach) / strip), 0)
+            last = min(int((x + reach) / strip), last_region)
+            for region in range(first, last + 1):
+                if region != owner:
+                    ghosts[region].append((pid, x, y, size))
+        return ghosts
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            if self.start_time is None:
+                elapsed = GAME_DURATION
+            else:
+                elapsed = int(GAME_DURATION - (self.clock() - self.start_time))
+            state = {
+                'seq': self.seq,
+                'players': self.players,
+                'food': dict(self.food),
+                'time_left': elapsed if elapsed > 0 else 0,
+                'input_acks': self.input_acks
+            }
+            if self.recorder is not None:
+                self.recorder.checkpoint(state)
+            return state
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import selectors
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+
+import protocol
+from server import BUFFER_SIZE, METRICS_HOST, Server
+
+logger = logging.getLogger(__name__)
+
+# Fan-out for spectators: a relay watches a game server as a single spectator and serves the same stream to
+# any number of spectators of its own, so the game server sends one stream however many people watch.
+# Upstream deltas are forwarded byte for byte; the relay keeps the decoded world only to make keyframes for
+# spectators that join or fall behind. A relay's upstream can be another relay, so relays form a tree.
+RELAY_PORT = 1410
+
+class Upstream:
+    # Stands in for the game: the relay's world is whatever its upstream sent last
+    def __init__(self, address: Tuple[str, int]):
+        self.address = address
+        self.lock = threading.Lock()
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = protocol.FrameDecoder()
+        self.state: Optional[Dict] = None
+        self.sock.sendall(protocol.encode_watch())
+        frames = protocol.recv_frames(self.sock, self.decoder)
+        msg_type, payload = frames[0]
+        if msg_type != protocol.MSG_WELCOME:
+            raise protocol.ProtocolError(f"Expected WELCOME from {address}, got message type {msg_type}")
+        _, _, self.tick_rate = protocol.decode_welcome(payload)
+        # Frames that came in the same read as WELCOME
+        self.early = frames[1:]
+        self.sock.setblocking(False)
+
+class Relay(Server):
+    def __init__(self, host: str, port: int, upstream: Tuple[str, int], metrics_port: Optional[int] = None):
+        game = Upstream(upstream)
+        super().__init__(host, port, tick_rate=game.tick_rate, metrics_port=metrics_port, game=game)
+        logger.info(f"Relaying {upstream[0]}:{upstream[1]}")
+
+    def admit(self, conn, name: str) -> None:
+        raise protocol.ProtocolError("This is a relay, it only takes spectators")
+
+    def start_simulation(self) -> None:
+        # Nothing to simulate: frames arrive from upstream on the event loop
+        pass
+
+    def register_sources(self) -> None:
+        super().register_sources()
+        self.selector.register(self.game.sock, selectors.EVENT_READ, self.on_upstream)
+        if self.game.early:
+            self.relay_frames(self.game.early)
+
+    def on_upstream(self) -> None:
+        try:
+            data = self.game.sock.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data = b""
+            logger.error(f"Upstream receive error: {e}")
+        if not data:
+            logger.error("Upstream closed the connection, stopping")
+            self.running = False
+            return
+        self.relay_frames(self.game.decoder.feed(data))
+
+    def relay_frames(self, frames) -> None:
+        upstream = self.game
+        for msg_type, payload in frames:
+            if msg_type == protocol.MSG_MINIMAP:
+                self.minimap_frame = protocol.frame(msg_type, bytes(payload))
+                self.minimap_version += 1
+            elif msg_type == protocol.MSG_STATE:
+                upstream.state = protocol.decode_state(payload)
+                frame = protocol.frame(msg_type, bytes(payload))
+                self.feed.push(upstream.state['seq'], -1, None, lambda frame=frame: frame)
+            elif msg_type == protocol.MSG_DELTA:
+                if upstream.state is None or protocol.delta_baseline(payload) != upstream.state['seq']:
+                    # Cannot happen on an ordered stream; wait for the next keyframe rather than guess
+                    logger.warning("Upstream delta does not follow the last frame, skipped")
+                    continue
+                baseline = upstream.state['seq']
+                state = upstream.state = protocol.apply_delta(upstream.state, payload)
+                self.feed.push(state['seq'], baseline, protocol.frame(msg_type, bytes(payload)),
+                               lambda state=state: protocol.encode_state(state))
+            self.send_feed()
+
+def parse_address(text: str) -> Tuple[str, int]:
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="phago.io spectator relay")
+    parser.add_argument("--upstream", type=parse_address, required=True, metavar="HOST:PORT",
+                        help="game server or another relay to watch")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=RELAY_PORT, help="port spectators connect to")
+    parser.add_argument("--metrics-port", type=int, help=f"serve metrics as text on http://{METRICS_HOST}:PORT/metrics")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        relay = Relay(args.host, args.port, args.upstream, args.metrics_port)
+        relay.run()
+    except KeyboardInterrupt:
+        logger.info("Relay stopped")
+    except OSError as e:
+        logger.error(f"Relay failed: {e}")
@@ -0,0 +1,194 @@
+import argparse
+import logging
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import percentile
+from server import ENGINES, create_game
+
+logger = logging.getLogger(__name__)
+
+# Match recordings: everything the simulation consumed from outside, in the order it took effect (joins,
+# leaves, and each tick's dt with the inputs drained in it), plus a state checksum every CHECKSUM_INTERVAL
+# ticks. With the game's RNG seeded from the header, replaying the events re-creates the match exactly.
+# Everything is written by the engine under its own lock, so the log order is the order the game saw.
+MAGIC = b"PHGR"
+VERSION = 1
+HEADER = struct.Struct('!4sB8sQIIIHH')  # magic, version, engine, seed, width, height, food count, tick rate,
+                                        # regions (0 unless engine is regions)
+TICK = struct.Struct('!BdH')            # type, dt, input count
+TICK_INPUT = struct.Struct('!Idd')      # pid, mx, my
+JOIN = struct.Struct('!BIB')            # type, pid, name length (UTF-8 name follows)
+LEAVE = struct.Struct('!BI')            # type, pid
+CHECK = struct.Struct('!BII')           # type, seq, CRC-32 of the state
+REC_TICK, REC_JOIN, REC_LEAVE, REC_CHECK = range(1, 5)
+CHECKSUM_INTERVAL = 60
+
+def state_checksum(state: Dict) -> int:
+    # Order-independent of the engine's iteration order; time_left is left out, it follows the wall clock
+    players = sorted(state['players'].items())
+    food = sorted(state['food'].items())
+    return zlib.crc32(repr((state['seq'], players, food)).encode())
+
+class Recorder:
+    def __init__(self, path: str, engine: str, seed: int, width: int, height: int, food_count: int, tick_rate: int,
+                 regions: int = 0):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, engine.encode(), seed, width, height, food_count, tick_rate,
+                                    regions))
+        self.lock = threading.Lock()
+        self.last_check = 0
+
+    def write(self, data: bytes) -> None:
+        with self.lock:
+            self.file.write(data)
+
+    def join(self, pid: int, name: str) -> None:
+        encoded = name.encode()[:255]
+        self.write(JOIN.pack(REC_JOIN, pid, len(encoded)) + encoded)
+
+    def leave(self, pid: int) -> None:
+        self.write(LEAVE.pack(REC_LEAVE, pid))
+
+    def tick(self, dt: float, inputs: Dict[int, Tuple[float, float, int]]) -> None:
+        parts = [TICK.pack(REC_TICK, dt, len(inputs))]
+        parts.extend(TICK_INPUT.pack(pid, mx, my) for pid, (mx, my, _) in inputs.items())
+        self.write(b"".join(parts))
+
+    def checkpoint(self, state: Dict) -> None:
+        # Called from get_state; a checksum per CHECKSUM_INTERVAL ticks, flushed so a killed server loses
+        # at most that much of the match
+        seq = state['seq']
+        if seq - self.last_check < CHECKSUM_INTERVAL:
+            return
+        self.last_check = seq
+        with self.lock:
+            self.file.write(CHECK.pack(REC_CHECK, seq, state_checksum(state)))
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+def read_recording(path: str) -> Tuple[Dict, Iterator[Tuple]]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, engine, seed, width, height, food_count, tick_rate, regions = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} match recording")
+    header = {'engine': engine.rstrip(b"\0").decode(), 'seed': seed, 'width': width, 'height': height,
+              'food_count': food_count, 'tick_rate': tick_rate, 'regions': regions}
+    return header, records(data, HEADER.size)
+
+def records(data: bytes, offset: int) -> Iterator[Tuple]:
+    # A server stopped mid-write leaves a partial record at the end; it is ignored
+    end = len(data)
+    try:
+        while offset < end:
+            kind = data[offset]
+            if kind == REC_TICK:
+                _, dt, count = TICK.unpack_from(data, offset)
+                offset += TICK.size
+                inputs = [TICK_INPUT.unpack_from(data, offset + i * TICK_INPUT.size) for i in range(count)]
+                offset += count * TICK_INPUT.size
+                yield REC_TICK, dt, inputs
+            elif kind == REC_JOIN:
+                _, pid, length = JOIN.unpack_from(data, offset)
+                offset += JOIN.size
+                name = data[offset:offset + length].decode(errors="replace")
+                offset += length
+                yield REC_JOIN, pid, name
+            elif kind == REC_LEAVE:
+                _, pid = LEAVE.unpack_from(data, offset)
+                offset += LEAVE.size
+                yield REC_LEAVE, pid
+            elif kind == REC_CHECK:
+                _, seq, checksum = CHECK.unpack_from(data, offset)
+                offset += CHECK.size
+                yield REC_CHECK, seq, checksum
+            else:
+                raise ValueError(f"Unknown record type {kind} at offset {offset}")
+    except struct.error:
+        logger.warning("Recording ends with a partial record")
+
+class ReplayClock:
+    # Match time advanced by the recorded dt, so time_left counts down as it did live
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def replay(path: str, engine: Optional[str] = None, regions: Optional[int] = None, verify: bool = True) -> Dict:
+    header, events = read_recording(path)
+    engine = engine or header['engine']
+    regions = regions or header['regions'] or None
+    # Another engine, or another region split, draws different random numbers, so its states are not comparable
+    verify = verify and engine == header['engine'] and (engine != "regions" or regions == header['regions'])
+    clock = ReplayClock()
+    game = create_game(engine, header['width'], header['height'], header['food_count'], regions,
+                       seed=header['seed'], clock=clock)
+    tick_times: List[float] = []
+    checked = 0
+    mismatches: List[int] = []
+    start = time.perf_counter()
+    for event in events:
+        kind = event[0]
+        if kind == REC_TICK:
+            _, dt, inputs = event
+            for pid, mx, my in inputs:
+                game.set_input(pid, mx, my)
+            tick_start = time.perf_counter()
+            game.tick(dt)
+            tick_times.append(time.perf_counter() - tick_start)
+            clock.now += dt
+        elif kind == REC_JOIN:
+            game.add_player(event[1], event[2])
+        elif kind == REC_LEAVE:
+            game.remove_player(event[1])
+        elif kind == REC_CHECK and verify:
+            _, seq, checksum = event
+            checked += 1
+            if game.seq != seq or state_checksum(game.get_state()) != checksum:
+                mismatches.append(seq)
+    return {
+        'engine': engine,
+        'ticks': len(tick_times),
+        'match_seconds': clock.now,
+        'wall_seconds': time.perf_counter() - start,
+        'tick_times': tick_times,
+        'checked': checked,
+        'mismatches': mismatches,
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Re-simulate a recorded phago.io match as fast as possible")
+    parser.add_argument("recording", help="file written by server.py --record")
+    parser.add_argument("--engine", choices=ENGINES, help="simulate with another engine (skips checksum checks)")
+    parser.add_argument("--regions", type=int, help="region processes for --engine regions")
+    parser.add_argument("--no-verify", action="store_true", help="skip state checksum checks")
+    return parser.parse_args()
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    args = parse_args()
+    result = replay(args.recording, args.engine, args.regions, not args.no_verify)
+    ticks = [t * 1000 for t in result['tick_times']]
+    wall = result['wall_seconds']
+    print(f"engine {result['engine']}: {result['ticks']} ticks, {result['match_seconds']:.1f} s of match "
+          f"replayed in {wall:.2f} s ({result['match_seconds'] / max(wall, 1e-9):.1f}x real time)")
+    if ticks:
+        print(f"tick ms: mean {sum(ticks) / len(ticks):.3f}  p50 {percentile(ticks, 0.5):.3f}  "
+              f"p99 {percentile(ticks, 0.99):.3f}  max {max(ticks):.3f}")
+    if result['checked'] or result['mismatches']:
+        print(f"checksums: {result['checked'] - len(result['mismatches'])}/{result['checked']} match")
+    if result['mismatches']:
+        print(f"first divergence at tick {result['mismatches'][0]}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,99 @@
+import argparse
+import collections
+import itertools
+import os
+import selectors
+import signal
 import socket
+import struct
 import threading
 import random
 import time
-import pickle
 import logging
-import pygame
-from typing import List, Dict, Tuple
+from typing import Callable, Deque, Iterator, List, Dict, Set, Tuple, Optional
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+import metrics
+import protocol
+from profiler import CPROFILE_TICKS, NULL_PROFILER, Profiler
+
+try:
+    import fcntl
+    import termios
+    TIOCOUTQ = getattr(termios, 'TIOCOUTQ', None)
+except ImportError:
+    # Windows: only the bytes still held in user space count towards a client's queue
+    fcntl = None
+    TIOCOUTQ = None
+from movement import SENSITIVITY, step
+from viewport import ZoomTracker
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-pygame.init()
 UI_WIDTH, UI_HEIGHT = 600, 400
-UI_SCREEN = pygame.display.set_mode((UI_WIDTH, UI_HEIGHT))
-pygame.display.set_caption("phago.io - Server Setup")
-FONT = pygame.font.SysFont('Arial', 24, bold=True)
-FOOTER_FONT = pygame.font.SysFont('Arial', 20, bold=False)
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GRAY = (150, 150, 150)
 
 WIDTH, HEIGHT = 1080, 720
 GAME_DURATION = 300
-BUFFER_SIZE = 4096
-MSG_UPDATE = 1
+BUFFER_SIZE = 65536
+# Snapshots per second sent to each client; clients interpolate between them, so this can sit well below
+# the tick rate
+SEND_RATE = 20
+# Buffers per sendmsg call (the usual IOV_MAX); platforms without sendmsg join them into one send
+SEND_IOV_MAX = 1024
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+# Number of views sent to each client kept as delta baselines (the newest ones, whatever the send stride); a
+# client whose ack is older than all of them gets a keyframe
+SNAPSHOT_HISTORY = 64
+# Area of interest: each client gets what its camera would show plus this margin (world units)
+AOI_MARGIN = 100
+AOI_CELL_SIZE = 256
+MINIMAP_INTERVAL = 0.5
+MINIMAP_COLS, MINIMAP_ROWS = 40, 30
+MINIMAP_TOP_PLAYERS = 10
+TICK_RATE = 60
+MAX_TICK_DT = 0.25
+# Durations of the most recent ticks (simulation plus snapshot publish), read by loadtest.py
+TICK_SAMPLES = 100000
+DEFAULT_PORT = 1401
+# Inputs per second accepted from each connection, with bursts of up to INPUT_BURST; the client samples at
+# 30 Hz by default, so this leaves room for faster clients and network jitter. Further inputs are ignored.
+INPUT_LIMIT = 120
+INPUT_BURST = 30
+# A TCP client that keeps sending more than INPUT_FLOOD_FACTOR times the input limit, averaged over
+# INPUT_FLOOD_WINDOW seconds, is flooding and gets dropped. Judged over time rather than per read, since TCP
+# hands over the inputs queued during an uplink (or event loop) stall all in one read.
+INPUT_FLOOD_FACTOR = 4
+INPUT_FLOOD_WINDOW = 5.0
+# Join storms: a connection gets HANDSHAKE_TIMEOUT seconds to send HELLO (or WATCH), and while
+# MAX_HANDSHAKES connections are still in their handshake the loop stops accepting, so further connects
+# wait in the kernel's listen backlog instead of piling up half-open in the server
+HANDSHAKE_TIMEOUT = 5.0
+MAX_HANDSHAKES = 256
+# Bytes per second of state each client gets. Every client starts at the initial budget. The budget grows
+# by BUDGET_STEP while frames have to leave updates out, and backs off by BUDGET_BACKOFF (at most once per
+# BACKOFF_INTERVAL) when more than QUEUE_TARGET seconds of it sit unsent or acks fall ACK_LAG_FRAMES behind.
+# Unspent budget carries over for up to BUDGET_BURST seconds.
+INITIAL_CLIENT_BUDGET = 64 * 1024
+MIN_CLIENT_BUDGET = 4 * 1024
+MAX_CLIENT_BUDGET = 1024 * 1024
+BUDGET_STEP = 4 * 1024
+BUDGET_BACKOFF = 0.7
+BACKOFF_INTERVAL = 0.25
+BUDGET_BURST = 0.5
+QUEUE_TARGET = 0.1
+ACK_LAG_FRAMES = 6
+# Priority each changed entity gains per frame it is not sent: blobs by size and nearness, new pellets a
+# little; frames over budget send the highest first and the rest keep accumulating
+PRIORITY_DISTANCE = 200.0
+FOOD_PRIORITY = 0.05
+# The metrics endpoint only listens locally; scrape it from the server machine or through a tunnel
+METRICS_HOST = "127.0.0.1"
+FOOD_COUNT = 75
+FOOD_SIZE = 5
+GRID_CELL_SIZE = 64
 
 class Player:
     def __init__(self, pid: int, name: str, x: float, y: float):
@@ -33,214 +103,1217 @@ class Player:
         self.y = y
         self.size = 20
         self.score = 0
-        self.sensitivity = 1.5
+        self.sensitivity = SENSITIVITY
         self.last_dx = 0 
         self.last_dy = 0 
+        self.target: Optional[Tuple[float, float]] = None
+        # Seq of the newest client input applied, echoed in snapshots for client-side prediction
+        self.input_seq = 0
 
-    def move(self, mx: float, my: float) -> None:
-        dx = mx - self.x
-        dy = my - self.y
-        dist = (dx**2 + dy**2)**0.5
-        speed = (1000 / self.size) * 1.1 * self.sensitivity
-
-        border_margin = 50
-        speed_boost = 1.0
-        if self.x < border_margin or self.x > WIDTH - border_margin:
-            speed_boost = 1.5
-        if self.y < border_margin or self.y > HEIGHT - border_margin:
-            speed_boost = max(speed_boost, 1.5)
-
-        speed *= speed_boost
-
-        if dist > 0:
-            self.last_dx = dx / dist  
-            self.last_dy = dy / dist
-            self.x += (dx / dist) * speed * (1/60)
-            self.y += (dy / dist) * speed * (1/60)
-        elif self.last_dx != 0 or self.last_dy != 0:
-            self.x += self.last_dx * speed * (1/60)
-            self.y += self.last_dy * speed * (1/60)
-
-        self.x = max(self.size * 0.5, min(WIDTH - self.size * 0.5, self.x))
-        self.y = max(self.size * 0.5, min(HEIGHT - self.size * 0.5, self.y))
-        logger.debug(f"Player {self.pid} moved to ({self.x:.1f}, {self.y:.1f})")
+    def move(self, mx: float, my: float, dt: float = 1/60, width: int = WIDTH, height: int = HEIGHT) -> None:
+        self.x, self.y, self.last_dx, self.last_dy = step(self.x, self.y, self.size, mx, my, self.last_dx, self.last_dy,
+                                                          dt, width, height, self.sensitivity)
 
 class Food:
-    def __init__(self, width: int, height: int):
-        self.x = random.randint(0, width - 10)
-        self.y = random.randint(0, height - 10)
-        self.size = 5
+    def __init__(self, width: int, height: int, fid: int = 0, rng: Optional[random.Random] = None):
+        self.fid = fid
+        self.size = FOOD_SIZE
+        self.respawn(width, height, rng)
+
+    def respawn(self, width: int, height: int, rng: Optional[random.Random] = None) -> None:
+        rng = rng if rng is not None else random
+        self.x = rng.randint(0, width - 10)
+        self.y = rng.randint(0, height - 10)
+
+class SpatialGrid:
+    # Uniform grid of world cells mapping each cell to the entity keys whose centre lies in it.
+    # Cells hold insertion-ordered dicts so query order is deterministic; a key can carry a value
+    # (the server's pellet index keeps each pellet's wire record there).
+    def __init__(self, cell_size: float = GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], Dict[int, object]] = {}
+        self.entries: Dict[int, Tuple[int, int]] = {}
+
+    def cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, key: int, x: float, y: float, value: object = None) -> None:
+        cell = self.cell_of(x, y)
+        self.entries[key] = cell
+        self.cells.setdefault(cell, {})[key] = value
+
+    def updated(self, removed: List[Tuple[int, float, float]],
+                added: List[Tuple[int, float, float, object]]) -> 'SpatialGrid':
+        # Copy-on-write: a new grid with the changes applied, sharing every cell they leave alone, so
+        # readers of this grid are never disturbed. Keys are located by position; the copy supports
+        # queries and further updated() calls but not remove() or move().
+        grid = SpatialGrid(self.cell_size)
+        cells = dict(self.cells)
+        copied = set()
+        for key, x, y in removed:
+            cell = self.cell_of(x, y)
+            if cell not in copied:
+                cells[cell] = dict(cells[cell])
+                copied.add(cell)
+            del cells[cell][key]
+        for key, x, y, value in added:
+            cell = self.cell_of(x, y)
+            if cell not in copied:
+                cells[cell] = dict(cells.get(cell, ()))
+                copied.add(cell)
+            cells[cell][key] = value
+        grid.cells = {cell: bucket for cell, bucket in cells.items() if bucket}
+        return grid
+
+    def remove(self, key: int) -> None:
+        cell = self.entries.pop(key, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self.cells[cell]
+
+    def move(self, key: int, x: float, y: float) -> None:
+        cell = self.cell_of(x, y)
+        if self.entries.get(key) != cell:
+            self.remove(key)
+            self.entries[key] = cell
+            self.cells.setdefault(cell, {})[key] = None
+
+    def query(self, x: float, y: float, radius: float) -> List[int]:
+        # Keys in every cell overlapping the square around (x, y); callers do the exact distance test
+        return self.query_rect(x - radius, y - radius, x + radius, y + radius)
+
+    def query_reach(self, eater: 'Player', margin: float) -> Iterator[int]:
+        # Keys near a blob that may grow while the caller goes through them (check_eat). Once they run out,
+        # the area the grown blob (size + margin) now reaches is searched again for keys not yet seen, so a
+        # blob growing mid-pass still finds what a full scan at its final size would. Keys already seen stay
+        # skipped even if they were moved meanwhile, like pellets respawned by the same pass.
+        radius = eater.size + margin
+        found = self.query(eater.x, eater.y, radius)
+        seen: Optional[Set[int]] = None
+        while found:
+            yield from found
+            if eater.size + margin <= radius:
+                return
+            radius = eater.size + margin
+            if seen is None:
+                seen = set(found)
+            else:
+                seen.update(found)
+            found = [key for key in self.query(eater.x, eater.y, radius) if key not in seen]
+
+    def query_rect(self, x0: float, y0: float, x1: float, y1: float) -> List[int]:
+        min_cx, min_cy = self.cell_of(x0, y0)
+        max_cx, max_cy = self.cell_of(x1, y1)
+        cells = self.cells
+        found = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+            # Rectangle larger than the occupied area (huge blobs): walk the occupied cells instead,
+            # sorted so the result order matches the row scan below
+            for cell in sorted(cells):
+                if min_cx <= cell[0] <= max_cx and min_cy <= cell[1] <= max_cy:
+                    found.extend(cells[cell])
+            return found
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.extend(bucket)
+        return found
+
+    def query_rect_items(self, x0: float, y0: float, x1: float, y1: float) -> List[Tuple[int, object]]:
+        # query_rect with each key's value, in the same order
+        min_cx, min_cy = self.cell_of(x0, y0)
+        max_cx, max_cy = self.cell_of(x1, y1)
+        cells = self.cells
+        found = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+            for cell in sorted(cells):
+                if min_cx <= cell[0] <= max_cx and min_cy <= cell[1] <= max_cy:
+                    found.extend(cells[cell].items())
+            return found
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.extend(bucket.items())
+        return found
 
 class Game:
-    def __init__(self, width: int, height: int):
+    # `seed` and `clock` make a match reproducible (replay.py); by default spawns are random and the match
+    # timer follows the wall clock. A `recorder` set by the server logs joins, leaves and each tick's inputs.
+    def __init__(self, width: int, height: int, food_count: int = FOOD_COUNT, seed: Optional[int] = None,
+                 clock: Callable[[], float] = time.time):
         self.width = width
         self.height = height
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.recorder = None
+        self.profiler = NULL_PROFILER
         self.players: Dict[int, Player] = {}
-        self.food: List[Food] = [Food(width, height) for _ in range(75)]
+        self.food: List[Food] = [Food(width, height, fid, self.random) for fid in range(food_count)]
+        # A respawned pellet is a new entity for the network layer, so it gets a fresh id
+        self.next_food_id = food_count
+        self.seq = 0
+        self.player_grid = SpatialGrid()
+        self.food_grid = SpatialGrid()
+        for index, food in enumerate(self.food):
+            self.food_grid.insert(index, food.x, food.y)
         self.lock = threading.Lock()
         self.start_time = None
-        self.last_decay = time.time()
+        self.decay_elapsed = 0.0
+        # Latest input per player, overwritten by receive threads and drained once per tick
+        self.pending_inputs: Dict[int, Tuple[float, float, int]] = {}
+        self.input_lock = threading.Lock()
 
     def add_player(self, pid: int, name: str) -> None:
         with self.lock:
+            if self.recorder is not None:
+                self.recorder.join(pid, name)
             if not self.players:
-                self.start_time = time.time()
+                self.start_time = self.clock()
                 logger.info("First player joined, starting game timer")
-            self.players[pid] = Player(pid, name, random.randint(0, self.width), random.randint(0, self.height))
+            player = Player(pid, name, self.random.randint(0, self.width), self.random.randint(0, self.height))
+            self.players[pid] = player
+            self.player_grid.insert(pid, player.x, player.y)
             logger.info(f"Added player {pid}: {name}")
 
     def remove_player(self, pid: int) -> None:
         with self.lock:
+            if self.recorder is not None:
+                self.recorder.leave(pid)
+            with self.input_lock:
+                self.pending_inputs.pop(pid, None)
             if pid in self.players:
                 del self.players[pid]
+                self.player_grid.remove(pid)
                 logger.info(f"Removed player {pid}")
 
-    def move_players(self, pid: int, mx: float, my: float) -> None:
-        with self.lock:
+    def set_input(self, pid: int, mx: float, my: float, seq: int = 0) -> None:
+        with self.input_lock:
+            self.pending_inputs[pid] = (mx, my, seq)
+
+    def move_players(self, dt: float) -> None:
+        with self.input_lock:
+            inputs, self.pending_inputs = self.pending_inputs, {}
+        if self.recorder is not None:
+            self.recorder.tick(dt, inputs)
+        for pid, (mx, my, seq) in inputs.items():
             if pid in self.players:
-                self.players[pid].move(mx, my)
+                self.players[pid].target = (mx, my)
+                self.players[pid].input_seq = seq
+        # Per-event debug lines are only built when DEBUG is on; the check is made once per tick
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for p in self.players.values():
+            if p.target is not None:
+                p.move(p.target[0], p.target[1], dt, self.width, self.height)
+                self.player_grid.move(p.pid, p.x, p.y)
+                if debug:
+                    logger.debug(f"Player {p.pid} moved to ({p.x:.1f}, {p.y:.1f})")
 
-    def check_eat(self) -> None:
+    def tick(self, dt: float) -> None:
         with self.lock:
-            players_list = list(self.players.values())
-            for p1 in players_list:
-                for p2 in players_list:
-                    if p1 == p2:
-                        continue
-                    if p1.size > p2.size:
-                        dist = ((p1.x - p2.x)**2 + (p1.y - p2.y)**2)**0.5
-                        if dist < p1.size:
-                            logger.info(f"Player {p1.pid} (size {p1.size}) ate {p2.pid} (size {p2.size})")
-                            p1.size += p2.size * 0.5
-                            p1.score += int(p2.score / 2)
-                            p2.size = 20
-                            p2.score = 0
+            self.seq += 1
+            profiler = self.profiler
+            start = profiler.begin()
+            self.move_players(dt)
+            profiler.end("move_players", start)
+            start = profiler.begin()
+            self.check_eat()
+            profiler.end("check_eat", start)
+            start = profiler.begin()
+            self.decay(dt)
+            profiler.end("decay", start)
+
+    def check_eat(self) -> None:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        players_list = list(self.players.values())
+        for p1 in players_list:
+            for pid in self.player_grid.query_reach(p1, 0):
+                p2 = self.players[pid]
+                if p1 == p2:
+                    continue
+                if p1.size > p2.size:
+                    dist = ((p1.x - p2.x)**2 + (p1.y - p2.y)**2)**0.5
+                    if dist < p1.size:
+                        logger.info(f"Player {p1.pid} (size {p1.size}) ate {p2.pid} (size {p2.size})")
+                        p1.size += p2.size * 0.5
+                        p1.score += int(p2.score / 2)
+                        p2.size = 20
+                        p2.score = 0
+                        if debug:
                             logger.debug(f"Player {p1.pid} score: {p1.score}, Player {p2.pid} score reset to: {p2.score}")
-                            p2.x = random.randint(0, self.width - p2.size)
-                            p2.y = random.randint(0, self.height - p2.size)
-
-                for food in self.food[:]:
-                    dist = ((p1.x - food.x)**2 + (p1.y - food.y)**2)**0.5
-                    # Eat food when the blob's edge touches the food (use sum of radii)
-                    if dist < (p1.size + food.size):
-                        p1.size += food.size
-                        p1.score += food.size
-                        self.food.remove(food)
-                        self.food.append(Food(self.width, self.height))
+                        p2.x = self.random.randint(0, self.width - p2.size)
+                        p2.y = self.random.randint(0, self.height - p2.size)
+                        self.player_grid.move(p2.pid, p2.x, p2.y)
+
+            for index in self.food_grid.query_reach(p1, FOOD_SIZE):
+                food = self.food[index]
+                dist = ((p1.x - food.x)**2 + (p1.y - food.y)**2)**0.5
+                # Eat food when the blob's edge touches the food (use sum of radii)
+                if dist < (p1.size + food.size):
+                    p1.size += food.size
+                    p1.score += food.size
+                    if debug:
                         logger.debug(f"Player {p1.pid} ate food at ({food.x}, {food.y})")
+                    # Respawn in place: the pellet keeps its slot and only changes grid cell
+                    food.respawn(self.width, self.height, self.random)
+                    food.fid = self.next_food_id
+                    self.next_food_id += 1
+                    self.food_grid.move(index, food.x, food.y)
 
-    def decay(self) -> None:
-        with self.lock:
-            now = time.time()
-            if now - self.last_decay >= 1.0:
-                for p in self.players.values():
-                    if p.size > 20:
-                        p.size *= 0.98
+    def decay(self, dt: float) -> None:
+        self.decay_elapsed += dt
+        if self.decay_elapsed >= 1.0:
+            debug = logger.isEnabledFor(logging.DEBUG)
+            for p in self.players.values():
+                if p.size > 20:
+                    p.size *= 0.98
+                    if debug:
                         logger.debug(f"Player {p.pid} decayed to {p.size:.1f}")
-                self.last_decay = now
+            self.decay_elapsed -= 1.0
 
     def get_state(self) -> Dict:
         with self.lock:
             if self.start_time is None:
                 elapsed = GAME_DURATION
             else:
-                elapsed = int(GAME_DURATION - (time.time() - self.start_time))
-            return {
+                elapsed = int(GAME_DURATION - (self.clock() - self.start_time))
+            state = {
+                'seq': self.seq,
                 'players': {p.pid: (p.x, p.y, p.size, p.name, int(p.score)) for p in self.players.values()},
-                'food': [(f.x, f.y, f.size) for f in self.food],
-                'time_left': elapsed if elapsed > 0 else 0
+                'food': {f.fid: (f.x, f.y, f.size) for f in self.food},
+                'time_left': elapsed if elapsed > 0 else 0,
+                'input_acks': {p.pid: p.input_seq for p in self.players.values()}
             }
+            if self.recorder is not None:
+                self.recorder.checkpoint(state)
+            return state
+
+ENGINES = ("python", "numpy", "regions")
+
+def create_game(engine: str, width: int, height: int, food_count: int = FOOD_COUNT, regions: Optional[int] = None,
+                seed: Optional[int] = None, clock: Callable[[], float] = time.time):
+    if engine == "numpy":
+        # Imported lazily so NumPy stays an optional dependency of the default engine
+        from numpy_engine import NumpyGame
+        return NumpyGame(width, height, food_count, seed=seed, clock=clock)
+    if engine == "regions":
+        from regions import RegionGame
+        return RegionGame(width, height, food_count, regions, seed=seed, clock=clock)
+    if engine != "python":
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    return Game(width, height, food_count, seed=seed, clock=clock)
+
+def unsent_bytes(sock: socket.socket) -> int:
+    # Bytes the kernel still holds for this socket (written but not yet acknowledged by the peer)
+    if TIOCOUTQ is None:
+        return 0
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), TIOCOUTQ, b'\0\0\0\0'))[0]
+    except OSError:
+        return 0
+
+class RateLimiter:
+    # Token bucket: `rate` events per second on average, up to `burst` at once
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, now: float, count: int = 1) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return True
+        return False
+
+class WorldSnapshot:
+    # One tick's state as the network side sees it: the game state plus the spatial indexes and wire records
+    # derived from it. Built by the simulation thread and never changed once published, so senders read
+    # the current one through a single attribute without any lock.
+    def __init__(self, state: Dict, player_index: SpatialGrid, player_records: Dict[int, bytes],
+                 player_updates: Dict[int, bytes], max_player_size: float, food_index: SpatialGrid):
+        self.state = state
+        self.player_index = player_index
+        # Full and update records of each player, packed once per tick and shared by every client's frame
+        self.player_records = player_records
+        self.player_updates = player_updates
+        self.max_player_size = max_player_size
+        # Pellets by position, each holding its packed record; carried over copy-on-write between ticks
+        self.food_index = food_index
+
+class SpectatorFeed:
+    # The whole-world stream every spectator shares. Each frame is encoded once as a delta on the frame
+    # before it; the keyframe is only made if some spectator needs one (just joined, or skipped a frame
+    # while its last one was unsent).
+    def __init__(self):
+        self.seq = -1
+        self.baseline = -1
+        self.delta: Optional[bytes] = None
+        self.keyframe: Optional[bytes] = None
+        self.make_keyframe: Optional[Callable[[], bytes]] = None
+
+    def push(self, seq: int, baseline: int, delta: Optional[bytes], make_keyframe: Callable[[], bytes]) -> None:
+        self.seq = seq
+        self.baseline = baseline
+        self.delta = delta
+        self.keyframe = None
+        self.make_keyframe = make_keyframe
+
+    def frame_for(self, sent_seq: int) -> Tuple[bytes, bool]:
+        # The frame for a spectator whose last frame was sent_seq, and whether it is a keyframe
+        if self.delta is not None and sent_seq == self.baseline:
+            return self.delta, False
+        if self.keyframe is None:
+            self.keyframe = self.make_keyframe()
+        return self.keyframe, True
+
+class Connection:
+    def __init__(self, sock: socket.socket, addr: Tuple[str, int], input_limit: float = INPUT_LIMIT):
+        self.sock = sock
+        self.addr = addr
+        self.decoder = protocol.FrameDecoder()
+        self.input_limiter = RateLimiter(input_limit, min(INPUT_BURST, input_limit))
+        flood_rate = INPUT_FLOOD_FACTOR * input_limit
+        self.input_flood = RateLimiter(flood_rate, flood_rate * INPUT_FLOOD_WINDOW)
+        self.pid: Optional[int] = None
+        self.name = ""
+        self.spectator = False
+        self.accepted_at = time.monotonic()
+        # Unsent buffers of the last frame written; no new state is queued until they drain, so a slow
+        # client skips straight to the newest snapshot instead of queueing stale ones
+        self.pending: List[bytes] = []
+        self.want_write = False
+        self.sent_seq = -1
+        self.skipped_seq = -1
+        self.acked = 0
+        self.sent_minimap = 0
+        self.zoom = ZoomTracker()
+        # UDP transport: the token handed out in WELCOME, the address its datagrams come from (None until
+        # the first valid one arrives, state goes over TCP until then) and the newest input seq applied
+        self.token = 0
+        self.udp_addr: Optional[Tuple[str, int]] = None
+        self.input_seq = 0
+        # Views of the world this client was sent, by seq, used as its delta baselines
+        self.views: Dict[int, Dict] = {}
+        # Bandwidth budget (bytes per second), the bytes it allows right now, and the accumulated priority
+        # of updates left out of earlier frames
+        self.budget = float(INITIAL_CLIENT_BUDGET)
+        self.credit = self.budget * BUDGET_BURST
+        self.credit_time = time.monotonic()
+        self.last_backoff = 0.0
+        self.budget_limited = False
+        self.player_priority: Dict[int, float] = {}
+        self.food_priority: Dict[int, float] = {}
 
 class Server:
-    def __init__(self, host: str, port: int):
-        self.game = Game(WIDTH, HEIGHT)
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            self.socket.bind((host, port))
-        except Exception as e:
-            logger.error(f"Failed to bind to {host}:{port}: {e}")
-            raise
-        self.socket.listen(5)
-        self.pid_counter = 0
-        self.connections: Dict[int, socket.socket] = {}
-        logger.info(f"Server running on {host}:{port}")
-
-    def handle_client(self, conn: socket.socket, addr: Tuple[str, int], pid: int, name: str) -> None:
-        logger.info(f"Starting client handler for {pid}: {name}")
+    # Single event loop (selectors) multiplexing every socket; the simulation runs on its own thread
+    # and wakes the loop through a socketpair whenever it publishes a snapshot.
+    # With port None nothing is bound: connections arrive through adopt() (lobby.py arenas).
+    def __init__(self, host: str, port: Optional[int], tick_rate: int = TICK_RATE, engine: str = "python", udp: bool = False,
+                 send_rate: int = SEND_RATE, metrics_port: Optional[int] = None,
+                 map_size: Tuple[int, int] = (WIDTH, HEIGHT), regions: Optional[int] = None,
+                 input_limit: float = INPUT_LIMIT, seed: Optional[int] = None, record: Optional[str] = None,
+                 client_budget: int = MAX_CLIENT_BUDGET, game: Optional[object] = None,
+                 backlog: int = socket.SOMAXCONN, max_players: Optional[int] = None,
+                 max_handshakes: int = MAX_HANDSHAKES, profile: bool = False,
+                 cprofile_ticks: int = CPROFILE_TICKS):
+        width, height = map_size
+        # Keep the default pellet density on larger maps
+        food_count = round(FOOD_COUNT * width * height / (WIDTH * HEIGHT))
+        if record is not None and seed is None:
+            # A recording is only replayable with the seed it was played with
+            seed = random.getrandbits(32)
+        # An already built game replaces the engine (gateway.py passes one that reads shared memory)
+        self.game = game if game is not None else create_game(engine, width, height, food_count, regions, seed=seed)
+        if record is not None:
+            from replay import Recorder
+            self.game.recorder = Recorder(record, engine, seed, width, height, food_count, tick_rate,
+                                          getattr(self.game, 'count', 0))
+            logger.info(f"Recording match to {record} (seed {seed})")
+        # Per-phase timings of the simulation and the event loop (profiler.py), off unless asked for
+        self.profiler = Profiler(cprofile_ticks=cprofile_ticks) if profile else NULL_PROFILER
+        self.game.profiler = self.profiler
+        self.metrics = metrics.Registry()
+        self.tick_seconds = self.metrics.histogram("phago_tick_seconds",
+                                                   "Simulation tick plus snapshot publish time")
+        self.lock_wait_seconds = self.metrics.histogram("phago_game_lock_wait_seconds",
+                                                        "Time spent waiting to acquire Game.lock")
+        self.lock_hold_seconds = self.metrics.histogram("phago_game_lock_hold_seconds",
+                                                        "Time Game.lock is held per acquisition")
+        self.snapshot_bytes = self.metrics.histogram("phago_snapshot_bytes", "Size of each state frame sent",
+                                                     metrics.BYTES_BUCKETS)
+        self.keyframes = self.metrics.counter("phago_keyframes_total", "Full state frames sent")
+        self.deltas = self.metrics.counter("phago_deltas_total", "Delta state frames sent")
+        self.snapshots_skipped = self.metrics.counter("phago_snapshots_skipped_total",
+                                                      "Ticks a client was due a frame but its last one was unsent")
+        self.bytes_sent = self.metrics.counter("phago_bytes_sent_total", "Bytes written to TCP and UDP sockets")
+        self.disconnects = self.metrics.counter("phago_disconnects_total", "Client connections closed")
+        self.handshake_seconds = self.metrics.histogram("phago_handshake_seconds",
+                                                        "Time from accept to a completed HELLO or WATCH")
+        self.handshakes_timed_out = self.metrics.counter("phago_handshakes_timed_out_total",
+                                                         "Connections closed for not finishing the handshake in time")
+        self.joins_refused = self.metrics.counter("phago_joins_refused_total",
+                                                  "Players turned away because the server was full")
+        self.metrics.gauge("phago_handshakes", "Connections still in their handshake", lambda: len(self.handshaking))
+        self.bad_messages = self.metrics.counter("phago_bad_messages_total",
+                                                 "Connections dropped and datagrams ignored for malformed data")
+        self.datagrams_dropped = self.metrics.counter("phago_datagrams_dropped_total",
+                                                      "State datagrams the socket refused")
+        self.inputs_limited = self.metrics.counter("phago_inputs_limited_total",
+                                                   "Inputs ignored for exceeding the per-connection rate limit")
+        self.snapshots_throttled = self.metrics.counter("phago_snapshots_throttled_total",
+                                                        "Ticks a client was due a frame but had spent its byte budget")
+        self.updates_deferred = self.metrics.counter("phago_updates_deferred_total",
+                                                     "Entity updates left out of a frame to stay within budget")
+        self.metrics.gauge("phago_client_budget_bytes", "Mean per-client byte budget per second",
+                           self.mean_client_budget)
+        self.metrics.gauge("phago_players", "Connected players", lambda: len(self.connections))
+        self.metrics.gauge("phago_spectators", "Connected spectators", lambda: len(self.spectators))
+        self.metrics.gauge("phago_send_queue_bytes", "Bytes waiting for the kernel across all clients",
+                           self.send_queue_bytes)
+        self.metrics.gauge("phago_send_queue_clients", "Clients with an unsent frame",
+                           lambda: sum(1 for conn in list(self.connections.values()) if conn.pending))
+        self.game.lock = metrics.TimedLock(self.lock_wait_seconds, self.game.lock, self.lock_hold_seconds)
+        self.tick_rate = tick_rate
+        self.input_limit = input_limit
+        self.client_budget = client_budget
+        self.max_players = max_players
+        self.max_handshakes = max_handshakes
+        # Each client gets a snapshot every send_stride ticks; clients join at different ticks, so sends
+        # are spread over the ticks instead of all landing on one
+        self.send_stride = max(1, round(tick_rate / send_rate))
+        self.tick_times: Deque[float] = collections.deque(maxlen=TICK_SAMPLES)
+        self.socket: Optional[socket.socket] = None
+        if port is not None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                self.socket.bind((host, port))
+            except Exception as e:
+                logger.error(f"Failed to bind to {host}:{port}: {e}")
+                raise
+            # A single accept loop drains bursts of connects, so give the kernel room to queue them
+            self.socket.listen(backlog)
+        self.pid_counter = itertools.count()
+        self.connections: Dict[int, Connection] = {}
+        # Spectators all get the same whole-world frames, built in the event loop only while any are watching
+        self.spectators: Set[Connection] = set()
+        self.feed = SpectatorFeed()
+        self.feed_view: Optional[Dict] = None
+        # Connections yet to finish their handshake, oldest first, with their deadlines
+        self.handshaking: Dict[Connection, float] = {}
+        self.accepting = False
+        self.selector: Optional[selectors.BaseSelector] = None
+        # Optional UDP socket on the same port for input and state datagrams
+        self.udp_socket: Optional[socket.socket] = None
+        self.tokens: Dict[int, Connection] = {}
+        if udp and self.socket is not None:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(self.socket.getsockname())
+            self.udp_socket.setblocking(False)
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        # Replaced, never modified, by the simulation thread after every tick
+        self.published: Optional[WorldSnapshot] = None
+        self.minimap_frame = b""
+        self.minimap_version = 0
+        self.last_minimap = 0.0
+        self.running = True
+        if self.socket is not None:
+            logger.info(f"Server running on {host}:{port}")
+        if metrics_port is not None:
+            metrics.serve(self.metrics, METRICS_HOST, metrics_port)
+            logger.info(f"Metrics on http://{METRICS_HOST}:{metrics_port}/metrics")
+
+    @property
+    def latest_snapshot(self) -> Optional[Dict]:
+        published = self.published
+        return published.state if published is not None else None
+
+    def mean_client_budget(self) -> float:
+        connections = list(self.connections.values())
+        return sum(conn.budget for conn in connections) / len(connections) if connections else 0.0
+
+    def send_queue_bytes(self) -> int:
+        # Read from the metrics thread while the event loop writes; a momentarily stale sum is fine
+        return sum(len(buffer) for conn in list(self.connections.values()) for buffer in list(conn.pending))
+
+    def handle_frames(self, conn: Connection, frames: List[Tuple[int, bytes]]) -> None:
+        latest = None
+        inputs = 0
+        for msg_type, payload in frames:
+            if conn.spectator:
+                raise protocol.ProtocolError(f"Spectators only receive, got message type {msg_type}")
+            if conn.pid is None:
+                if msg_type == protocol.MSG_WATCH:
+                    protocol.decode_watch(payload)
+                    self.watch(conn)
+                    continue
+                if msg_type != protocol.MSG_HELLO:
+                    raise protocol.ProtocolError(f"Expected HELLO, got message type {msg_type}")
+                name = protocol.decode_hello(payload)
+                if self.max_players is not None and len(self.connections) >= self.max_players:
+                    logger.warning(f"Server full ({self.max_players} players), refusing {conn.addr}")
+                    self.joins_refused.inc()
+                    self.drop(conn)
+                    return
+                self.admit(conn, name)
+            elif msg_type == protocol.MSG_INPUT:
+                latest = payload
+                inputs += 1
+        if inputs:
+            now = time.monotonic()
+            if not conn.input_flood.allow(now, inputs):
+                raise protocol.ProtocolError(f"Input flood: over {conn.input_flood.rate:.0f} inputs/s "
+                                             f"for {INPUT_FLOOD_WINDOW:.0f} s")
+            # Inputs are latest-value-wins: only the newest one in a batch is applied, so a batch is charged once
+            if not conn.input_limiter.allow(now):
+                self.inputs_limited.inc()
+                latest = None
+        if latest is not None:
+            mx, my, ack, seq = protocol.decode_input(latest)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received update from {conn.pid}: ({mx:.1f}, {my:.1f})")
+            self.game.set_input(conn.pid, mx, my, seq)
+            conn.acked = max(conn.acked, ack)
+
+    def admit(self, conn: Connection, name: str) -> None:
+        pid = next(self.pid_counter)
+        logger.info(f"Received name from {conn.addr}: {name}")
+        conn.pid = pid
+        conn.name = name
+        self.handshake_done(conn)
         self.game.add_player(pid, name)
         self.connections[pid] = conn
-        conn.setblocking(False)
+        if self.udp_socket is not None:
+            while not conn.token or conn.token in self.tokens:
+                conn.token = random.getrandbits(32)
+            self.tokens[conn.token] = conn
+        conn.pending = [protocol.encode_welcome(pid, conn.token, self.tick_rate)]
+
+    def handshake_done(self, conn: Connection) -> None:
+        if self.handshaking.pop(conn, None) is not None:
+            self.handshake_seconds.observe(time.monotonic() - conn.accepted_at)
+            self.resume_accepting()
+
+    def watch(self, conn: Connection) -> None:
+        logger.info(f"Spectator from {conn.addr}")
+        self.handshake_done(conn)
+        conn.spectator = True
+        self.spectators.add(conn)
+        conn.pending = [protocol.encode_welcome(protocol.SPECTATOR_PID, 0, self.tick_rate)]
+
+    def queue_snapshot(self, conn: Connection) -> bool:
+        snapshot = self.latest_snapshot
+        if conn.pid is None or snapshot is None or snapshot['seq'] - conn.sent_seq < self.send_stride:
+            return False
+        if conn.pending:
+            # Counted once per tick the client is due a frame but still has the last one unsent
+            if conn.skipped_seq != snapshot['seq']:
+                conn.skipped_seq = snapshot['seq']
+                self.snapshots_skipped.inc()
+            return False
+        self.adapt_budget(conn, time.monotonic())
+        if conn.credit <= 0:
+            # Over budget: no frame until the credit refills; the client keeps interpolating meanwhile
+            self.snapshots_throttled.inc()
+            return False
+        view = self.build_view(conn.pid, conn.zoom)
+        baseline = conn.views.get(conn.acked)
+        parts = self.keyframe_parts(view) if baseline is None else self.delta_parts(baseline, view)
+        size = sum(map(len, parts))
+        if size > conn.credit:
+            conn.budget_limited = True
+            view = self.schedule_view(conn, view, baseline)
+            parts = self.keyframe_parts(view) if baseline is None else self.delta_parts(baseline, view)
+            size = sum(map(len, parts))
+        else:
+            conn.player_priority.clear()
+            conn.food_priority.clear()
+        conn.credit -= size
+        conn.views[view['seq']] = view
+        # Views go in with rising seqs, so the oldest is always first
+        while len(conn.views) > SNAPSHOT_HISTORY:
+            del conn.views[next(iter(conn.views))]
+        if baseline is None:
+            self.keyframes.inc()
+        else:
+            self.deltas.inc()
+        self.snapshot_bytes.observe(size)
+        frames = [parts]
+        if conn.sent_minimap != self.minimap_version:
+            conn.sent_minimap = self.minimap_version
+            frames.insert(0, [self.minimap_frame])
+            conn.credit -= len(self.minimap_frame)
+        for parts in frames:
+            # Frames too big for one datagram fall back to the TCP stream
+            if conn.udp_addr is not None and sum(map(len, parts)) <= protocol.MAX_DATAGRAM_SIZE:
+                self.send_datagram(conn, parts)
+            else:
+                conn.pending.extend(parts)
+        conn.sent_seq = view['seq']
+        return bool(conn.pending)
+
+    def adapt_budget(self, conn: Connection, now: float) -> None:
+        # AIMD on what is still queued for the client (our pending buffers plus, for TCP, the kernel's send
+        # queue) and on how far its acks trail what we sent, which is the only signal UDP gives
+        queued = sum(map(len, conn.pending))
+        if conn.udp_addr is None:
+            queued += unsent_bytes(conn.sock)
+        ack_lag = (conn.sent_seq - conn.acked) / self.send_stride if conn.acked else 0
+        if queued > conn.budget * QUEUE_TARGET or ack_lag > ACK_LAG_FRAMES:
+            if now - conn.last_backoff >= BACKOFF_INTERVAL:
+                conn.budget = max(MIN_CLIENT_BUDGET, conn.budget * BUDGET_BACKOFF)
+                conn.last_backoff = now
+        elif conn.budget_limited:
+            conn.budget += BUDGET_STEP
+        conn.budget = min(conn.budget, self.client_budget)
+        conn.budget_limited = False
+        conn.credit = min(conn.budget * BUDGET_BURST, conn.credit + conn.budget * (now - conn.credit_time))
+        conn.credit_time = now
+
+    def schedule_view(self, conn: Connection, view: Dict, baseline: Optional[Dict]) -> Dict:
+        # Trim a view that does not fit the client's credit. A deferred change keeps the value the client
+        # already has: a blob stays at its baseline record, a new blob or pellet is left out. Anything the
+        # client may hold newer than its baseline (sent in an unacked frame), and its own blob, is always
+        # sent, since reverting it to the baseline would make it jump back.
+        base_players = baseline['players'] if baseline is not None else {}
+        base_food = baseline['food'] if baseline is not None else {}
+        last = conn.views.get(conn.sent_seq)
+        last_players = last['players'] if last is not None else {}
+        last_food = last['food'] if last is not None else {}
+        positions = self.latest_snapshot['players']
+        ox, oy = positions[conn.pid][:2] if conn.pid in positions else (0.0, 0.0)
+        players = {}
+        food = {}
+        candidates = []
+        # Header and removals are always sent
+        required = (protocol.HEADER.size + protocol.DELTA_HEADER.size
+                    + 4 * sum(1 for pid in base_players if pid not in view['players'])
+                    + 4 * sum(1 for fid in base_food if fid not in view['food']))
+        for pid, update in view['players'].items():
+            old = base_players.get(pid)
+            if old == update:
+                players[pid] = update
+                continue
+            cost = protocol.PLAYER.size if old is None else protocol.PLAYER_UPDATE.size
+            if pid == conn.pid or last_players.get(pid) != old:
+                players[pid] = update
+                required += cost
+                continue
+            x, y, size, _, _ = positions.get(pid, (ox, oy, 20, "", 0))
+            distance = ((x - ox) ** 2 + (y - oy) ** 2) ** 0.5
+            weight = (size / 20) / (1 + distance / PRIORITY_DISTANCE)
+            candidates.append((conn.player_priority.get(pid, 0.0) + weight, True, pid, update, old, cost))
+        for fid, record in view['food'].items():
+            if fid in base_food or fid in last_food:
+                food[fid] = record
+                if fid not in base_food:
+                    required += protocol.FOOD.size
+                continue
+            candidates.append((conn.food_priority.get(fid, 0.0) + FOOD_PRIORITY, False, fid, record, None,
+                               protocol.FOOD.size))
+        allowance = conn.credit - required
+        player_priority = {}
+        food_priority = {}
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for priority, is_player, key, value, old, cost in candidates:
+            if cost <= allowance:
+                allowance -= cost
+                if is_player:
+                    players[key] = value
+                else:
+                    food[key] = value
+            elif is_player:
+                player_priority[key] = priority
+                if old is not None:
+                    players[key] = old
+            else:
+                food_priority[key] = priority
+        conn.player_priority = player_priority
+        conn.food_priority = food_priority
+        self.updates_deferred.inc(len(player_priority) + len(food_priority))
+        return {**view, 'players': players, 'food': food}
+
+    def send_datagram(self, conn: Connection, parts: List[bytes]) -> None:
         try:
-            conn.send(pickle.dumps(("PID", pid)))
-        except Exception as e:
-            logger.error(f"Failed to send PID to {addr}: {e}")
+            if HAS_SENDMSG:
+                sent = self.udp_socket.sendmsg(parts, (), 0, conn.udp_addr)
+            else:
+                sent = self.udp_socket.sendto(b"".join(parts), conn.udp_addr)
+            self.bytes_sent.inc(sent)
+        except OSError as e:
+            # Full socket buffer or unreachable peer: state is latest-value-wins, the next tick replaces it
+            self.datagrams_dropped.inc()
+            logger.debug(f"Datagram to {conn.udp_addr} dropped: {e}")
+
+    def keyframe_parts(self, view: Dict) -> List[bytes]:
+        records = view['records']
+        players = [records[pid] for pid in view['players']]
+        return protocol.state_parts(view['seq'], view['input_ack'], view['time_left'], players,
+                                    list(view['food'].values()))
+
+    def delta_parts(self, baseline: Dict, view: Dict) -> List[bytes]:
+        # Views hold packed update records, so a changed player is simply one whose bytes differ
+        records = view['records']
+        players = view['players']
+        base_players = baseline['players']
+        joined = []
+        updated = []
+        for pid, update in players.items():
+            old = base_players.get(pid)
+            if old is None:
+                joined.append(records[pid])
+            elif old != update:
+                updated.append(update)
+        left = [pid for pid in base_players if pid not in players]
+        food = view['food']
+        base_food = baseline['food']
+        spawned = [record for fid, record in food.items() if fid not in base_food]
+        eaten = [fid for fid in base_food if fid not in food]
+        return protocol.delta_parts(view['seq'], baseline['seq'], view['input_ack'], view['time_left'], joined,
+                                    updated, left, spawned, eaten)
+
+    def flush(self, conn: Connection) -> bool:
+        # Write as much of the pending frame as the socket takes (scatter/gather, no joined copy);
+        # True once it is fully sent
+        pending = conn.pending
+        while pending:
+            batch = pending[:SEND_IOV_MAX]
+            try:
+                if HAS_SENDMSG:
+                    sent = conn.sock.sendmsg(batch)
+                else:
+                    sent = conn.sock.send(b"".join(batch))
+            except BlockingIOError:
+                return False
+            self.bytes_sent.inc(sent)
+            # Drop the buffers written in full and keep the unsent tail of a partially written one
+            done = 0
+            while done < len(pending) and sent >= len(pending[done]):
+                sent -= len(pending[done])
+                done += 1
+            if sent:
+                pending[done] = memoryview(pending[done])[sent:]
+            del pending[:done]
+        return True
+
+    def drop(self, conn: Connection) -> None:
+        if self.selector is not None:
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+        if conn.pid is not None:
+            self.game.remove_player(conn.pid)
+            self.connections.pop(conn.pid, None)
+        self.tokens.pop(conn.token, None)
+        self.spectators.discard(conn)
+        if self.handshaking.pop(conn, None) is not None:
+            self.resume_accepting()
+        conn.sock.close()
+        self.disconnects.inc()
+        logger.info(f"Client {conn.addr} disconnected")
+
+    def publish_snapshot(self) -> None:
+        profiler = self.profiler
+        start = profiler.begin()
+        snapshot = self.game.get_state()
+        profiler.end("get_state", start)
+        previous = self.published
+        food = snapshot['food']
+        if previous is None:
+            food_index = SpatialGrid(AOI_CELL_SIZE)
+            for fid, record in food.items():
+                food_index.insert(fid, record[0], record[1], protocol.encode_food_record(fid, record))
+        else:
+            # Pellets change little per tick: only eaten and spawned ones touch the index
+            old_food = previous.state['food']
+            eaten = [(fid, old_food[fid][0], old_food[fid][1]) for fid in old_food.keys() - food.keys()]
+            spawned = [(fid, food[fid][0], food[fid][1], protocol.encode_food_record(fid, food[fid]))
+                       for fid in food.keys() - old_food.keys()]
+            food_index = previous.food_index.updated(eaten, spawned)
+        player_index = SpatialGrid(AOI_CELL_SIZE)
+        max_player_size = 0.0
+        player_records = {}
+        player_updates = {}
+        for pid, record in snapshot['players'].items():
+            x, y, size, _, _ = record
+            player_index.insert(pid, x, y)
+            max_player_size = max(max_player_size, size)
+            player_records[pid] = protocol.encode_player_record(pid, record)
+            player_updates[pid] = protocol.encode_player_update(pid, record)
+        self.published = WorldSnapshot(snapshot, player_index, player_records, player_updates, max_player_size,
+                                       food_index)
+        now = time.monotonic()
+        if now - self.last_minimap >= MINIMAP_INTERVAL:
+            self.publish_minimap(snapshot)
+            self.last_minimap = now
+
+    def publish_minimap(self, snapshot: Dict) -> None:
+        density = bytearray(MINIMAP_COLS * MINIMAP_ROWS)
+        cell_w = self.game.width / MINIMAP_COLS
+        cell_h = self.game.height / MINIMAP_ROWS
+        for x, y, _ in snapshot['food'].values():
+            cell = min(int(y / cell_h), MINIMAP_ROWS - 1) * MINIMAP_COLS + min(int(x / cell_w), MINIMAP_COLS - 1)
+            if density[cell] < 255:
+                density[cell] += 1
+        leaders = sorted(snapshot['players'].items(), key=lambda item: item[1][4], reverse=True)[:MINIMAP_TOP_PLAYERS]
+        self.minimap_frame = protocol.encode_minimap(self.game.width, self.game.height, MINIMAP_COLS, MINIMAP_ROWS,
+                                                     density, leaders)
+        self.minimap_version += 1
+
+    def build_view(self, pid: int, zoom: ZoomTracker) -> Dict:
+        # The part of the latest snapshot this player's camera can see, plus AOI_MARGIN
+        published = self.published
+        snapshot = published.state
+        players = snapshot['players']
+        own = players.get(pid)
+        records = published.player_records
+        if own is None:
+            return {'seq': snapshot['seq'], 'players': {}, 'food': {}, 'time_left': snapshot['time_left'],
+                    'input_ack': 0, 'records': records}
+        px, py, psize, _, _ = own
+        zoom.update_zoom(psize)
+        half_w, half_h = zoom.view_half_extents()
+        x0, y0 = px - half_w - AOI_MARGIN, py - half_h - AOI_MARGIN
+        x1, y1 = px + half_w + AOI_MARGIN, py + half_h + AOI_MARGIN
+        # Blobs are indexed by centre, so widen the query by the largest radius to catch big overlapping ones
+        reach = published.max_player_size
+        updates = published.player_updates
+        visible_players = {}
+        for other in published.player_index.query_rect(x0 - reach, y0 - reach, x1 + reach, y1 + reach):
+            x, y, size, _, _ = players[other]
+            if x0 - size <= x <= x1 + size and y0 - size <= y <= y1 + size:
+                visible_players[other] = updates[other]
+        visible_players[pid] = updates[pid]
+        food = snapshot['food']
+        visible_food = {}
+        for fid, record in published.food_index.query_rect_items(x0, y0, x1, y1):
+            x, y, _ = food[fid]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                visible_food[fid] = record
+        # Players map to their packed update record and pellets to their packed record; 'records' holds
+        # this tick's full player records for joins and keyframes
+        return {
+            'seq': snapshot['seq'],
+            'players': visible_players,
+            'food': visible_food,
+            'time_left': snapshot['time_left'],
+            'input_ack': snapshot['input_acks'].get(pid, 0),
+            'records': records
+        }
+
+    def world_view(self, published: WorldSnapshot) -> Dict:
+        # build_view without the camera: every player and pellet, for spectators
+        snapshot = published.state
+        return {
+            'seq': snapshot['seq'],
+            'players': published.player_updates,
+            'food': dict(published.food_index.query_rect_items(0, 0, self.game.width, self.game.height)),
+            'time_left': snapshot['time_left'],
+            'input_ack': 0,
+            'records': published.player_records
+        }
+
+    def update_feed(self) -> None:
+        published = self.published
+        if published is None or published.state['seq'] - self.feed.seq < self.send_stride:
+            return
+        view = self.world_view(published)
+        previous = self.feed_view
+        self.feed_view = view
+        if previous is None:
+            self.feed.push(view['seq'], -1, None, lambda: b"".join(self.keyframe_parts(view)))
+        else:
+            self.feed.push(view['seq'], previous['seq'], b"".join(self.delta_parts(previous, view)),
+                           lambda: b"".join(self.keyframe_parts(view)))
+
+    def send_feed(self) -> None:
+        feed = self.feed
+        for conn in list(self.spectators):
+            if conn.sent_seq == feed.seq:
+                continue
+            if conn.pending:
+                if conn.skipped_seq != feed.seq:
+                    conn.skipped_seq = feed.seq
+                    self.snapshots_skipped.inc()
+                continue
+            frame, keyframe = feed.frame_for(conn.sent_seq)
+            if keyframe:
+                self.keyframes.inc()
+            else:
+                self.deltas.inc()
+            self.snapshot_bytes.observe(len(frame))
+            if conn.sent_minimap != self.minimap_version:
+                conn.sent_minimap = self.minimap_version
+                conn.pending.append(self.minimap_frame)
+            conn.pending.append(frame)
+            conn.sent_seq = feed.seq
+            self.write(conn)
+
+    def simulation_loop(self) -> None:
+        interval = 1.0 / self.tick_rate
+        last_tick = time.monotonic()
+        next_tick = last_tick + interval
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            profiler = self.profiler
+            start = profiler.begin()
+            self.game.tick(min(now - last_tick, MAX_TICK_DT))
+            profiler.end("tick", start)
+            start = profiler.begin()
+            self.publish_snapshot()
+            profiler.end("publish", start)
+            profiler.tick()
+            tick_time = time.monotonic() - now
+            self.tick_times.append(tick_time)
+            self.tick_seconds.observe(tick_time)
+            self.wake()
+            last_tick = now
+            next_tick += interval
+            if next_tick < now:
+                # Fell behind (e.g. a long GC pause); resync instead of bursting catch-up ticks
+                next_tick = now + interval
+
+    def start_simulation(self) -> None:
+        sim_thread = threading.Thread(target=self.simulation_loop, daemon=True, name="simulation")
+        sim_thread.start()
+        logger.info(f"Simulation running at {self.tick_rate} Hz using {type(self.game).__name__}")
+
+    def wake(self) -> None:
+        try:
+            self.wake_writer.send(b"\0")
+        except BlockingIOError:
+            # The loop already has an unread wake-up pending
+            pass
+
+    def accept_ready(self) -> None:
+        while self.accepting:
+            try:
+                sock, addr = self.socket.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # e.g. out of file descriptors: leave the rest in the backlog until connections close
+                logger.error(f"Accept failed: {e}")
+                return
+            logger.info(f"New connection from {addr}")
+            self.adopt(sock, addr)
+
+    def adopt(self, sock: socket.socket, addr: Tuple[str, int]) -> Connection:
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Connection(sock, addr, self.input_limit)
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+        self.handshaking[conn] = conn.accepted_at + HANDSHAKE_TIMEOUT
+        if self.accepting and len(self.handshaking) >= self.max_handshakes:
+            self.selector.unregister(self.socket)
+            self.accepting = False
+            logger.warning(f"{len(self.handshaking)} handshakes in progress, pausing accept")
+        return conn
+
+    def resume_accepting(self) -> None:
+        if not self.accepting and self.socket is not None and self.selector is not None \
+                and len(self.handshaking) < self.max_handshakes:
+            self.selector.register(self.socket, selectors.EVENT_READ, self.accept_ready)
+            self.accepting = True
+
+    def handshake_wait(self) -> Optional[float]:
+        # How long the event loop may block before the oldest handshake is due; the loop expires handshakes
+        # itself, since a front end without a simulation (relay.py) is never woken by ticks
+        if not self.handshaking:
+            return None
+        return max(0.0, next(iter(self.handshaking.values())) - time.monotonic())
+
+    def expire_handshakes(self, now: float) -> None:
+        # Deadlines are in accept order, so only the front of the dict can have passed
+        while self.handshaking:
+            conn, deadline = next(iter(self.handshaking.items()))
+            if deadline > now:
+                return
+            logger.info(f"Client {conn.addr} did not finish its handshake in {HANDSHAKE_TIMEOUT:.0f} s")
+            self.handshakes_timed_out.inc()
+            self.drop(conn)
+
+    def on_readable(self, conn: Connection) -> None:
+        try:
+            data = conn.sock.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f"Receive error from {conn.addr}: {e}")
+            self.drop(conn)
             return
-        last_sent = time.time()
+        if not data:
+            logger.debug(f"No data from {conn.addr}, closing")
+            self.drop(conn)
+            return
+        try:
+            self.handle_frames(conn, conn.decoder.feed(data))
+        except (protocol.ProtocolError, struct.error) as e:
+            logger.error(f"Bad message from {conn.addr}: {e}")
+            self.bad_messages.inc()
+            self.drop(conn)
+            return
+        if conn.pending:
+            self.write(conn)
+
+    def on_datagram(self) -> None:
+        while True:
+            try:
+                data, addr = self.udp_socket.recvfrom(BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # e.g. ICMP port unreachable from a client that went away
+                logger.debug(f"UDP receive error: {e}")
+                continue
+            self.handle_datagram(data, addr)
+
+    def handle_datagram(self, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            msg_type, payload = protocol.decode_datagram(data)
+            if msg_type != protocol.MSG_UDP_INPUT:
+                raise protocol.ProtocolError(f"Unexpected datagram type {msg_type}")
+            token, seq, mx, my, ack = protocol.decode_udp_input(payload)
+        except (protocol.ProtocolError, struct.error) as e:
+            self.bad_messages.inc()
+            logger.debug(f"Bad datagram from {addr}: {e}")
+            return
+        conn = self.tokens.get(token)
+        # Unknown token, or a duplicate / reordered datagram older than the newest applied input
+        if conn is None or seq <= conn.input_seq:
+            return
+        if not conn.input_limiter.allow(time.monotonic()):
+            self.inputs_limited.inc()
+            return
+        conn.input_seq = seq
+        if conn.udp_addr != addr:
+            logger.info(f"Client {conn.pid} sending over UDP from {addr}")
+            conn.udp_addr = addr
+        self.game.set_input(conn.pid, mx, my, seq)
+        conn.acked = max(conn.acked, ack)
+
+    def write(self, conn: Connection) -> None:
+        try:
+            drained = self.flush(conn)
+        except OSError as e:
+            logger.error(f"Send failed to {conn.addr}: {e}")
+            self.drop(conn)
+            return
+        # Only ask for writability while a frame is stuck in the kernel buffer
+        if drained == conn.want_write:
+            conn.want_write = not drained
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.want_write else 0)
+            self.selector.modify(conn.sock, events, conn)
+
+    def broadcast(self) -> None:
+        profiler = self.profiler
+        start = profiler.begin()
+        for conn in list(self.connections.values()):
+            if self.queue_snapshot(conn):
+                self.write(conn)
+        profiler.end("broadcast", start)
+        if self.spectators:
+            start = profiler.begin()
+            self.update_feed()
+            self.send_feed()
+            profiler.end("spectators", start)
+
+    def on_wake(self) -> None:
+        try:
+            self.wake_reader.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            pass
+        self.broadcast()
+
+    def register_sources(self) -> None:
+        # Everything the loop reads besides client connections, each with its handler
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, self.on_wake)
+        if self.socket is not None:
+            self.socket.setblocking(False)
+            self.selector.register(self.socket, selectors.EVENT_READ, self.accept_ready)
+            self.accepting = True
+        if self.udp_socket is not None:
+            self.selector.register(self.udp_socket, selectors.EVENT_READ, self.on_datagram)
+
+    def run(self) -> None:
+        self.start_simulation()
+        self.selector = selectors.DefaultSelector()
+        self.register_sources()
+        while self.running:
+            for key, events in self.selector.select(self.handshake_wait()):
+                conn = key.data
+                if not isinstance(conn, Connection):
+                    conn()
+                    continue
+                if events & selectors.EVENT_READ:
+                    self.on_readable(conn)
+                if events & selectors.EVENT_WRITE and conn.sock.fileno() != -1:
+                    self.write(conn)
+            if self.handshaking:
+                self.expire_handshakes(time.monotonic())
+
+class ThreadedServer(Server):
+    # The previous thread-per-connection front end with polling loops, kept for benchmark.py connections
+    # (TCP only: it never reads the UDP socket, so tokens are handed out but never bound)
+    def serve_connection(self, conn: Connection) -> None:
         try:
+            conn.sock.settimeout(5)
+            self.handle_frames(conn, protocol.recv_frames(conn.sock, conn.decoder))
+            conn.sock.setblocking(False)
             while True:
                 try:
-                    data = conn.recv(BUFFER_SIZE)
+                    data = conn.sock.recv(BUFFER_SIZE)
                     if not data:
-                        logger.debug(f"No data from {addr}, closing")
                         break
-                    _, (mx, my) = pickle.loads(data)
-                    logger.debug(f"Received update from {pid}: ({mx:.1f}, {my:.1f})")
-                    self.game.move_players(pid, mx, my)
-                    self.game.check_eat()
-                    self.game.decay()
+                    self.handle_frames(conn, conn.decoder.feed(data))
                 except BlockingIOError:
                     pass
-                except Exception as e:
-                    logger.error(f"Receive error from {addr}: {e}")
-                    break
-
-                if time.time() - last_sent > 0.01:
-                    state = self.game.get_state()
-                    try:
-                        conn.send(pickle.dumps((MSG_UPDATE, state)))
-                        last_sent = time.time()
-                        logger.debug(f"Sent state to {pid}")
-                    except Exception as e:
-                        logger.error(f"Send failed to {addr}: {e}")
-                        break
+                self.queue_snapshot(conn)
+                self.flush(conn)
                 time.sleep(0.005)
         except Exception as e:
-            logger.error(f"Client {addr} crashed: {e}")
+            logger.error(f"Client {conn.addr} crashed: {e}")
         finally:
-            self.game.remove_player(pid)
-            self.connections.pop(pid, None)
-            conn.close()
-            logger.info(f"Client {addr} disconnected")
+            self.drop(conn)
 
     def run(self) -> None:
+        self.start_simulation()
         while True:
             try:
-                self.socket.settimeout(10)
-                conn, addr = self.socket.accept()
-                logger.info(f"New connection from {addr}")
-                try:
-                    conn.setblocking(True)
-                    conn.settimeout(5)
-                    name = pickle.loads(conn.recv(BUFFER_SIZE))
-                    logger.info(f"Received name from {addr}: {name}")
-                    thread = threading.Thread(target=self.handle_client, args=(conn, addr, self.pid_counter, name))
-                    thread.daemon = True
-                    thread.start()
-                    self.pid_counter += 1
-                except Exception as e:
-                    logger.error(f"Error accepting {addr}: {e}")
-                    conn.close()
-            except socket.timeout:
-                logger.warning("Socket accept timed out, continuing...")
-                continue
-            except Exception as e:
+                sock, addr = self.socket.accept()
+            except OSError as e:
                 logger.error(f"Server error: {e}")
                 break
+            logger.info(f"New connection from {addr}")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(sock, addr, self.input_limit)
+            thread = threading.Thread(target=self.serve_connection, args=(conn,))
+            thread.daemon = True
+            thread.start()
 
 def get_server_config() -> Tuple[str, int]:
+    # Only the interactive setup window needs pygame; --headless never imports it
+    import pygame
+    pygame.init()
+    screen = pygame.display.set_mode((UI_WIDTH, UI_HEIGHT))
+    pygame.display.set_caption("phago.io - Server Setup")
+    font = pygame.font.SysFont('Arial', 24, bold=True)
+    footer_font = pygame.font.SysFont('Arial', 20, bold=False)
     default_ip = socket.gethostbyname(socket.gethostname())
-    default_port = "1401"
+    default_port = str(DEFAULT_PORT)
     ip = default_ip
     port = default_port
     active_field = "ip"
@@ -256,6 +1329,7 @@ def get_server_config() -> Tuple[str, int]:
                     if ip and port:
                         try:
                             port_num = int(port)
+                            pygame.quit()
                             return ip, port_num
                         except ValueError:
                             continue
@@ -272,37 +1346,89 @@ def get_server_config() -> Tuple[str, int]:
                     else:
                         port += event.unicode
 
-        UI_SCREEN.fill(BLACK)
-        branding = FONT.render("phago.io", True, WHITE)
-        UI_SCREEN.blit(branding, (UI_WIDTH//2 - branding.get_width()//2, 30))
-        title = FONT.render("Configure Server", True, WHITE)
-        UI_SCREEN.blit(title, (UI_WIDTH//2 - title.get_width()//2, 90))
-        ip_label = FONT.render("Enter IP:", True, WHITE)
-        UI_SCREEN.blit(ip_label, (UI_WIDTH//2 - ip_label.get_width()//2, 140))
-        ip_text = FONT.render(ip, True, WHITE if active_field == "ip" else GRAY)
-        UI_SCREEN.blit(ip_text, (UI_WIDTH//2 - ip_text.get_width()//2, 170))
-        port_label = FONT.render("Enter Port:", True, WHITE)
-        UI_SCREEN.blit(port_label, (UI_WIDTH//2 - port_label.get_width()//2, 220))
-        port_text = FONT.render(port, True, WHITE if active_field == "port" else GRAY)
-        UI_SCREEN.blit(port_text, (UI_WIDTH//2 - port_text.get_width()//2, 250))
-        credit1 = FOOTER_FONT.render("23XT46 - Computer Networks Lab", True, GRAY)
-        UI_SCREEN.blit(credit1, (UI_WIDTH//2 - credit1.get_width()//2, UI_HEIGHT - 100))
-        credit2 = FOOTER_FONT.render("23PT01 - Aakash Velusamy", True, GRAY)
-        UI_SCREEN.blit(credit2, (UI_WIDTH//2 - credit2.get_width()//2, UI_HEIGHT - 70))
-        credit3 = FOOTER_FONT.render("23PT14 - Kabilan S", True, GRAY)
-        UI_SCREEN.blit(credit3, (UI_WIDTH//2 - credit3.get_width()//2, UI_HEIGHT - 40))
+        screen.fill(BLACK)
+        branding = font.render("phago.io", True, WHITE)
+        screen.blit(branding, (UI_WIDTH//2 - branding.get_width()//2, 30))
+        title = font.render("Configure Server", True, WHITE)
+        screen.blit(title, (UI_WIDTH//2 - title.get_width()//2, 90))
+        ip_label = font.render("Enter IP:", True, WHITE)
+        screen.blit(ip_label, (UI_WIDTH//2 - ip_label.get_width()//2, 140))
+        ip_text = font.render(ip, True, WHITE if active_field == "ip" else GRAY)
+        screen.blit(ip_text, (UI_WIDTH//2 - ip_text.get_width()//2, 170))
+        port_label = font.render("Enter Port:", True, WHITE)
+        screen.blit(port_label, (UI_WIDTH//2 - port_label.get_width()//2, 220))
+        port_text = font.render(port, True, WHITE if active_field == "port" else GRAY)
+        screen.blit(port_text, (UI_WIDTH//2 - port_text.get_width()//2, 250))
+        credit1 = footer_font.render("23XT46 - Computer Networks Lab", True, GRAY)
+        screen.blit(credit1, (UI_WIDTH//2 - credit1.get_width()//2, UI_HEIGHT - 100))
+        credit2 = footer_font.render("23PT01 - Aakash Velusamy", True, GRAY)
+        screen.blit(credit2, (UI_WIDTH//2 - credit2.get_width()//2, UI_HEIGHT - 70))
+        credit3 = footer_font.render("23PT14 - Kabilan S", True, GRAY)
+        screen.blit(credit3, (UI_WIDTH//2 - credit3.get_width()//2, UI_HEIGHT - 40))
         pygame.display.flip()
         clock.tick(30)
 
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = (int(n) for n in text.lower().split("x"))
+    if not 0 < width <= 65535 or not 0 < height <= 65535:
+        raise argparse.ArgumentTypeError("map sides must be between 1 and 65535")
+    return width, height
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="phago.io game server")
+    parser.add_argument("--headless", action="store_true", help="skip the setup window and serve on --host/--port")
+    parser.add_argument("--host", default="0.0.0.0", help="address to bind with --headless")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to bind with --headless")
+    parser.add_argument("--engine", choices=ENGINES, default="python",
+                        help="simulation backend (numpy needs NumPy installed; regions splits the map across processes)")
+    parser.add_argument("--map-size", type=parse_size, default=(WIDTH, HEIGHT), metavar="WxH",
+                        help=f"world size (default {WIDTH}x{HEIGHT}, at most 65535 on a side)")
+    parser.add_argument("--regions", type=int, help="region processes for --engine regions (default: one per CPU)")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, help="simulation ticks per second")
+    parser.add_argument("--send-rate", type=int, default=SEND_RATE, help="snapshots per second sent to each client")
+    parser.add_argument("--udp", action="store_true", help="also accept input and send state over UDP on the same port")
+    parser.add_argument("--input-limit", type=float, default=INPUT_LIMIT,
+                        help="inputs per second accepted from each client; more are ignored")
+    parser.add_argument("--client-budget", type=int, default=MAX_CLIENT_BUDGET,
+                        help="most bytes of state per second any one client is sent")
+    parser.add_argument("--max-players", type=int, help="turn further players away once this many are connected")
+    parser.add_argument("--backlog", type=int, default=socket.SOMAXCONN,
+                        help="connections the kernel queues while the server is busy accepting others")
+    parser.add_argument("--seed", type=int, help="seed spawns and pellets for a reproducible match")
+    parser.add_argument("--record", metavar="FILE", help="record joins, leaves and inputs for replay.py")
+    parser.add_argument("--metrics-port", type=int, help=f"serve metrics as text on http://{METRICS_HOST}:PORT/metrics")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="time tick and send phases, written on exit as a Chrome trace (.json) or folded stacks")
+    parser.add_argument("--cprofile-ticks", type=int, default=CPROFILE_TICKS,
+                        help="ticks a cProfile run covers once started with SIGUSR1 (needs --profile)")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO",
+                        help="DEBUG adds a line per move, meal and input")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    server = None
     try:
-        host, port = get_server_config()
+        if args.headless:
+            host, port = args.host, args.port
+        else:
+            host, port = get_server_config()
         if host is None or port is None:
-            pygame.quit()
             exit()
-        server = Server(host, port)
-        pygame.quit()
+        server = Server(host, port, tick_rate=args.tick_rate, engine=args.engine, udp=args.udp,
+                        send_rate=args.send_rate, metrics_port=args.metrics_port, map_size=args.map_size,
+                        regions=args.regions, input_limit=args.input_limit, seed=args.seed, record=args.record,
+                        client_budget=args.client_budget, backlog=args.backlog, max_players=args.max_players,
+                        profile=args.profile is not None, cprofile_ticks=args.cprofile_ticks)
+        if args.profile and hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: server.profiler.request_cprofile())
+            logger.info(f"Profiling phases; kill -USR1 {os.getpid()} runs cProfile for {args.cprofile_ticks} ticks")
         server.run()
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
     except Exception as e:
         logger.error(f"Server failed to start: {e}")
-        pygame.quit()
+    finally:
+        if args.profile and server is not None:
+            server.profiler.dump(args.profile)
@@ -0,0 +1,180 @@
+import functools
+import struct
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import protocol
+
+# Shared memory between one simulation process and its network gateways (gateway.py). Both structures are
+# single-writer and lock-free, guarded by sequence locks: a writer makes a counter odd, writes, then makes
+# it even again, and a reader that sees the counter odd or changed across its read discards what it read.
+#
+# SnapshotRing: the simulation writes each tick's world into the next of RING_SLOTS fixed-size slots, laid
+# out as a STATE payload (protocol.py) followed by every player's input ack. Gateways decode it straight
+# out of the mapping; a reader only loses a read if the writer laps the whole ring while it decodes.
+#
+# InputTable: one row per player, written only by the gateway that owns the row and scanned by the
+# simulation every tick. A row holds the player's pid and name from the join on, plus the newest input;
+# clearing the pid is the leave. Native byte order throughout, the memory never leaves the machine.
+RING_SLOTS = 4
+RING_HEADER = struct.Struct('=IIQ')    # slots, slot size, number of the newest complete write (0 = none)
+SLOT_HEADER = struct.Struct('=QI')     # sequence counter (2n - 1 while write n is in progress, 2n after), length
+ROW_VERSION = struct.Struct('=I')
+ROW = struct.Struct(f'=IIff{protocol.NAME_BYTES}s')  # pid + 1 (0 = free row), input seq, mx, my, name
+
+@functools.lru_cache(maxsize=64)
+def ack_block(count: int) -> struct.Struct:
+    return struct.Struct(f'!{count}I')
+
+def world_size(players: int, food: int) -> int:
+    return protocol.STATE_HEADER.size + players * (protocol.PLAYER.size + 4) + food * protocol.FOOD.size
+
+class SnapshotRing:
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        self.buf = memory.buf
+        self.slots, self.slot_size, _ = RING_HEADER.unpack_from(self.buf, 0)
+        self.written = 0
+        self.last_read = 0
+
+    @classmethod
+    def create(cls, slot_size: int, slots: int = RING_SLOTS) -> 'SnapshotRing':
+        memory = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + slots * (SLOT_HEADER.size + slot_size))
+        RING_HEADER.pack_into(memory.buf, 0, slots, slot_size, 0)
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SnapshotRing':
+        return cls(shared_memory.SharedMemory(name=name), False)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def slot_offset(self, number: int) -> int:
+        return RING_HEADER.size + (number % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+    def write(self, state: Dict) -> None:
+        players = state['players']
+        food = state['food']
+        acks = state['input_acks']
+        size = world_size(len(players), len(food))
+        if size > self.slot_size:
+            raise ValueError(f"World of {size} bytes does not fit a {self.slot_size} byte ring slot")
+        number = self.written + 1
+        buf = self.buf
+        offset = self.slot_offset(number)
+        SLOT_HEADER.pack_into(buf, offset, 2 * number - 1, size)
+        offset += SLOT_HEADER.size
+        protocol.STATE_HEADER.pack_into(buf, offset, state['seq'], 0, state['time_left'], len(players), len(food))
+        offset += protocol.STATE_HEADER.size
+        for pid, (x, y, psize, name, score) in players.items():
+            protocol.PLAYER.pack_into(buf, offset, pid, x, y, psize, int(score), protocol.encode_name(name))
+            offset += protocol.PLAYER.size
+        if food:
+            protocol.food_block(len(food)).pack_into(buf, offset, *protocol.flatten_food(food.items()))
+            offset += len(food) * protocol.FOOD.size
+        if players:
+            ack_block(len(players)).pack_into(buf, offset, *(acks.get(pid, 0) for pid in players))
+        SLOT_HEADER.pack_into(buf, self.slot_offset(number), 2 * number, size)
+        RING_HEADER.pack_into(buf, 0, self.slots, self.slot_size, number)
+        self.written = number
+
+    def newest(self) -> int:
+        return RING_HEADER.unpack_from(self.buf, 0)[2]
+
+    def read(self) -> Optional[Dict]:
+        # The newest world not yet read, as Game.get_state() would return it; None if there is none or the
+        # writer overwrote it mid-read (the caller just tries again next tick)
+        number = self.newest()
+        if number == self.last_read:
+            return None
+        buf = self.buf
+        offset = self.slot_offset(number)
+        version, _ = SLOT_HEADER.unpack_from(buf, offset)
+        if version != 2 * number:
+            return None
+        start = offset + SLOT_HEADER.size
+        seq, _, time_left, player_count, food_count = protocol.STATE_HEADER.unpack_from(buf, start)
+        start += protocol.STATE_HEADER.size
+        end = start + player_count * protocol.PLAYER.size
+        players = {}
+        for pid, x, y, size, score, name in protocol.PLAYER.iter_unpack(buf[start:end]):
+            players[pid] = (x, y, size, protocol.decode_name(name), score)
+        food = protocol.unflatten_food(protocol.food_block(food_count).unpack_from(buf, end))
+        acks = ack_block(player_count).unpack_from(buf, end + food_count * protocol.FOOD.size)
+        if SLOT_HEADER.unpack_from(buf, offset)[0] != version:
+            return None
+        self.last_read = number
+        return {
+            'seq': seq,
+            'players': players,
+            'food': food,
+            'time_left': time_left,
+            'input_acks': dict(zip(players, acks))
+        }
+
+    def close(self) -> None:
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+class InputTable:
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        self.buf = memory.buf
+        self.rows = memory.size // (ROW_VERSION.size + ROW.size)
+        # Row versions as of the last scan, so unchanged rows are skipped after one read
+        self.seen: List[int] = [0] * self.rows
+
+    @classmethod
+    def create(cls, rows: int) -> 'InputTable':
+        return cls(shared_memory.SharedMemory(create=True, size=rows * (ROW_VERSION.size + ROW.size)), True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'InputTable':
+        return cls(shared_memory.SharedMemory(name=name), False)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, row: int, pid: Optional[int], seq: int = 0, mx: float = 0.0, my: float = 0.0,
+              name: str = "") -> None:
+        buf = self.buf
+        offset = row * (ROW_VERSION.size + ROW.size)
+        version = ROW_VERSION.unpack_from(buf, offset)[0] + 1
+        ROW_VERSION.pack_into(buf, offset, version & 0xFFFFFFFF)
+        ROW.pack_into(buf, offset + ROW_VERSION.size, 0 if pid is None else pid + 1, seq, mx, my,
+                      protocol.encode_name(name))
+        ROW_VERSION.pack_into(buf, offset, (version + 1) & 0xFFFFFFFF)
+
+    def clear(self, rows: range) -> None:
+        for row in rows:
+            self.write(row, None)
+
+    def changed(self) -> Iterator[Tuple[int, Optional[int], int, float, float, str]]:
+        # Rows written since the last scan: (row, pid or None for a free row, input seq, mx, my, name).
+        # A row caught mid-write is left for the next scan.
+        buf = self.buf
+        seen = self.seen
+        stride = ROW_VERSION.size + ROW.size
+        for row in range(self.rows):
+            offset = row * stride
+            version = ROW_VERSION.unpack_from(buf, offset)[0]
+            if version == seen[row] or version & 1:
+                continue
+            pid, seq, mx, my, name = ROW.unpack_from(buf, offset + ROW_VERSION.size)
+            if ROW_VERSION.unpack_from(buf, offset)[0] != version:
+                continue
+            seen[row] = version
+            yield row, pid - 1 if pid else None, seq, mx, my, protocol.decode_name(name)
+
+    def close(self) -> None:
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
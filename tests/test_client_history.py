@@ -0,0 +1,19 @@
+import client
+import protocol
+import server
+
+def state(seq: int):
+    return {'seq': seq, 'players': {1: (1.0, 2.0, 20.0, 'alice', 0)}, 'food': {}, 'time_left': 60, 'input_ack': 0}
+
+def test_snapshot_history_counts_snapshots_not_seqs():
+    # Snapshots three seqs apart, as the server sends them at 20 Hz on a 60 Hz tick
+    player = client.Client("alice", "127.0.0.1", 0)
+    try:
+        for seq in range(3, 3 * (client.SNAPSHOT_HISTORY + 50), 3):
+            applied = player.apply(protocol.MSG_STATE, protocol.encode_state(state(seq))[protocol.HEADER.size:])
+        assert len(player.snapshots) == client.SNAPSHOT_HISTORY
+        assert max(player.snapshots) == applied['seq'] == player.acked
+        # Every view the server may still use as a baseline is held here
+        assert client.SNAPSHOT_HISTORY >= server.SNAPSHOT_HISTORY
+    finally:
+        player.socket.close()
@@ -0,0 +1,62 @@
+import socket
+import types
+
+import pytest
+
+import gateway
+import protocol
+import server
+from shm_ring import InputTable, SnapshotRing, world_size
+
+@pytest.fixture
+def shared(monkeypatch):
+    # The simulation's side of the shared memory, for a gateway of two rows
+    monkeypatch.setattr(gateway, "GATEWAY_CAPACITY", 2)
+    ring = SnapshotRing.create(world_size(2, 10))
+    inputs = InputTable.create(2)
+    yield ring, inputs
+    ring.close()
+    inputs.close()
+
+@pytest.fixture
+def full_gateway(shared):
+    ring, inputs = shared
+    listener = socket.socket()
+    front_end = gateway.Gateway(0, 1, listener, ring.name, inputs.name, 60, 20, None, (1080, 720), 120, 100000)
+    pairs = []
+    for name in ("alice", "bob"):
+        pairs.append(join(front_end, name))
+    yield front_end
+    for ours, theirs, _ in pairs:
+        ours.close()
+        theirs.close()
+    front_end.game.ring.close()
+    front_end.game.inputs.close()
+    listener.close()
+
+def join(front_end: gateway.Gateway, name: str):
+    ours, theirs = socket.socketpair()
+    conn = server.Connection(ours, ("127.0.0.1", 0))
+    front_end.handle_frames(conn, conn.decoder.feed(protocol.encode_hello(name)))
+    return ours, theirs, conn
+
+def test_full_gateway_refuses_as_capacity_not_bad_message(full_gateway):
+    ours, theirs, conn = join(full_gateway, "carol")
+    try:
+        assert conn.pid is None
+        assert full_gateway.joins_refused.value == 1
+        assert full_gateway.bad_messages.value == 0
+        assert len(full_gateway.connections) == 2
+    finally:
+        ours.close()
+        theirs.close()
+
+def test_input_before_the_next_tick_keeps_the_name(full_gateway, shared):
+    # The simulation usually first sees a row after the player's first input has overwritten it
+    _, inputs = shared
+    for conn in list(full_gateway.connections.values()):
+        full_gateway.handle_frames(conn, conn.decoder.feed(protocol.encode_input(10.0, 20.0, 0, 1)))
+    simulation = types.SimpleNamespace(inputs=inputs, players={}, game=server.Game(1080, 720, food_count=0))
+    gateway.Simulation.apply_inputs(simulation)
+    assert sorted(player.name for player in simulation.game.players.values()) == ["alice", "bob"]
+    assert all(seq == 1 for _, _, seq in simulation.game.pending_inputs.values())
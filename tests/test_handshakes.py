@@ -0,0 +1,45 @@
+import socket
+import threading
+
+import pytest
+
+import relay
+import server
+
+def serve(front_end: server.Server) -> threading.Thread:
+    thread = threading.Thread(target=front_end.run, daemon=True)
+    thread.start()
+    return thread
+
+def stop(front_end: server.Server, thread: threading.Thread) -> None:
+    front_end.running = False
+    front_end.wake()
+    thread.join(timeout=2)
+
+@pytest.fixture
+def game_server(monkeypatch):
+    monkeypatch.setattr(server, "HANDSHAKE_TIMEOUT", 0.3)
+    game = server.Server("127.0.0.1", 0, tick_rate=30)
+    thread = serve(game)
+    yield game
+    stop(game, thread)
+
+def assert_closed_idle(front_end: server.Server) -> None:
+    # Connect and never send HELLO: the front end must hang up once the handshake deadline passes
+    with socket.create_connection(front_end.socket.getsockname()) as sock:
+        sock.settimeout(3)
+        assert sock.recv(64) == b""
+    assert front_end.handshakes_timed_out.value == 1
+    assert not front_end.handshaking
+
+def test_server_closes_idle_connection(game_server):
+    assert_closed_idle(game_server)
+
+def test_relay_closes_idle_connection(game_server):
+    # A relay has no simulation thread waking its loop, so expiry has to come from the loop itself
+    spectator_relay = relay.Relay("127.0.0.1", 0, game_server.socket.getsockname())
+    thread = serve(spectator_relay)
+    try:
+        assert_closed_idle(spectator_relay)
+    finally:
+        stop(spectator_relay, thread)
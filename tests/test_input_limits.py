@@ -0,0 +1,74 @@
+import socket
+
+import pytest
+
+import protocol
+import server
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+@pytest.fixture
+def player(clock):
+    # A Server without a listening socket or a running loop, and one connection that has sent HELLO
+    front_end = server.Server("", None)
+    ours, theirs = socket.socketpair()
+    conn = server.Connection(ours, ("127.0.0.1", 0))
+    front_end.handle_frames(conn, conn.decoder.feed(protocol.encode_hello("alice")))
+    inputs = []
+    front_end.game.set_input = lambda pid, mx, my, seq=0: inputs.append((mx, my, seq))
+    yield front_end, conn, inputs
+    ours.close()
+    theirs.close()
+
+def input_frames(conn: server.Connection, first: int, count: int):
+    data = b"".join(protocol.encode_input(float(seq), 0.0, 0, seq) for seq in range(first, first + count))
+    return conn.decoder.feed(data)
+
+def test_backlog_in_one_read_applies_newest_input(player):
+    # 2.5 s of 30 Hz input queued behind a stalled uplink arrives in a single read
+    front_end, conn, inputs = player
+    front_end.handle_frames(conn, input_frames(conn, 1, 75))
+    assert inputs == [(75.0, 0.0, 75)]
+    assert front_end.inputs_limited.value == 0
+
+def test_rate_limit_charges_each_batch_once(player, clock):
+    front_end, conn, inputs = player
+    for batch in range(server.INPUT_BURST + 5):
+        front_end.handle_frames(conn, input_frames(conn, 10 * batch + 1, 10))
+    # The burst allowance covers INPUT_BURST batches with the clock standing still, whatever their size
+    assert len(inputs) == server.INPUT_BURST
+    assert front_end.inputs_limited.value == 5
+    clock.now += 1.0
+    front_end.handle_frames(conn, input_frames(conn, 1000, 3))
+    assert inputs[-1] == (1002.0, 0.0, 1002)
+
+def test_normal_client_is_never_a_flood(player, clock):
+    front_end, conn, inputs = player
+    seq = 1
+    for _ in range(30 * 60):
+        front_end.handle_frames(conn, input_frames(conn, seq, 1))
+        seq += 1
+        clock.now += 1 / 30
+    assert len(inputs) == 30 * 60
+
+def test_sustained_flood_is_dropped(player, clock):
+    front_end, conn, _ = player
+    # Ten times the limit, in reads a tenth of a second apart
+    per_read = int(server.INPUT_LIMIT)
+    with pytest.raises(protocol.ProtocolError, match="flood"):
+        for read in range(int(10 * server.INPUT_FLOOD_WINDOW)):
+            front_end.handle_frames(conn, input_frames(conn, read * per_read + 1, per_read))
+            clock.now += 0.1
+    # Not on the first reads: the window has to fill first
+    assert read >= server.INPUT_FLOOD_WINDOW
@@ -0,0 +1,165 @@
+import pytest
+
+import protocol
+
+# Coordinates and sizes are sent as float32, so the fixtures use values float32 holds exactly
+BASELINE = {
+    'seq': 41,
+    'players': {1: (100.5, 200.25, 20.0, 'alice', 3), 2: (300.0, 50.0, 12.5, 'bob', 0), 7: (5.0, 5.0, 10.0, 'eve', 9)},
+    'food': {10: (1, 2, 5), 11: (1079, 719, 6), 12: (500, 360, 5)},
+    'time_left': 120,
+    'input_ack': 17
+}
+STATE = {
+    'seq': 42,
+    # alice moved and grew, bob is unchanged, eve left, zoë joined
+    'players': {1: (101.5, 201.25, 21.0, 'alice', 4), 2: (300.0, 50.0, 12.5, 'bob', 0), 9: (0.0, 0.0, 10.0, 'zoë', 0)},
+    'food': {10: (1, 2, 5), 12: (500, 360, 5), 13: (65535, 0, 255)},
+    'time_left': 119,
+    'input_ack': 18
+}
+
+def only_frame(data: bytes):
+    frames = protocol.FrameDecoder().feed(data)
+    assert len(frames) == 1
+    return frames[0]
+
+def payload_of(data: bytes, msg_type: int) -> bytes:
+    frame_type, payload = only_frame(data)
+    assert frame_type == msg_type
+    return bytes(payload)
+
+def test_hello_round_trip():
+    assert protocol.decode_hello(payload_of(protocol.encode_hello("alice"), protocol.MSG_HELLO)) == "alice"
+
+def test_hello_truncates_name_on_a_character_boundary():
+    name = protocol.decode_hello(payload_of(protocol.encode_hello("ééééééééé"), protocol.MSG_HELLO))
+    assert name == "é" * (protocol.NAME_BYTES // 2)
+
+def test_watch_round_trip():
+    assert protocol.decode_watch(payload_of(protocol.encode_watch(), protocol.MSG_WATCH)) is None
+
+def test_welcome_round_trip():
+    payload = payload_of(protocol.encode_welcome(protocol.SPECTATOR_PID, 0xDEADBEEF, 30), protocol.MSG_WELCOME)
+    assert protocol.decode_welcome(payload) == (protocol.SPECTATOR_PID, 0xDEADBEEF, 30)
+
+def test_input_round_trip():
+    payload = payload_of(protocol.encode_input(12.5, -3.25, 99, 1234), protocol.MSG_INPUT)
+    assert protocol.decode_input(payload) == (12.5, -3.25, 99, 1234)
+
+def test_udp_input_round_trip():
+    msg_type, payload = protocol.decode_datagram(protocol.encode_udp_input(7, 8, 1.5, 2.5, 9))
+    assert msg_type == protocol.MSG_UDP_INPUT
+    assert protocol.decode_udp_input(payload) == (7, 8, 1.5, 2.5, 9)
+
+def test_state_round_trip():
+    assert protocol.decode_state(payload_of(protocol.encode_state(STATE), protocol.MSG_STATE)) == STATE
+
+def test_empty_state_round_trip():
+    empty = {'seq': 1, 'players': {}, 'food': {}, 'time_left': 0, 'input_ack': 0}
+    assert protocol.decode_state(payload_of(protocol.encode_state(empty), protocol.MSG_STATE)) == empty
+
+def test_state_parts_match_encode_state():
+    players = [protocol.encode_player_record(pid, record) for pid, record in STATE['players'].items()]
+    food = [protocol.encode_food_record(fid, record) for fid, record in STATE['food'].items()]
+    parts = protocol.state_parts(STATE['seq'], STATE['input_ack'], STATE['time_left'], players, food)
+    assert b"".join(parts) == protocol.encode_state(STATE)
+
+def test_delta_round_trip():
+    payload = payload_of(protocol.encode_delta(BASELINE, STATE), protocol.MSG_DELTA)
+    assert protocol.delta_baseline(payload) == BASELINE['seq']
+    assert protocol.snapshot_seq(payload) == STATE['seq']
+    assert protocol.apply_delta(BASELINE, payload) == STATE
+
+def test_delta_against_itself_is_empty():
+    payload = payload_of(protocol.encode_delta(STATE, STATE), protocol.MSG_DELTA)
+    assert len(payload) == protocol.DELTA_HEADER.size
+    assert protocol.apply_delta(STATE, payload)['players'] == STATE['players']
+
+def test_delta_parts_match_encode_delta():
+    joined = [protocol.encode_player_record(9, STATE['players'][9])]
+    updated = [protocol.encode_player_update(1, STATE['players'][1])]
+    spawned = [protocol.encode_food_record(13, STATE['food'][13])]
+    parts = protocol.delta_parts(STATE['seq'], BASELINE['seq'], STATE['input_ack'], STATE['time_left'], joined,
+                                 updated, [7], spawned, [11])
+    assert b"".join(parts) == protocol.encode_delta(BASELINE, STATE)
+
+def test_minimap_round_trip():
+    density = bytes(range(24))
+    leaders = [(1, STATE['players'][1]), (9, STATE['players'][9])]
+    payload = payload_of(protocol.encode_minimap(5400, 3600, 6, 4, density, leaders), protocol.MSG_MINIMAP)
+    assert protocol.decode_minimap(payload) == {'width': 5400, 'height': 3600, 'cols': 6, 'rows': 4,
+                                                'density': density, 'players': dict(leaders)}
+
+def test_frame_decoder_reassembles_frames_split_across_reads():
+    data = protocol.encode_hello("alice") + protocol.encode_state(STATE) + protocol.encode_input(1.0, 2.0)
+    decoder = protocol.FrameDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames.extend(decoder.feed(data[i:i + 1]))
+    assert [msg_type for msg_type, _ in frames] == [protocol.MSG_HELLO, protocol.MSG_STATE, protocol.MSG_INPUT]
+    assert protocol.decode_state(frames[1][1]) == STATE
+    assert not decoder.buffer
+
+def test_frame_decoder_splits_frames_merged_in_one_read():
+    inputs = [protocol.encode_input(float(i), 0.0, 0, i) for i in range(50)]
+    # Several whole frames plus the first half of another in one read, the rest in the next
+    tail = protocol.encode_watch()
+    decoder = protocol.FrameDecoder()
+    frames = decoder.feed(b"".join(inputs) + tail[:3])
+    assert [protocol.decode_input(payload)[3] for _, payload in frames] == list(range(50))
+    assert decoder.feed(tail[3:]) == [(protocol.MSG_WATCH, bytearray(tail[protocol.HEADER.size:]))]
+
+def test_frame_decoder_accepts_empty_payload():
+    assert protocol.FrameDecoder().feed(protocol.frame(protocol.MSG_WATCH, b"")) == [(protocol.MSG_WATCH, b"")]
+
+def test_frame_decoder_rejects_oversized_frame():
+    decoder = protocol.FrameDecoder(max_frame_size=1024)
+    # Refused from the header alone, before the payload is buffered
+    with pytest.raises(protocol.ProtocolError, match="exceeds limit"):
+        decoder.feed(protocol.HEADER.pack(1025, protocol.MSG_STATE))
+
+@pytest.mark.parametrize("decode, payload", [
+    (protocol.decode_hello, protocol.HELLO.pack(protocol.PROTOCOL_VERSION + 1, b"alice")),
+    (protocol.decode_watch, protocol.WATCH.pack(protocol.PROTOCOL_VERSION - 1)),
+    (protocol.decode_welcome, protocol.WELCOME.pack(0, 1, 0, 60)),
+])
+def test_wrong_version_is_refused(decode, payload):
+    with pytest.raises(protocol.ProtocolError, match="version"):
+        decode(payload)
+
+@pytest.mark.parametrize("decode, data, msg_type", [
+    (protocol.decode_hello, protocol.encode_hello("alice"), protocol.MSG_HELLO),
+    (protocol.decode_watch, protocol.encode_watch(), protocol.MSG_WATCH),
+    (protocol.decode_welcome, protocol.encode_welcome(1), protocol.MSG_WELCOME),
+    (protocol.decode_input, protocol.encode_input(1.0, 2.0), protocol.MSG_INPUT),
+    (protocol.decode_state, protocol.encode_state(STATE), protocol.MSG_STATE),
+    (protocol.decode_minimap, protocol.encode_minimap(100, 100, 2, 2, b"\0\1\2\3", [(1, STATE['players'][1])]),
+     protocol.MSG_MINIMAP),
+    (lambda payload: protocol.apply_delta(BASELINE, payload), protocol.encode_delta(BASELINE, STATE),
+     protocol.MSG_DELTA),
+])
+def test_truncated_or_padded_payload_is_refused(decode, data, msg_type):
+    payload = payload_of(data, msg_type)
+    for cut in (0, len(payload) // 2, len(payload) - 1):
+        with pytest.raises(protocol.ProtocolError):
+            decode(payload[:cut])
+    with pytest.raises(protocol.ProtocolError):
+        decode(payload + b"\0")
+
+def test_udp_input_truncated_is_refused():
+    _, payload = protocol.decode_datagram(protocol.encode_udp_input(7, 8, 1.5, 2.5))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_udp_input(payload[:-1])
+
+def test_datagram_length_must_match_header():
+    data = protocol.encode_input(1.0, 2.0)
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_datagram(data[:-1])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_datagram(data[:2])
+
+def test_checked_keeps_decoder_names():
+    assert protocol.decode_state.__name__ == "decode_state"
+    with pytest.raises(protocol.ProtocolError, match="decode_input"):
+        protocol.decode_input(b"")
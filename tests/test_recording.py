@@ -0,0 +1,23 @@
+import logging
+import os
+import subprocess
+import sys
+
+import server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_recording_keeps_server_logging(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    front_end = server.Server("", None, record=str(tmp_path / "match.rec"))
+    try:
+        assert logging.root.manager.disable == logging.NOTSET
+        assert any("Recording match to" in record.getMessage() for record in caplog.records)
+    finally:
+        front_end.game.recorder.close()
+
+def test_importing_benchmark_leaves_logging_alone():
+    # In a fresh interpreter: here benchmark may already be imported and pytest manages logging itself
+    code = "import logging, benchmark; print(logging.root.manager.disable)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == str(logging.NOTSET)
@@ -0,0 +1,48 @@
+import socket
+
+import pytest
+
+import protocol
+import server
+
+@pytest.fixture
+def player():
+    # A Server without a listening socket or a running loop, and one connection that has sent HELLO
+    front_end = server.Server("", None)
+    ours, theirs = socket.socketpair()
+    conn = server.Connection(ours, ("127.0.0.1", 0))
+    front_end.handle_frames(conn, conn.decoder.feed(protocol.encode_hello("alice")))
+    conn.pending.clear()
+    yield front_end, conn
+    ours.close()
+    theirs.close()
+
+def send_frames(front_end: server.Server, conn: server.Connection, frames: int, ack: bool) -> None:
+    sent = 0
+    while sent < frames:
+        front_end.game.tick(1 / front_end.tick_rate)
+        front_end.publish_snapshot()
+        if front_end.queue_snapshot(conn):
+            sent += 1
+        conn.pending.clear()
+        if ack:
+            conn.acked = conn.sent_seq
+
+def test_view_history_is_bounded_with_a_send_stride(player):
+    front_end, conn = player
+    assert front_end.send_stride > 1
+    send_frames(front_end, conn, 3 * server.SNAPSHOT_HISTORY, ack=True)
+    assert len(conn.views) == server.SNAPSHOT_HISTORY
+    assert max(conn.views) == conn.sent_seq
+    assert front_end.deltas.value > 2 * server.SNAPSHOT_HISTORY
+
+def test_ack_older_than_history_gets_a_keyframe(player):
+    front_end, conn = player
+    send_frames(front_end, conn, 1, ack=True)
+    stale = conn.acked
+    send_frames(front_end, conn, server.SNAPSHOT_HISTORY + 1, ack=False)
+    assert stale not in conn.views
+    conn.acked = stale
+    keyframes = front_end.keyframes.value
+    send_frames(front_end, conn, 1, ack=False)
+    assert front_end.keyframes.value == keyframes + 1
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+import server
+from server import GRID_CELL_SIZE, HEIGHT, WIDTH, SpatialGrid
+
+def scatter(rng: random.Random, count: int):
+    # Random points plus points on every edge and corner of the map and on cell boundaries
+    points = [(rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT)) for _ in range(count)]
+    points += [(0, 0), (WIDTH, 0), (0, HEIGHT), (WIDTH, HEIGHT), (0, HEIGHT / 2), (WIDTH, HEIGHT / 2),
+               (WIDTH / 2, 0), (WIDTH / 2, HEIGHT), (GRID_CELL_SIZE, GRID_CELL_SIZE),
+               (GRID_CELL_SIZE - 1e-9, 2 * GRID_CELL_SIZE)]
+    return dict(enumerate(points))
+
+def brute_force(grid: SpatialGrid, points, x: float, y: float, radius: float):
+    # Every key whose cell overlaps the query square, found by checking all of them
+    x0, y0 = grid.cell_of(x - radius, y - radius)
+    x1, y1 = grid.cell_of(x + radius, y + radius)
+    return {key for key, (px, py) in points.items()
+            if x0 <= grid.cell_of(px, py)[0] <= x1 and y0 <= grid.cell_of(px, py)[1] <= y1}
+
+def within(points, x: float, y: float, radius: float):
+    return {key for key, (px, py) in points.items() if abs(px - x) <= radius and abs(py - y) <= radius}
+
+QUERIES = [(0, 0, 20), (WIDTH, HEIGHT, 20), (WIDTH, 0, 45.5), (0, HEIGHT, 5), (WIDTH / 2, HEIGHT / 2, 0),
+           (GRID_CELL_SIZE, GRID_CELL_SIZE, 1), (-30, -30, 10), (WIDTH + 30, HEIGHT / 2, 50),
+           (WIDTH / 3, HEIGHT / 3, 250), (WIDTH / 2, HEIGHT / 2, 5000)]
+
+@pytest.fixture
+def points():
+    return scatter(random.Random(7), 500)
+
+@pytest.fixture
+def grid(points):
+    grid = SpatialGrid()
+    for key, (x, y) in points.items():
+        grid.insert(key, x, y)
+    return grid
+
+@pytest.mark.parametrize("x, y, radius", QUERIES)
+def test_query_matches_brute_force(grid, points, x, y, radius):
+    found = grid.query(x, y, radius)
+    assert len(found) == len(set(found))
+    assert set(found) == brute_force(grid, points, x, y, radius)
+    assert set(found) >= within(points, x, y, radius)
+
+def test_query_after_moves_and_removals(grid, points):
+    rng = random.Random(8)
+    for key in list(points)[::3]:
+        points[key] = (rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT))
+        grid.move(key, *points[key])
+    for key in list(points)[1::5]:
+        del points[key]
+        grid.remove(key)
+    for x, y, radius in QUERIES:
+        assert set(grid.query(x, y, radius)) == brute_force(grid, points, x, y, radius)
+
+def test_updated_copy_matches_brute_force_and_leaves_original(grid, points):
+    before = {query: set(grid.query(*query)) for query in QUERIES}
+    moved = dict(points)
+    removed = [(key, *points[key]) for key in list(points)[:50]]
+    for key, _, _ in removed:
+        del moved[key]
+    added = [(1000 + i, float(i * 7 % WIDTH), float(i * 13 % HEIGHT), None) for i in range(50)]
+    for key, x, y, _ in added:
+        moved[key] = (x, y)
+    copy = grid.updated(removed, added)
+    for query in QUERIES:
+        assert set(copy.query(*query)) == brute_force(copy, moved, *query)
+        assert set(grid.query(*query)) == before[query]
+
+class Eater:
+    def __init__(self, x: float, y: float, size: float):
+        self.x, self.y, self.size = x, y, size
+
+def test_query_reach_searches_again_after_growth():
+    grid = SpatialGrid()
+    for key in range(10):
+        grid.insert(key, 100 + key * GRID_CELL_SIZE, 100)
+    eater = Eater(100, 100, 10)
+    seen = []
+    for key in grid.query_reach(eater, 0):
+        seen.append(key)
+        eater.size += GRID_CELL_SIZE
+    assert seen == list(range(10))
+
+def test_query_reach_without_growth_is_one_query(grid, points):
+    eater = Eater(WIDTH / 2, HEIGHT / 2, 30)
+    assert list(grid.query_reach(eater, 5)) == grid.query(WIDTH / 2, HEIGHT / 2, 35)
+
+def test_check_eat_follows_growth_like_a_full_scan():
+    # A chain of pellets, each only touched once the blob has eaten the one before it, running well past
+    # the cells the blob reached at its starting size. A full scan eats all of them in one tick.
+    count = 40
+    game = server.Game(WIDTH, HEIGHT, food_count=count, seed=1)
+    game.add_player(1, "alice")
+    blob = game.players[1]
+    blob.x, blob.y, blob.size = 200.0, 300.0, 20
+    game.player_grid.move(1, blob.x, blob.y)
+    for index, food in enumerate(game.food):
+        food.x, food.y = 200 + blob.size + server.FOOD_SIZE - 1 + index * server.FOOD_SIZE, 300
+        game.food_grid.move(index, food.x, food.y)
+    game.check_eat()
+    assert blob.size == 20 + count * server.FOOD_SIZE
+    assert game.next_food_id == 2 * count
@@ -0,0 +1,41 @@
+import logging
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared between client.py (rendering) and server.py (area-of-interest culling)
+GAME_WIDTH, GAME_HEIGHT = 960, 720
+
+class ZoomTracker:
+    # Zoom hysteresis of the client camera: only re-target the zoom when the blob leaves the size band
+    def __init__(self):
+        self.zoom = 2.0
+        self.target_zoom = 2.0
+        self.base_zoom = 2.0
+        self.min_zoom = 0.5
+        self.max_zoom = 2.2
+        self.smoothing = 0.1
+        self.min_threshold = 20
+        self.max_threshold = 50
+
+    def update_zoom(self, player_size: float) -> None:
+        desired_diameter = min(GAME_WIDTH, GAME_HEIGHT) * 0.5
+        if player_size > self.max_threshold:
+            self.target_zoom = desired_diameter / (player_size * 2)
+            self.target_zoom = max(self.min_zoom, min(self.max_zoom, self.target_zoom))
+            self.min_threshold = self.max_threshold
+            self.max_threshold = player_size * 1.5
+            logger.debug(f"Zooming out: size={player_size}, zoom={self.target_zoom}, new min={self.min_threshold}, new max={self.max_threshold}")
+        elif player_size < self.min_threshold:
+            self.target_zoom = desired_diameter / (player_size * 2)
+            self.target_zoom = max(self.min_zoom, min(self.max_zoom, self.target_zoom))
+            self.max_threshold = self.min_threshold
+            self.min_threshold = player_size * 0.5
+            logger.debug(f"Zooming in: size={player_size}, zoom={self.target_zoom}, new min={self.min_threshold}, new max={self.max_threshold}")
+
+        self.zoom += (self.target_zoom - self.zoom) * self.smoothing
+
+    def view_half_extents(self) -> Tuple[float, float]:
+        # World-space half width/height of the screen; while zooming, the wider of current and target view
+        zoom = min(self.zoom, self.target_zoom)
+        return GAME_WIDTH / 2 / zoom, GAME_HEIGHT / 2 / zoom